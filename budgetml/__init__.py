@@ -1 +1,3 @@
 from budgetml.main import BudgetML
+from budgetml.autoscaling import AutoscalingPolicy
+from budgetml.apikey import ApiKey
@@ -0,0 +1,43 @@
+import hashlib
+import re
+from typing import Text
+from uuid import uuid4
+
+
+class ApiKey:
+    def __init__(self,
+                 name: Text,
+                 key: Text = None,
+                 rate_limit: float = None,
+                 burst: float = None,
+                 quota: int = None):
+        """
+        An API key of a launched server, in addition to its token.
+
+        :param name: identifies the key in metrics, letters, digits, `_`,
+        `.` and `-`.
+        :param key: the secret sent as bearer token, generated by default.
+        Only its hash is passed to the server.
+        :param rate_limit: requests per second, the server's
+        `BUDGET_RATE_LIMIT` by default (unlimited).
+        :param burst: requests allowed at once, one second's worth by
+        default.
+        :param quota: requests per day, the server's `BUDGET_QUOTA` by
+        default (unlimited).
+        """
+        assert re.match(r'^[A-Za-z0-9_.-]+$', name), \
+            f'Invalid API key name: {name}'
+        self.name = name
+        self.key = key or uuid4().hex
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.quota = quota
+
+    def to_spec(self) -> Text:
+        """Entry of `BUDGET_API_KEYS`, see server/app/auth.py."""
+        limits = [self.rate_limit, self.burst, self.quota]
+        while limits and limits[-1] is None:
+            limits.pop()
+        digest = hashlib.sha256(self.key.encode()).hexdigest()
+        return ':'.join([f'{self.name}={digest}'] + [
+            '' if limit is None else str(limit) for limit in limits])
@@ -0,0 +1,153 @@
+import json
+import logging
+import math
+import os
+import time
+import urllib.request
+from datetime import datetime
+
+import googleapiclient.discovery
+
+compute = googleapiclient.discovery.build('compute', 'v1')
+
+# Instances stopped on purpose, which the autostarter leaves alone
+LABEL = 'budget-autoscaler'
+STOPPED_LABEL = 'stopped'
+
+RUNNING = ('PROVISIONING', 'STAGING', 'RUNNING')
+
+# API token of the replicas, sent to /load
+TOKEN = os.getenv('BUDGET_TOKEN', '')
+
+
+def list_replicas(project, zones, names):
+    """The replicas and their zones, in the order of `names`."""
+    found = {}
+    for zone in zones:
+        res = compute.instances().list(project=project, zone=zone).execute()
+        for instance in res.get('items', []):
+            if instance['name'] in names:
+                found[instance['name']] = (instance, zone)
+    return [found[name] for name in names if name in found]
+
+
+def get_load(instance, timeout=2):
+    """The load reported by the server of a replica, None if it does not
+    answer, e.g. while booting."""
+    try:
+        ip = instance['networkInterfaces'][0]['accessConfigs'][0]['natIP']
+        req = urllib.request.Request(
+            f'http://{ip}/load',
+            headers={'Authorization': f'Bearer {TOKEN}'})
+        with urllib.request.urlopen(req, timeout=timeout) as res:
+            return json.loads(res.read())
+    except Exception as e:
+        logging.debug(f'No load from {instance["name"]}: {str(e)}')
+        return None
+
+
+def get_timestamp(instance, key):
+    if key not in instance:
+        return 0
+    return datetime.strptime(
+        instance[key], '%Y-%m-%dT%H:%M:%S.%f%z').timestamp()
+
+
+def set_label(project, zone, instance, value):
+    labels = dict(instance.get('labels', {}))
+    if value is None:
+        labels.pop(LABEL, None)
+    else:
+        labels[LABEL] = value
+    compute.instances().setLabels(
+        project=project, zone=zone, instance=instance['name'],
+        body={'labels': labels,
+              'labelFingerprint': instance['labelFingerprint']}).execute()
+
+
+def get_desired(loads, min_replicas, max_replicas, target_concurrency,
+                target_rps):
+    """Replicas needed to keep the concurrency (and optionally the
+    request rate) per replica at its target."""
+    concurrency = sum(load['in_flight'] for load in loads)
+    rps = sum(load['requests_per_second'] for load in loads)
+    desired = math.ceil(concurrency / target_concurrency)
+    if target_rps:
+        desired = max(desired, math.ceil(rps / target_rps))
+    return min(max(desired, min_replicas), max_replicas), concurrency, rps
+
+
+def scale(event, context):
+    project = os.environ['BUDGET_PROJECT']
+    zones = os.environ['BUDGET_ZONES'].split(',')
+    names = os.environ['BUDGET_INSTANCES'].split(',')
+    min_replicas = int(os.getenv('BUDGET_MIN_REPLICAS', '1'))
+    max_replicas = int(os.getenv('BUDGET_MAX_REPLICAS', str(len(names))))
+    target_concurrency = float(os.getenv('BUDGET_TARGET_CONCURRENCY', '4'))
+    target_rps = float(os.getenv('BUDGET_TARGET_RPS', '0'))
+    scale_up_cooldown = float(os.getenv('BUDGET_SCALE_UP_COOLDOWN', '60'))
+    scale_down_cooldown = float(
+        os.getenv('BUDGET_SCALE_DOWN_COOLDOWN', '300'))
+
+    replicas = list_replicas(project, zones, names)
+    running = [(i, z) for i, z in replicas if i['status'] in RUNNING]
+    loads = [load for load in (
+        get_load(i) for i, _ in running if i['status'] == 'RUNNING')
+        if load is not None]
+    desired, concurrency, rps = get_desired(
+        loads, min_replicas, max_replicas, target_concurrency, target_rps)
+
+    now = time.time()
+    last_start = max(
+        [get_timestamp(i, 'lastStartTimestamp') for i, _ in replicas] +
+        [get_timestamp(i, 'creationTimestamp') for i, _ in replicas] + [0])
+    last_stop = max(
+        [get_timestamp(i, 'lastStopTimestamp') for i, _ in replicas] + [0])
+    record = {'current': len(running), 'desired': desired,
+              'concurrency': concurrency, 'requests_per_second': rps,
+              'reporting': len(loads), 'action': None}
+
+    if not loads:
+        # e.g. all booting, or the load endpoint is unreachable
+        record['action'] = 'no_data'
+    elif desired > len(running):
+        if now - last_start < scale_up_cooldown:
+            record['action'] = 'cooldown'
+        else:
+            # the first replicas first, as they are listed first
+            stopped = [(i, z) for i, z in replicas if i['status'] not in
+                       RUNNING and i['status'] != 'STOPPING']
+            started = []
+            for instance, zone in stopped[:desired - len(running)]:
+                set_label(project, zone, instance, None)
+                compute.instances().start(
+                    project=project, zone=zone,
+                    instance=instance['name']).execute()
+                started.append(instance['name'])
+            record['action'] = 'scale_up'
+            record['started'] = started
+    elif desired < len(running):
+        if now - max(last_start, last_stop) < scale_down_cooldown:
+            record['action'] = 'cooldown'
+        elif len(loads) < len(running):
+            # replicas still booting would be counted without their load
+            record['action'] = 'waiting'
+        else:
+            # the last replicas first, never the first one, which runs the
+            # proxy
+            candidates = [(i, z) for i, z in running
+                          if i['name'] != names[0]][::-1]
+            stopped = []
+            for instance, zone in candidates[:len(running) - desired]:
+                # before stopping, as the shutdown script triggers the
+                # autostarter
+                set_label(project, zone, instance, STOPPED_LABEL)
+                compute.instances().stop(
+                    project=project, zone=zone,
+                    instance=instance['name']).execute()
+                stopped.append(instance['name'])
+            record['action'] = 'scale_down'
+            record['stopped'] = stopped
+
+    logging.info(json.dumps(record))
+    return record
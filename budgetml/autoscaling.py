@@ -0,0 +1,48 @@
+from typing import Dict, Text
+
+
+class AutoscalingPolicy:
+    def __init__(self,
+                 min_replicas: int = 1,
+                 max_replicas: int = None,
+                 target_concurrency: float = 4,
+                 target_requests_per_second: float = None,
+                 scale_up_cooldown: float = 60,
+                 scale_down_cooldown: float = 300,
+                 schedule: Text = '* * * * *'):
+        """
+        Bounds and targets for starting and stopping replicas with load.
+
+        :param min_replicas: replicas kept running at all times, at least 1.
+        :param max_replicas: defaults to the number of replicas launched.
+        :param target_concurrency: requests in flight (including queued) per
+        replica to scale to.
+        :param target_requests_per_second: optional request rate per replica
+        to scale to. The larger of the two resulting replica counts wins.
+        :param scale_up_cooldown: seconds after a replica was started before
+        more are started.
+        :param scale_down_cooldown: seconds after a replica was started or
+        stopped before any is stopped.
+        :param schedule: cron schedule of the load checks.
+        """
+        assert min_replicas >= 1 and target_concurrency > 0
+        self.min_replicas = min_replicas
+        self.max_replicas = max_replicas
+        self.target_concurrency = target_concurrency
+        self.target_requests_per_second = target_requests_per_second
+        self.scale_up_cooldown = scale_up_cooldown
+        self.scale_down_cooldown = scale_down_cooldown
+        self.schedule = schedule
+
+    def to_env(self, replicas: int) -> Dict[Text, Text]:
+        """Configuration of the autoscaler cloud function."""
+        return {
+            'BUDGET_MIN_REPLICAS': str(self.min_replicas),
+            # there are no more instances than launched
+            'BUDGET_MAX_REPLICAS': str(
+                min(self.max_replicas or replicas, replicas)),
+            'BUDGET_TARGET_CONCURRENCY': str(self.target_concurrency),
+            'BUDGET_TARGET_RPS': str(self.target_requests_per_second or 0),
+            'BUDGET_SCALE_UP_COOLDOWN': str(self.scale_up_cooldown),
+            'BUDGET_SCALE_DOWN_COOLDOWN': str(self.scale_down_cooldown),
+        }
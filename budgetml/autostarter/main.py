@@ -1,11 +1,32 @@
+import base64
+import json
 import logging
 import os
+import random
 import time
 
 import googleapiclient.discovery
+from googleapiclient.errors import HttpError
 
 compute = googleapiclient.discovery.build('compute', 'v1')
 
+# Statuses in which it is (about to be) up anyway
+RUNNING = ('PROVISIONING', 'STAGING', 'RUNNING')
+
+# Label of instances stopped by the autoscaler, which are left alone
+AUTOSCALER_LABEL = 'budget-autoscaler'
+
+# Errors of a start caused by a lack of capacity in the zone
+CAPACITY_ERRORS = ('ZONE_RESOURCE_POOL_EXHAUSTED',
+                   'ZONE_RESOURCE_POOL_EXHAUSTED_WITH_DETAILS',
+                   'RESOURCE_POOL_EXHAUSTED')
+
+TRANSIENT_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class CapacityError(Exception):
+    pass
+
 
 def start_instance(project, zone, instance_name):
     res = compute.instances().start(
@@ -17,10 +38,167 @@ def start_instance(project, zone, instance_name):
     return res
 
 
+def get_instance(project, zone, instance_name):
+    try:
+        return compute.instances().get(
+            project=project, zone=zone, instance=instance_name).execute()
+    except HttpError as e:
+        if e.resp.status == 404:
+            return None
+        raise
+
+
+def find_instance(project, zones, instance_name):
+    """The instance and its zone, which can be a fallback zone if it was
+    moved before."""
+    for zone in zones:
+        instance = get_instance(project, zone, instance_name)
+        if instance is not None:
+            return instance, zone
+    return None, None
+
+
+def wait_for_operation(project, zone, operation, deadline):
+    delay = 0.5
+    while time.time() < deadline:
+        res = compute.zoneOperations().get(
+            project=project, zone=zone, operation=operation).execute()
+        if res['status'] == 'DONE':
+            errors = res.get('error', {}).get('errors', [])
+            if any(e.get('code') in CAPACITY_ERRORS for e in errors):
+                raise CapacityError(f'No capacity in {zone}: {errors}')
+            if errors:
+                raise RuntimeError(f'Operation {operation} failed: {errors}')
+            return res
+        time.sleep(delay * (0.5 + random.random() / 2))
+        delay = min(delay * 1.5, 5)
+    raise TimeoutError(f'Operation {operation} not done in time')
+
+
+def wait_until_stopped(project, zone, instance_name, deadline):
+    """A preempted instance is STOPPING for up to 30 seconds and can not be
+    started until it is TERMINATED."""
+    delay = 1
+    while time.time() < deadline:
+        instance = get_instance(project, zone, instance_name)
+        if instance is None or instance['status'] != 'STOPPING':
+            return instance
+        time.sleep(delay)
+        delay = min(delay * 1.5, 5)
+    raise TimeoutError(f'{instance_name} still stopping')
+
+
+def move_instance(project, zone, target_zone, instance_name, deadline):
+    logging.warning(f'Moving {instance_name} from {zone} to {target_zone}')
+    res = compute.projects().moveInstance(project=project, body={
+        'targetInstance': f'zones/{zone}/instances/{instance_name}',
+        'destinationZone': f'zones/{target_zone}',
+    }).execute()
+    # a global operation
+    delay = 1
+    while time.time() < deadline:
+        res = compute.globalOperations().get(
+            project=project, operation=res['name']).execute()
+        if res['status'] == 'DONE':
+            if 'error' in res:
+                raise RuntimeError(f'Moving {instance_name} failed: '
+                                   f'{res["error"]}')
+            return res
+        time.sleep(delay)
+        delay = min(delay * 1.5, 5)
+    raise TimeoutError(f'Moving {instance_name} not done in time')
+
+
+def recover(project, zones, instance_name, deadline, retries=5):
+    """
+    Starts an instance if it is stopped. Transient errors are retried with
+    backoff. If its zone has no capacity, the instance is moved to the next
+    of the fallback zones.
+
+    :return: tuple of the zone it runs in, whether it had to be started and
+    the number of start attempts.
+    """
+    instance, zone = find_instance(project, zones, instance_name)
+    if instance is None:
+        raise ValueError(f'Instance {instance_name} not found in {zones}')
+    if instance['status'] in RUNNING:
+        return zone, False, 0
+    if instance.get('labels', {}).get(AUTOSCALER_LABEL) == 'stopped':
+        logging.info(f'{instance_name} was stopped by the autoscaler')
+        return zone, False, 0
+    if instance['status'] == 'STOPPING':
+        wait_until_stopped(project, zone, instance_name, deadline)
+
+    candidates = [zone] + [z for z in zones if z != zone]
+    attempt = 0
+    delay = 1
+    while True:
+        attempt += 1
+        try:
+            try:
+                operation = start_instance(project, zone, instance_name)
+            except HttpError as e:
+                if any(code in str(e) for code in CAPACITY_ERRORS):
+                    raise CapacityError(f'No capacity in {zone}: {str(e)}')
+                raise
+            wait_for_operation(project, zone, operation['name'], deadline)
+            return zone, True, attempt
+        except CapacityError as e:
+            logging.warning(str(e))
+            candidates.remove(zone)
+            if not candidates:
+                raise
+            move_instance(
+                project, zone, candidates[0], instance_name, deadline)
+            zone = candidates[0]
+        except HttpError as e:
+            if e.resp.status not in TRANSIENT_STATUS_CODES or \
+                    attempt > retries:
+                raise
+            logging.warning(f'Starting {instance_name} failed with: '
+                            f'{str(e)}. Retrying in {delay}s')
+            time.sleep(delay * (0.5 + random.random() / 2))
+            delay *= 2
+        if time.time() > deadline:
+            raise TimeoutError(f'{instance_name} not started in time')
+
+
 def launch(event, context):
     project = os.environ['BUDGET_PROJECT']
     zone = os.environ['BUDGET_ZONE']
-    instance = os.environ['BUDGET_INSTANCE']
+    instances = os.getenv(
+        'BUDGET_INSTANCES', os.environ['BUDGET_INSTANCE']).split(',')
+    fallback_zones = [z for z in os.getenv(
+        'BUDGET_FALLBACK_ZONES', '').split(',') if z]
+    # Stay within the function's timeout
+    deadline = time.time() + float(
+        os.getenv('BUDGET_RECOVERY_TIMEOUT', '180'))
+
+    # The shutdown script of an instance names itself in the message, the
+    # scheduler job does not and all stopped instances are started
+    data = {}
+    if event.get('data'):
+        data = json.loads(base64.b64decode(event['data']).decode() or '{}')
+    if data.get('instance') in instances:
+        instances = [data['instance']]
 
-    time.sleep(10)
-    start_instance(project, zone, instance)
+    for instance in instances:
+        start = time.time()
+        # Same format as the boot timeline on the instance, to line up the
+        # two in the logs
+        record = {'phase': 'autostart', 'time': start, 'instance': instance,
+                  'source': 'autostarter'}
+        try:
+            running_zone, started, attempts = recover(
+                project, [zone] + fallback_zones, instance, deadline)
+            record.update(
+                zone=running_zone, started=started, attempts=attempts)
+        except Exception as e:
+            record.update(started=False, error=str(e))
+            logging.exception(f'Recovering {instance} failed')
+        record['recovery_seconds'] = round(time.time() - start, 3)
+        if data.get('time') and data.get('instance') == instance:
+            # From the shutdown script run to the instance being started
+            record['downtime_seconds'] = round(
+                time.time() - float(data['time']), 3)
+        logging.info(json.dumps(record))
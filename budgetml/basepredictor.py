@@ -1,5 +1,5 @@
 from abc import abstractmethod
-from typing import Union, Any
+from typing import Union, Any, List, Dict, Text
 
 from fastapi import UploadFile
 from starlette.requests import Request
@@ -7,6 +7,22 @@ from starlette.responses import Response
 
 
 class BasePredictor:
+    # Files the predictor needs, as a mapping of name to gs:// path. They are
+    # downloaded (or taken from the local cache) before `load` is called, and
+    # their local paths are available as `self.artifact_paths[name]`.
+    artifacts: Dict[Text, Text] = {}
+
+    # Set to True if `predict` always returns the same output for the same
+    # `/predict_dict/` payload, to let the server cache responses.
+    cacheable: bool = False
+
+    # Sample `/predict_dict/` payloads, sent through `predict` in each worker
+    # at startup so that the first real requests do not pay for lazy
+    # initialization, e.g. JIT compilation or weights paged in on first use.
+    # A predictor may instead define `warmup(self, requests)`, which then
+    # gets them as Payload objects and is run like `predict`.
+    warmup_payloads: List[Dict] = []
+
     def load(self):
         """Called once during each worker initialization. Performs
         setup such as downloading/initializing the model or downloading a
@@ -14,13 +30,44 @@ class BasePredictor:
         """
         pass
 
+    def post_fork(self):
+        """Called once in each worker if the server runs with
+        `BUDGET_PRELOAD=1`. `load` then only runs once in the parent process
+        and the workers share its memory. Use this to re-create anything that
+        does not survive a fork, e.g. threads or network sessions.
+        """
+        pass
+
+    def unload(self):
+        """Called before the server evicts the predictor, when it is one of
+        several models served by the same server. Use this to free memory
+        the garbage collector does not, e.g. on the GPU.
+        """
+        pass
+
     @abstractmethod
     async def predict(self,
                       request: Union[
                           Request, UploadFile, Any]) -> Response:
         """Responsible for running the inference.
 
+        Can also be written as an async generator (using `yield`), in which
+        case the server streams the yielded chunks to the client as they are
+        produced.
+
         Args:
             request (required): The request from the server client
         """
         pass
+
+    async def predict_batch(self, requests: List[Any]) -> List[Any]:
+        """Runs the inference on a batch of `/predict_dict/` requests.
+
+        Only used when the server runs with `BUDGET_MAX_BATCH_SIZE` > 1.
+        Override it to push the whole batch through the model at once. The
+        returned list must have one response per request, in order.
+
+        Args:
+            requests (required): A list of Payload objects
+        """
+        return [await self.predict(request) for request in requests]
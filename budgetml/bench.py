@@ -0,0 +1,264 @@
+import importlib.util
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Text
+
+import requests
+
+from budgetml import bench_predictors
+
+ROUTES = ['/predict_dict/', '/predict_image/', '/predict/']
+PREDICTORS = {
+    'sleep': 'SleepPredictor',
+    'cpu': 'CPUPredictor',
+    'large': 'LargePayloadPredictor',
+}
+# Installed as budgetml.server, see setup.py, otherwise that of a source
+# checkout
+DEFAULT_APP_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'server')
+if not os.path.exists(os.path.join(DEFAULT_APP_DIR, 'main.py')):
+    DEFAULT_APP_DIR = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'server', 'app')
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile of already sorted values."""
+    if not values:
+        return None
+    index = max(int(round(p / 100 * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class LocalServer:
+    def __init__(self,
+                 predictor: Text = 'sleep',
+                 app_dir: Text = DEFAULT_APP_DIR,
+                 latency_ms: float = 10,
+                 response_bytes: int = 1048576,
+                 env: Dict[Text, Text] = None):
+        """
+        Runs the BudgetML server with a stub predictor in a subprocess, so
+        that it does not compete with the load generator for the GIL.
+
+        :param predictor: one of `sleep`, `cpu` or `large`.
+        :param app_dir: path to the server's `app` directory.
+        :param latency_ms: latency of the `sleep` and `cpu` predictors.
+        :param response_bytes: response size of the `large` predictor.
+        :param env: additional server environment, e.g. BUDGET_* settings.
+        """
+        if not os.path.exists(os.path.join(app_dir, 'main.py')):
+            raise FileNotFoundError(
+                f'No server found in {app_dir}. Pass the path to the '
+                f'server/app directory, or benchmark a running server by '
+                f'its URL.')
+        for module in ('fastapi', 'uvicorn'):
+            if importlib.util.find_spec(module) is None:
+                raise ImportError(
+                    f'{module} is needed to run the server locally, '
+                    f'install it with: pip install budgetml[bench]')
+        self.app_dir = app_dir
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.username = 'bench'
+        self.password = 'bench'
+        self.env = dict(os.environ)
+        self.env.update({
+            'BUDGET_PREDICTOR_PATH': bench_predictors.__file__,
+            'BUDGET_PREDICTOR_ENTRYPOINT': PREDICTORS[predictor],
+            'BUDGET_USERNAME': self.username,
+            'BUDGET_PWD': self.password,
+            'BUDGET_TOKEN': 'bench',
+            'BUDGET_BENCH_LATENCY_MS': str(latency_ms),
+            'BUDGET_BENCH_RESPONSE_BYTES': str(response_bytes),
+        })
+        self.env.update(env or {})
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'main:app',
+             '--app-dir', self.app_dir, '--port', str(self.port),
+             '--log-level', 'warning'],
+            env=self.env)
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            try:
+                requests.get(self.url, timeout=1)
+                return self
+            except requests.ConnectionError:
+                if self.process.poll() is not None:
+                    raise RuntimeError('Benchmark server failed to start')
+                time.sleep(0.1)
+        self.__exit__()
+        raise TimeoutError('Benchmark server did not come up within 30s')
+
+    def __exit__(self, *args):
+        self.process.terminate()
+        self.process.wait()
+
+
+def get_token(url: Text, username: Text, password: Text) -> Text:
+    res = requests.post(f'{url}/token',
+                        data={'username': username, 'password': password})
+    res.raise_for_status()
+    return res.json()['access_token']
+
+
+def make_request_kwargs(route: Text, payload_bytes: int) -> Dict:
+    data = 'x' * payload_bytes
+    if route == '/predict_dict/':
+        return {'json': {'payload': {'data': data}}}
+    if route == '/predict_image/':
+        return {'files': {'request': ('bench.bin', data.encode())}}
+    return {'data': data.encode()}
+
+
+def run_route(url: Text,
+              token: Text,
+              route: Text,
+              concurrency: int = 8,
+              duration: float = 10,
+              payload_bytes: int = 1024) -> Dict:
+    """Drives closed-loop load: `concurrency` clients each send their next
+    request as soon as the previous one finished."""
+    kwargs = make_request_kwargs(route, payload_bytes)
+    headers = {'Authorization': f'Bearer {token}'}
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    end = time.perf_counter() + duration
+
+    def client():
+        session = requests.Session()
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            try:
+                res = session.post(url + route, headers=headers, **kwargs)
+                error = None if res.ok else res.status_code
+            except requests.RequestException as e:
+                error = type(e).__name__
+            elapsed = time.perf_counter() - start
+            with lock:
+                if error is None:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(error)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    total = len(latencies) + len(errors)
+    return {
+        'route': route,
+        'concurrency': concurrency,
+        'payload_bytes': payload_bytes,
+        'requests': total,
+        'errors': len(errors),
+        'error_rate': len(errors) / total if total else 0,
+        'error_codes': sorted({str(e) for e in errors}),
+        'throughput_rps': len(latencies) / elapsed,
+        'latency_ms': {
+            name: None if value is None else value * 1000
+            for name, value in [
+                ('p50', percentile(latencies, 50)),
+                ('p95', percentile(latencies, 95)),
+                ('p99', percentile(latencies, 99)),
+                ('max', latencies[-1] if latencies else None),
+            ]
+        },
+    }
+
+
+def format_report(results: List[Dict]) -> Text:
+    def ms(value):
+        return '-' if value is None else f'{value:.1f}'
+
+    lines = [f'{"route":<16}{"rps":>10}{"p50 ms":>10}{"p95 ms":>10}'
+             f'{"p99 ms":>10}{"errors":>10}']
+    for r in results:
+        lines.append(
+            f'{r["route"]:<16}{r["throughput_rps"]:>10.1f}'
+            f'{ms(r["latency_ms"]["p50"]):>10}'
+            f'{ms(r["latency_ms"]["p95"]):>10}'
+            f'{ms(r["latency_ms"]["p99"]):>10}'
+            f'{r["error_rate"]:>10.1%}')
+    return '\n'.join(lines)
+
+
+def bench(url: Text = None,
+          routes: List[Text] = None,
+          predictor: Text = 'sleep',
+          concurrency: int = 8,
+          duration: float = 10,
+          payload_bytes: int = 1024,
+          latency_ms: float = 10,
+          response_bytes: int = 1048576,
+          username: Text = None,
+          password: Text = None,
+          token: Text = None,
+          app_dir: Text = DEFAULT_APP_DIR,
+          server_env: Dict[Text, Text] = None,
+          output: Text = None) -> Dict:
+    """
+    Benchmarks the predict routes of a server.
+
+    Without `url`, a local server with a stub predictor is started, which
+    needs no GCP access. With `url`, an already deployed server is used and
+    `token` or `username`/`password` are required.
+
+    :return: dict with the settings and one result per route. Also written
+    as JSON to `output` if given, to track regressions between releases.
+    """
+    routes = routes or ROUTES
+    settings = {
+        'url': url,
+        'predictor': None if url else predictor,
+        'concurrency': concurrency,
+        'duration': duration,
+        'payload_bytes': payload_bytes,
+        'latency_ms': None if url else latency_ms,
+        'server_env': None if url else server_env,
+    }
+
+    def run(url, token):
+        results = []
+        for route in routes:
+            logging.info(f'Benchmarking {route} for {duration}s')
+            results.append(run_route(
+                url, token, route, concurrency, duration, payload_bytes))
+        return results
+
+    if url is None:
+        with LocalServer(predictor, app_dir, latency_ms, response_bytes,
+                         server_env) as server:
+            token = get_token(server.url, server.username, server.password)
+            results = run(server.url, token)
+    else:
+        if token is None:
+            token = get_token(url, username, password)
+        results = run(url.rstrip('/'), token)
+
+    report = {'settings': settings, 'results': results}
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
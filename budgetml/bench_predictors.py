@@ -0,0 +1,59 @@
+"""Stub predictors used by `budgetml bench`.
+
+This file is loaded by the server as a standalone predictor source, so it
+must not import anything from budgetml. The stubs are configured through
+environment variables set by the benchmark.
+"""
+import asyncio
+import os
+import time
+
+LATENCY_MS = float(os.getenv('BUDGET_BENCH_LATENCY_MS', '10'))
+RESPONSE_BYTES = int(os.getenv('BUDGET_BENCH_RESPONSE_BYTES', '1048576'))
+
+
+async def _consume(request):
+    # Read the body the way a real predictor would, whatever the route
+    if hasattr(request, 'payload'):
+        return request.payload
+    if hasattr(request, 'read'):
+        return await request.read()
+    return await request.body()
+
+
+class SleepPredictor:
+    """Fixed latency without using the CPU, like waiting on a remote
+    model. Measures pure framework overhead."""
+
+    def load(self):
+        pass
+
+    async def predict(self, request):
+        await _consume(request)
+        await asyncio.sleep(LATENCY_MS / 1000)
+        return {'ok': True}
+
+
+class CPUPredictor:
+    """Blocks the CPU for a fixed time, like local inference. Being
+    synchronous, it runs in the server's executor."""
+
+    def load(self):
+        pass
+
+    def predict(self, request):
+        end = time.perf_counter() + LATENCY_MS / 1000
+        while time.perf_counter() < end:
+            pass
+        return {'ok': True}
+
+
+class LargePayloadPredictor:
+    """Returns a large response. Measures serialization and transfer."""
+
+    def load(self):
+        self.data = 'x' * RESPONSE_BYTES
+
+    async def predict(self, request):
+        await _consume(request)
+        return {'data': self.data}
@@ -0,0 +1,83 @@
+import argparse
+import json
+import logging
+
+from budgetml.bench import DEFAULT_APP_DIR, PREDICTORS, ROUTES, bench, \
+    format_report
+
+
+def parse_env(values):
+    env = {}
+    for value in values or []:
+        key, _, val = value.partition('=')
+        env[key] = val
+    return env
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='budgetml')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    bench_parser = subparsers.add_parser(
+        'bench',
+        help='Load test the predict routes of a local or deployed server.')
+    bench_parser.add_argument(
+        '--url', help='Server to benchmark. If omitted, a local server with '
+                      'a stub predictor is started.')
+    bench_parser.add_argument(
+        '--route', action='append', choices=ROUTES, dest='routes',
+        help='Route to benchmark, can be repeated. Defaults to all.')
+    bench_parser.add_argument(
+        '--predictor', choices=sorted(PREDICTORS), default='sleep',
+        help='Stub predictor of the local server.')
+    bench_parser.add_argument('--concurrency', type=int, default=8)
+    bench_parser.add_argument(
+        '--duration', type=float, default=10, help='Seconds per route.')
+    bench_parser.add_argument(
+        '--payload-bytes', type=int, default=1024, help='Request size.')
+    bench_parser.add_argument(
+        '--latency-ms', type=float, default=10,
+        help='Latency of the sleep and cpu stub predictors.')
+    bench_parser.add_argument(
+        '--response-bytes', type=int, default=1048576,
+        help='Response size of the large stub predictor.')
+    bench_parser.add_argument('--username')
+    bench_parser.add_argument('--password')
+    bench_parser.add_argument('--token')
+    bench_parser.add_argument(
+        '--app-dir', default=DEFAULT_APP_DIR,
+        help='Path to server/app for the local server.')
+    bench_parser.add_argument(
+        '--env', action='append', metavar='KEY=VALUE',
+        help='Environment of the local server, e.g. '
+             'BUDGET_MAX_BATCH_SIZE=8. Can be repeated.')
+    bench_parser.add_argument(
+        '--output', help='Write the results as JSON to this file.')
+
+    args = parser.parse_args(args)
+    if args.command == 'bench':
+        logging.getLogger().setLevel(logging.INFO)
+        report = bench(
+            url=args.url,
+            routes=args.routes,
+            predictor=args.predictor,
+            concurrency=args.concurrency,
+            duration=args.duration,
+            payload_bytes=args.payload_bytes,
+            latency_ms=args.latency_ms,
+            response_bytes=args.response_bytes,
+            username=args.username,
+            password=args.password,
+            token=args.token,
+            app_dir=args.app_dir,
+            server_env=parse_env(args.env),
+            output=args.output,
+        )
+        print(format_report(report['results']))
+        if args.output is None:
+            print(json.dumps(report['settings']))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,8 @@ __version__ = '0.1.3'
 APP_NAME = 'budgetml'
 BUDGET_NGINX_PATH = os.getenv('BUDGET_NGINX_PATH', './nginx.conf')
 BUDGET_CERTS_PATH = os.getenv('BUDGET_CERTS_PATH', './certs/')
+# On the instance, shared by the startup/shutdown scripts and the server
+BUDGET_BOOT_TIMELINE_PATH = '/home/budgetml/boot/timeline.jsonl'
 
 BUDGETML_REGISTRY = 'us.gcr.io/budgetml'
 BUDGETML_BASE_IMAGE_NAME = f'{BUDGETML_REGISTRY}/budgetml:base-{__version__}'
\ No newline at end of file
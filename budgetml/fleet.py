@@ -0,0 +1,77 @@
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable
+
+from google.api_core import exceptions as api_exceptions
+from googleapiclient.errors import HttpError
+
+from budgetml.steps import StepError
+
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        Token bucket shared between threads.
+
+        :param rate: calls allowed per second on average.
+        :param burst: calls allowed at once after being idle.
+        """
+        assert rate > 0 and burst > 0
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a call is allowed."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether an error of a GCP call is worth retrying (quota, overload,
+    network), as opposed to e.g. invalid arguments."""
+    if isinstance(error, StepError):
+        error = error.error
+    if isinstance(error, HttpError):
+        return error.resp.status in TRANSIENT_STATUS_CODES
+    if isinstance(error, api_exceptions.GoogleAPICallError):
+        return error.code in TRANSIENT_STATUS_CODES
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+def retry(fn: Callable[[], Any],
+          retries: int = 3,
+          initial_delay: float = 5,
+          factor: float = 2) -> Any:
+    """Calls `fn`, retrying transient errors with jittered exponential
+    backoff.
+
+    :return: tuple of the result and the number of attempts.
+    """
+    delay = initial_delay
+    for attempt in range(1, retries + 2):
+        try:
+            return fn(), attempt
+        except Exception as e:
+            if attempt > retries or not is_transient(e):
+                raise
+            sleep = delay * (0.5 + random.random() / 2)
+            logging.warning(f'Attempt {attempt} failed with: {str(e)}. '
+                            f'Retrying in {sleep:.0f}s')
+            time.sleep(sleep)
+            delay *= factor
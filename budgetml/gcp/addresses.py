@@ -1,5 +1,8 @@
 import logging
-import time
+
+from googleapiclient.errors import HttpError
+
+from budgetml.gcp.utils import wait_for_region_operation
 
 
 def promote_ephemeral_ip(
@@ -28,12 +31,19 @@ def create_static_ip(compute, project, region, static_ip_name):
     config = {
         'name': static_ip_name
     }
-    compute.addresses().insert(
-        project=project,
-        region=region,
-        body=config).execute()
-
-    time.sleep(3)
+    try:
+        operation = compute.addresses().insert(
+            project=project,
+            region=region,
+            body=config).execute()
+        # The address is only reserved once the operation is done
+        wait_for_region_operation(
+            compute, project, region, operation['name'])
+    except HttpError as e:
+        # Reserved already, e.g. by a previous attempt of a retried launch
+        if e.resp.status != 409:
+            raise
+        logging.info(f'Static IP {static_ip_name} exists already')
 
     req = compute.addresses().get(
         project=project,
@@ -44,11 +54,42 @@ def create_static_ip(compute, project, region, static_ip_name):
     return res
 
 
-def release_static_ip(compute, project, region, static_ip):
+def create_internal_ip(compute, project, region, address_name,
+                       subnetwork='default'):
+    """Reserves an internal address, which an instance keeps across
+    restarts, e.g. to be listed in a load balancer's upstream pool."""
+    config = {
+        'name': address_name,
+        'addressType': 'INTERNAL',
+        'subnetwork': f'regions/{region}/subnetworks/{subnetwork}',
+    }
+    try:
+        operation = compute.addresses().insert(
+            project=project,
+            region=region,
+            body=config).execute()
+        wait_for_region_operation(
+            compute, project, region, operation['name'])
+    except HttpError as e:
+        if e.resp.status != 409:
+            raise
+        logging.info(f'Internal IP {address_name} exists already')
+
+    res = compute.addresses().get(
+        project=project,
+        region=region,
+        address=address_name).execute()
+    logging.debug(f'Internal IP {address_name} created with response: {res}')
+    return res
+
+
+def release_static_ip(compute, project, region, static_ip, wait=True):
     req = compute.addresses().delete(
         project=project,
         region=region,
         address=static_ip)
     res = req.execute()
+    if wait:
+        res = wait_for_region_operation(compute, project, region, res['name'])
     logging.debug(f'Static IP {static_ip} deleted with response: {res}')
     return res
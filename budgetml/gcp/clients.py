@@ -0,0 +1,92 @@
+"""Process-wide registry of GCP API clients.
+
+Every client is built once and then reused, together with its HTTP
+connections and auth tokens. Discovery based clients (compute,
+cloudfunctions) rely on httplib2, which is not thread-safe, so they are kept
+per thread, but share one in-memory copy of each discovery document.
+
+Tests can swap any client for a fake with `set_client`.
+"""
+import threading
+from typing import Any, Callable, Dict, Text
+
+import googleapiclient.discovery
+from google.cloud import pubsub_v1, scheduler, storage
+from googleapiclient.discovery_cache.base import Cache
+
+_LOCK = threading.Lock()
+_CLIENTS: Dict[Text, Any] = {}
+_OVERRIDES: Dict[Text, Any] = {}
+_THREAD_CLIENTS = threading.local()
+
+
+class _MemoryCache(Cache):
+    def __init__(self):
+        self.documents = {}
+
+    def get(self, url):
+        return self.documents.get(url)
+
+    def set(self, url, content):
+        self.documents[url] = content
+
+
+_DISCOVERY_CACHE = _MemoryCache()
+
+
+def set_client(key: Text, client: Any):
+    """Overrides the client for `key` (e.g. `storage`, `compute`) in all
+    threads, e.g. with a local fake."""
+    _OVERRIDES[key] = client
+
+
+def reset():
+    """Drops all cached clients and overrides."""
+    with _LOCK:
+        _CLIENTS.clear()
+        _OVERRIDES.clear()
+    _THREAD_CLIENTS.__dict__.clear()
+
+
+def _shared(key: Text, factory: Callable[[], Any]) -> Any:
+    if key in _OVERRIDES:
+        return _OVERRIDES[key]
+    if key not in _CLIENTS:
+        with _LOCK:
+            if key not in _CLIENTS:
+                _CLIENTS[key] = factory()
+    return _CLIENTS[key]
+
+
+def get_discovery_client(api: Text, version: Text = 'v1') -> Any:
+    key = f'{api}/{version}'
+    if key in _OVERRIDES:
+        return _OVERRIDES[key]
+    if api in _OVERRIDES:
+        return _OVERRIDES[api]
+    client = getattr(_THREAD_CLIENTS, key, None)
+    if client is None:
+        client = googleapiclient.discovery.build(
+            api, version, cache=_DISCOVERY_CACHE)
+        setattr(_THREAD_CLIENTS, key, client)
+    return client
+
+
+def get_compute() -> Any:
+    return get_discovery_client('compute', 'v1')
+
+
+def get_functions() -> Any:
+    return get_discovery_client('cloudfunctions', 'v1')
+
+
+def get_storage_client() -> Any:
+    return _shared('storage', storage.Client)
+
+
+def get_publisher_client() -> Any:
+    return _shared('publisher', pubsub_v1.PublisherClient)
+
+
+def get_scheduler_client() -> Any:
+    return _shared('scheduler', scheduler.CloudSchedulerClient)
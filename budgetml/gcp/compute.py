@@ -17,6 +17,8 @@
 
 import logging
 
+from budgetml.gcp.utils import wait_for_operation
+
 
 def list_instances(compute, project, zone):
     result = compute.instances().list(project=project, zone=zone).execute()
@@ -27,11 +29,16 @@ def create_instance(compute, project, zone, static_ip, instance_name,
                     machine_type, startup_script, shutdown_script,
                     preemptible, requirements_content,
                     docker_template_content, docker_compose_content,
-                    nginx_conf_content):
-    # Get the latest Debian Jessie image.
-    image_response = compute.images().getFromFamily(
-        project='ubuntu-os-cloud', family='ubuntu-1804-lts').execute()
-    source_disk_image = image_response['selfLink']
+                    nginx_conf_content, wait=True, source_image=None,
+                    network_ip=None):
+    if source_image is not None:
+        # e.g. an image with docker and the serving images preinstalled
+        source_disk_image = source_image
+    else:
+        # Get the latest Debian Jessie image.
+        image_response = compute.images().getFromFamily(
+            project='ubuntu-os-cloud', family='ubuntu-1804-lts').execute()
+        source_disk_image = image_response['selfLink']
 
     # Configure the machine
     machine_type_full = f"zones/{zone}/machineTypes/{machine_type}"
@@ -114,19 +121,32 @@ def create_instance(compute, project, zone, static_ip, instance_name,
         }
     }
 
+    if static_ip is None:
+        # an ephemeral external address, e.g. for replicas
+        del config['networkInterfaces'][0]['accessConfigs'][0]['natIP']
+    if network_ip is not None:
+        # a reserved internal address
+        config['networkInterfaces'][0]['networkIP'] = network_ip
+
     logging.debug(f"Creating instance: {config}")
 
-    return compute.instances().insert(
+    operation = compute.instances().insert(
         project=project,
         zone=zone,
         body=config).execute()
+    if wait:
+        return wait_for_operation(compute, project, zone, operation['name'])
+    return operation
 
 
-def delete_instance(compute, project, zone, name):
-    return compute.instances().delete(
+def delete_instance(compute, project, zone, name, wait=True):
+    operation = compute.instances().delete(
         project=project,
         zone=zone,
         instance=name).execute()
+    if wait:
+        return wait_for_operation(compute, project, zone, operation['name'])
+    return operation
 
 
 def get_instance(compute, project, zone, instance_name):
@@ -3,15 +3,16 @@ import os
 import zipfile
 from tempfile import TemporaryFile
 
-import googleapiclient.discovery
 import requests
 
 from budgetml import autostarter
+from budgetml.gcp.clients import get_functions
+from budgetml.gcp.operations import FUNCTION, Operation, OperationPoller
 from budgetml.gcp.pubsub import create_topic
 
 
 def get_api():
-    service = googleapiclient.discovery.build('cloudfunctions', 'v1')
+    service = get_functions()
     cloud_functions_api = service.projects().locations().functions()
     return cloud_functions_api
 
@@ -24,7 +25,7 @@ def zipdir(path, ziph):
                 ziph.write(os.path.join(root, file), file)
 
 
-def create_upload_url(parent):
+def create_upload_url(parent, source=autostarter):
     upload_url = \
         get_api().generateUploadUrl(parent=parent,
                                     body={}).execute()[
@@ -33,7 +34,7 @@ def create_upload_url(parent):
 
     with TemporaryFile() as data:
         with zipfile.ZipFile(data, 'w', zipfile.ZIP_DEFLATED) as archive:
-            zipdir(autostarter.__path__[0], archive)
+            zipdir(source.__path__[0], archive)
         data.seek(0)
         headers = {
             'content-type': 'application/zip',
@@ -51,23 +52,39 @@ def create_cloud_function(
         instance_zone,
         instance_name,
         topic,
-        timeout=200):
+        timeout=200,
+        create_pubsub_topic=True,
+        instance_names=None,
+        fallback_zones=None,
+        source=autostarter,
+        entry_point='launch',
+        environment=None):
     # create pubsub topic
-    full_topic = create_topic(project, topic)
+    if create_pubsub_topic:
+        full_topic = create_topic(project, topic)
+    else:
+        full_topic = f'projects/{project}/topics/{topic}'
 
     parent = 'projects/{}/locations/{}'.format(project, region)
 
-    upload_url = create_upload_url(parent)
+    upload_url = create_upload_url(parent, source)
     config = {
         "name": parent + '/functions/' + function_name,
-        "entryPoint": "launch",
+        "entryPoint": entry_point,
         "runtime": "python37",
         "availableMemoryMb": 128,
         "timeout": f"{timeout}s",
         "environmentVariables": {
             "BUDGET_PROJECT": project,
             "BUDGET_ZONE": instance_zone,
-            "BUDGET_INSTANCE": instance_name
+            "BUDGET_INSTANCE": instance_name,
+            # A shared function restarts all instances of a fleet
+            "BUDGET_INSTANCES": ','.join(instance_names or [instance_name]),
+            # Zones of the region to move instances to if theirs is full
+            "BUDGET_FALLBACK_ZONES": ','.join(fallback_zones or []),
+            # Leaves time to log before the function is killed
+            "BUDGET_RECOVERY_TIMEOUT": str(max(timeout - 20, 10)),
+            **(environment or {}),
         },
         "sourceUploadUrl": upload_url,
         "eventTrigger": {
@@ -84,6 +101,12 @@ def create_cloud_function(
     return res
 
 
+def wait_for_function_operation(operation_name, timeout=600):
+    logging.debug(f'Waiting for function operation {operation_name}...')
+    return OperationPoller().wait(
+        Operation(operation_name, FUNCTION), timeout)
+
+
 def delete_cloud_function(project, region, function_name):
     parent = 'projects/{}/locations/{}'.format(project, region)
     full_name = f'{parent}/functions/{function_name}'
@@ -0,0 +1,80 @@
+import logging
+import time
+
+from budgetml.gcp.compute import delete_instance, get_instance
+from budgetml.gcp.operations import GLOBAL, Operation, OperationPoller
+from budgetml.gcp.utils import wait_for_operation
+
+
+def get_boot_image(compute, project, image_name):
+    """Self link of a disk image. `image_name` can also be `family/<name>`
+    for the latest image of a family."""
+    if image_name.startswith('family/'):
+        return compute.images().getFromFamily(
+            project=project, family=image_name[len('family/'):]).execute()[
+            'selfLink']
+    return compute.images().get(
+        project=project, image=image_name).execute()['selfLink']
+
+
+def create_boot_image(compute, project, zone, image_name, setup_script,
+                      family='budgetml', machine_type='e2-medium',
+                      timeout=1800):
+    """
+    Creates a disk image by running `setup_script` on a temporary instance,
+    which has to power itself off when it is done, e.g. with
+    `shutdown -h now`.
+
+    :return: the self link of the created image.
+    """
+    builder = f'{image_name}-builder'
+    source_image = compute.images().getFromFamily(
+        project='ubuntu-os-cloud', family='ubuntu-1804-lts').execute()[
+        'selfLink']
+    config = {
+        'name': builder,
+        'machineType': f'zones/{zone}/machineTypes/{machine_type}',
+        'disks': [{
+            'boot': True,
+            'diskSizeGb': '100',
+            'autoDelete': True,
+            'initializeParams': {'sourceImage': source_image},
+        }],
+        'networkInterfaces': [{
+            'network': 'global/networks/default',
+            'accessConfigs': [
+                {'type': 'ONE_TO_ONE_NAT', 'name': 'External NAT'}
+            ]
+        }],
+        'serviceAccounts': [{
+            'email': 'default',
+            'scopes': ['https://www.googleapis.com/auth/cloud-platform'],
+        }],
+        'metadata': {
+            'items': [{'key': 'startup-script', 'value': setup_script}]
+        },
+    }
+    operation = compute.instances().insert(
+        project=project, zone=zone, body=config).execute()
+    wait_for_operation(compute, project, zone, operation['name'])
+
+    try:
+        logging.info(f'Waiting for {builder} to finish its setup..')
+        deadline = time.time() + timeout
+        while get_instance(compute, project, zone, builder)[
+                'status'] != 'TERMINATED':
+            if time.time() > deadline:
+                raise TimeoutError(f'{builder} not done in time')
+            time.sleep(15)
+
+        operation = compute.images().insert(project=project, body={
+            'name': image_name,
+            'family': family,
+            'sourceDisk': f'zones/{zone}/disks/{builder}',
+        }).execute()
+        OperationPoller(compute=compute).wait(
+            Operation(operation['name'], GLOBAL, project), timeout)
+    finally:
+        delete_instance(compute, project, zone, builder, wait=False)
+
+    return get_boot_image(compute, project, image_name)
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Dict, List, Text
+
+from budgetml.gcp.clients import get_compute, get_functions
+
+ZONE = 'zone'
+REGION = 'region'
+GLOBAL = 'global'
+FUNCTION = 'function'
+
+# Operations per batched status request
+BATCH_SIZE = 500
+
+
+class OperationCancelled(Exception):
+    pass
+
+
+class OperationError(Exception):
+    def __init__(self, operation: 'Operation', error: Dict):
+        super().__init__(f'Operation {operation.name} failed with: {error}')
+        self.operation = operation
+        self.error = error
+
+
+class Operation:
+    def __init__(self,
+                 name: Text,
+                 kind: Text = ZONE,
+                 project: Text = None,
+                 location: Text = None):
+        """
+        A long-running GCP operation.
+
+        :param name: operation name (for cloud functions the full name).
+        :param kind: one of `zone`, `region`, `global` or `function`.
+        :param project: (gcp) project_id, not needed for cloud functions.
+        :param location: zone or region, for the respective kinds.
+        """
+        assert kind in (ZONE, REGION, GLOBAL, FUNCTION)
+        self.name = name
+        self.kind = kind
+        self.project = project
+        self.location = location
+        self.result = None
+
+    @classmethod
+    def from_compute(cls, project: Text, res: Dict) -> 'Operation':
+        """Creates an Operation from a compute API response, e.g. of
+        instances().insert()."""
+        if 'zone' in res:
+            return cls(res['name'], ZONE, project,
+                       res['zone'].split('/')[-1])
+        if 'region' in res:
+            return cls(res['name'], REGION, project,
+                       res['region'].split('/')[-1])
+        return cls(res['name'], GLOBAL, project)
+
+    @property
+    def done(self) -> bool:
+        if self.result is None:
+            return False
+        if self.kind == FUNCTION:
+            return self.result.get('done', False)
+        return self.result['status'] == 'DONE'
+
+    def __repr__(self):
+        return f'Operation({self.kind}, {self.name})'
+
+
+class OperationPoller:
+    def __init__(self,
+                 compute=None,
+                 functions=None,
+                 initial_delay: float = 0.5,
+                 max_delay: float = 10,
+                 factor: float = 1.5,
+                 jitter: float = 0.5,
+                 timeout: float = 600):
+        """
+        Waits for long-running operations, polling their status with
+        jittered exponential backoff. Many operations are polled together
+        with one batched HTTP request per API.
+
+        :param compute: compute API client, shared one if not given.
+        :param functions: cloudfunctions API client, shared one if not
+        given.
+        :param initial_delay: seconds before the first re-poll.
+        :param max_delay: upper bound for the delay between polls.
+        :param factor: growth of the delay per poll.
+        :param jitter: fraction of each delay that is randomized, so that
+        concurrent waiters do not poll in lockstep.
+        :param timeout: default deadline in seconds for a wait.
+        """
+        self._compute = compute
+        self._functions = functions
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.timeout = timeout
+        self._cancelled = threading.Event()
+
+    @property
+    def compute(self):
+        return self._compute or get_compute()
+
+    @property
+    def functions(self):
+        return self._functions or get_functions()
+
+    def cancel(self):
+        """Makes all current and future waits of this poller raise
+        OperationCancelled."""
+        self._cancelled.set()
+
+    def delays(self):
+        delay = self.initial_delay
+        while True:
+            yield delay * (1 - self.jitter * random.random())
+            delay = min(delay * self.factor, self.max_delay)
+
+    def _request(self, operation: Operation):
+        if operation.kind == FUNCTION:
+            return self.functions.operations().get(name=operation.name)
+        if operation.kind == ZONE:
+            return self.compute.zoneOperations().get(
+                project=operation.project, zone=operation.location,
+                operation=operation.name)
+        if operation.kind == REGION:
+            return self.compute.regionOperations().get(
+                project=operation.project, region=operation.location,
+                operation=operation.name)
+        return self.compute.globalOperations().get(
+            project=operation.project, operation=operation.name)
+
+    def refresh(self, operations: List[Operation]):
+        """Fetches the status of all operations, batched per API."""
+        by_service = {}
+        for operation in operations:
+            service = self.functions if operation.kind == FUNCTION \
+                else self.compute
+            by_service.setdefault(id(service), (service, []))[1].append(
+                operation)
+
+        for service, ops in by_service.values():
+            if len(ops) == 1:
+                ops[0].result = self._request(ops[0]).execute()
+                continue
+            for i in range(0, len(ops), BATCH_SIZE):
+                chunk = ops[i:i + BATCH_SIZE]
+                errors = []
+
+                def callback(request_id, response, exception):
+                    if exception is not None:
+                        errors.append(exception)
+                    else:
+                        chunk[int(request_id)].result = response
+
+                batch = service.new_batch_http_request(callback=callback)
+                for j, operation in enumerate(chunk):
+                    batch.add(self._request(operation), request_id=str(j))
+                batch.execute()
+                if errors:
+                    raise errors[0]
+
+    def _pending(self, operations: List[Operation]) -> List[Operation]:
+        pending = []
+        for operation in operations:
+            if not operation.done:
+                pending.append(operation)
+            elif 'error' in operation.result:
+                raise OperationError(operation, operation.result['error'])
+        return pending
+
+    def wait_all(self, operations: List[Operation],
+                 timeout: float = None) -> List[Dict]:
+        """Blocks until all operations are done.
+
+        :return: the final operation resources, in order.
+        """
+        deadline = time.time() + (timeout or self.timeout)
+        delays = self.delays()
+        pending = list(operations)
+        while True:
+            if self._cancelled.is_set():
+                raise OperationCancelled(f'Waiting for {pending} cancelled')
+            self.refresh(pending)
+            pending = self._pending(pending)
+            if not pending:
+                return [operation.result for operation in operations]
+            delay = next(delays)
+            if time.time() + delay > deadline:
+                raise TimeoutError(f'{pending} not done in time')
+            logging.debug(f'{len(pending)} operations pending, polling '
+                          f'again in {delay:.1f}s')
+            # Returns early on cancel()
+            self._cancelled.wait(delay)
+
+    def wait(self, operation: Operation, timeout: float = None) -> Dict:
+        return self.wait_all([operation], timeout)[0]
+
+    async def wait_all_async(self, operations: List[Operation],
+                             timeout: float = None) -> List[Dict]:
+        """Same as wait_all, without blocking the event loop. Cancelling
+        the awaiting task stops the polling."""
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        delays = self.delays()
+        pending = list(operations)
+        while True:
+            if self._cancelled.is_set():
+                raise OperationCancelled(f'Waiting for {pending} cancelled')
+            await loop.run_in_executor(None, self.refresh, pending)
+            pending = self._pending(pending)
+            if not pending:
+                return [operation.result for operation in operations]
+            delay = next(delays)
+            if loop.time() + delay > deadline:
+                raise TimeoutError(f'{pending} not done in time')
+            await asyncio.sleep(delay)
+
+    async def wait_async(self, operation: Operation,
+                         timeout: float = None) -> Dict:
+        return (await self.wait_all_async([operation], timeout))[0]
@@ -1,10 +1,10 @@
 import logging
 
-from google.cloud import pubsub_v1
+from budgetml.gcp.clients import get_publisher_client
 
 
 def create_topic(project, topic):
-    publisher = pubsub_v1.PublisherClient()
+    publisher = get_publisher_client()
     topic_path = publisher.topic_path(project, topic)
     topic = publisher.create_topic(request={"name": topic_path})
     logging.debug("Created topic: {}".format(topic.name))
@@ -1,6 +1,6 @@
 import logging
 
-from google.cloud import scheduler
+from budgetml.gcp.clients import get_scheduler_client
 
 
 def create_scheduler_job(
@@ -10,8 +10,8 @@ def create_scheduler_job(
         location_id='us-central1'):
     """Create a job with a PubSub topic via the Cloud Scheduler API"""
 
-    # Create a client.
-    client = scheduler.CloudSchedulerClient()
+    # Get the shared client.
+    client = get_scheduler_client()
 
     # Construct the fully qualified location path.
     parent = f"projects/{project_id}/locations/{location_id}"
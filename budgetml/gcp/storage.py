@@ -1,12 +1,13 @@
 import logging
 
-from google.cloud import storage
 from google.cloud.exceptions import Conflict
 
+from budgetml.gcp.clients import get_storage_client
+
 
 def upload_blob(bucket_name, source_file_name, destination_blob_name):
     """Uploads a file to the bucket."""
-    storage_client = storage.Client()
+    storage_client = get_storage_client()
     bucket = storage_client.bucket(bucket_name)
     blob = bucket.blob(destination_blob_name)
 
@@ -21,7 +22,7 @@ def upload_blob(bucket_name, source_file_name, destination_blob_name):
 
 def create_bucket_if_not_exists(bucket_name):
     """Create a new bucket in specific location"""
-    storage_client = storage.Client()
+    storage_client = get_storage_client()
     bucket = storage_client.bucket(bucket_name)
     try:
         new_bucket = storage_client.create_bucket(bucket, location="us")
@@ -1,19 +1,16 @@
 import logging
-import time
 
+from budgetml.gcp.operations import Operation, OperationPoller, REGION, ZONE
 
-def wait_for_operation(compute, project, zone, operation):
-    logging.debug('Waiting for operation to finish...')
-    while True:
-        result = compute.zoneOperations().get(
-            project=project,
-            zone=zone,
-            operation=operation).execute()
 
-        if result['status'] == 'DONE':
-            print("done.")
-            if 'error' in result:
-                raise Exception(result['error'])
-            return result
+def wait_for_operation(compute, project, zone, operation, timeout=600):
+    logging.debug(f'Waiting for zone operation {operation} to finish...')
+    return OperationPoller(compute=compute).wait(
+        Operation(operation, ZONE, project, zone), timeout)
 
-        time.sleep(1)
+
+def wait_for_region_operation(compute, project, region, operation,
+                              timeout=600):
+    logging.debug(f'Waiting for region operation {operation} to finish...')
+    return OperationPoller(compute=compute).wait(
+        Operation(operation, REGION, project, region), timeout)
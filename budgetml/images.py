@@ -0,0 +1,94 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+from typing import Text
+
+import docker
+
+# Where a baked image keeps the predictor source
+PREDICTOR_IMAGE_PATH = '/budgetml/predictor.py'
+
+
+def get_image_tag(docker_template_content: Text,
+                  requirements_content: Text,
+                  predictor_source: Text) -> Text:
+    """Content hash of everything that goes into a baked image, so that
+    unchanged predictors reuse the pushed image."""
+    digest = hashlib.sha256()
+    for part in (docker_template_content, requirements_content,
+                 predictor_source):
+        digest.update(part.encode())
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+def get_baked_dockerfile(docker_template_content: Text) -> Text:
+    return docker_template_content.rstrip('\n') + '\n\n' \
+        f'COPY predictor.py {PREDICTOR_IMAGE_PATH}\n'
+
+
+def image_exists(client, image: Text) -> bool:
+    try:
+        client.images.get_registry_data(image)
+        return True
+    except docker.errors.NotFound:
+        return False
+    except docker.errors.APIError as e:
+        # Some registries answer unknown tags with a 403/401
+        logging.debug(f'Could not look up {image}: {str(e)}')
+        return False
+
+
+def build_and_push_image(repository: Text,
+                         docker_template_content: Text,
+                         requirements_content: Text,
+                         predictor_file: Text) -> Text:
+    """
+    Builds the serving image with requirements and predictor baked in and
+    pushes it, unless an image with the same content hash was pushed
+    before. Needs a local docker daemon that is logged in to the registry,
+    e.g. via `gcloud auth configure-docker`.
+
+    :param repository: image repository, e.g. gcr.io/<project>/budgetml.
+    :param docker_template_content: contents of the Dockerfile template.
+    :param requirements_content: contents of the requirements file.
+    :param predictor_file: path to the predictor source.
+    :return: full image reference.
+    """
+    with open(predictor_file, 'r') as f:
+        predictor_source = f.read()
+    tag = get_image_tag(
+        docker_template_content, requirements_content, predictor_source)
+    image = f'{repository}:{tag}'
+
+    client = docker.from_env()
+    if image_exists(client, image):
+        logging.info(f'Image {image} exists already, skipping build')
+        return image
+
+    context_dir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(context_dir, 'template.Dockerfile'), 'w') as f:
+            f.write(get_baked_dockerfile(docker_template_content))
+        with open(os.path.join(context_dir, 'custom_requirements.txt'),
+                  'w') as f:
+            f.write(requirements_content)
+        shutil.copy(predictor_file, os.path.join(context_dir, 'predictor.py'))
+
+        logging.info(f'Building image {image}..')
+        client.images.build(
+            path=context_dir,
+            dockerfile='template.Dockerfile',
+            tag=image,
+        )
+    finally:
+        shutil.rmtree(context_dir, ignore_errors=True)
+
+    logging.info(f'Pushing image {image}..')
+    for line in client.images.push(
+            repository, tag=tag, stream=True, decode=True):
+        if 'error' in line:
+            raise RuntimeError(f'Pushing {image} failed: {line["error"]}')
+    return image
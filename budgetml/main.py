@@ -3,20 +3,37 @@ import inspect
 import logging
 import os
 import pathlib
-from typing import List, Union
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Union
 from typing import Text, Any
 from uuid import uuid4
 
 import docker
-import googleapiclient.discovery
-
-from budgetml.constants import BUDGETML_BASE_IMAGE_NAME
-from budgetml.gcp.addresses import create_static_ip, release_static_ip
+import requests
+
+from budgetml import autoscaler
+from budgetml.apikey import ApiKey
+from budgetml.autoscaling import AutoscalingPolicy
+from budgetml.constants import BUDGETML_BASE_IMAGE_NAME, \
+    BUDGET_BOOT_TIMELINE_PATH
+from budgetml.fleet import RateLimiter, retry
+from budgetml.gcp.addresses import create_internal_ip, create_static_ip, \
+    release_static_ip
+from budgetml.gcp.clients import get_compute
 from budgetml.gcp.compute import create_instance
-from budgetml.gcp.function import create_cloud_function as create_gcp_function
+from budgetml.gcp.function import create_cloud_function as \
+    create_gcp_function, wait_for_function_operation
+from budgetml.gcp.images import create_boot_image, get_boot_image
+from budgetml.gcp.pubsub import create_topic
 from budgetml.gcp.scheduler import \
     create_scheduler_job as create_gcp_scheduler_job
 from budgetml.gcp.storage import upload_blob, create_bucket_if_not_exists
+from budgetml.signing import get_signature_headers
+from budgetml.images import PREDICTOR_IMAGE_PATH, build_and_push_image, \
+    get_image_tag
+from budgetml.steps import Step, run_steps
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -27,7 +44,8 @@ class BudgetML:
                  zone: Text = 'us-central1-a',
                  unique_id: Text = str(uuid4()),
                  region: Text = 'us-central1',
-                 static_ip: Text = None):
+                 static_ip: Text = None,
+                 fallback_zones: List[Text] = None):
         """
         BudgetML client instance.
 
@@ -36,15 +54,22 @@ class BudgetML:
         :param unique_id: unique id to identify client.
         :param region: (gcp) region.
         :param static_ip: static ip address.
+        :param fallback_zones: zones of the region the autostarter moves a
+        preempted instance to, if its zone has no capacity to restart it.
         """
         self.project = project
         self.zone = zone
+        self.fallback_zones = fallback_zones or []
         self.unique_id = unique_id
         self.region = region
         self.static_ip = static_ip
+        self.launch_timings = {}
 
-        # Initialize compute REST API client
-        self.compute = googleapiclient.discovery.build('compute', 'v1')
+    @property
+    def compute(self):
+        # Compute REST API client of the calling thread, launch steps run
+        # in several threads and the client is not thread-safe
+        return get_compute()
 
     def create_static_ip(self, static_ip_name: Text):
         res = create_static_ip(
@@ -97,31 +122,184 @@ class BudgetML:
     def get_nginx_conf_contents(self,
                                 domain: Text,
                                 subdomain: Text,
-                                nginx_config_path: Text = None):
+                                nginx_config_path: Text = None,
+                                upstreams: List[Text] = None):
         if nginx_config_path is None:
             base_path = os.path.dirname(os.path.abspath(__file__))
+            # replicas are load balanced, a single instance is proxied to
             nginx_config_path = os.path.join(
-                base_path, 'template-nginx.conf')
+                base_path, 'template-nginx-pool.conf' if upstreams
+                else 'template-nginx.conf')
 
         with open(nginx_config_path, 'r') as f:
             nginx_config_content = f.read()
             nginx_config_content = nginx_config_content.replace(
                 "$BUDGET_DOMAIN", f'{subdomain}.{domain}')
+            nginx_config_content = nginx_config_content.replace(
+                "$BUDGET_UPSTREAM_SERVERS", '\n'.join(
+                    f'    server {ip}:80 max_fails=2 fail_timeout=10s;'
+                    for ip in upstreams or []))
             return nginx_config_content
 
+    def get_health_check_script(self, nginx_conf_location: Text,
+                                upstreams: List[Text],
+                                interval: int = 5):
+        """Background loop on the instance running the proxy, taking
+        replicas out of the upstream pool while their readiness check
+        (`/ready`) fails and back in once it passes."""
+        healthy = f'{nginx_conf_location}.healthy'
+        candidate = f'{nginx_conf_location}.next'
+        loop = f'cp {nginx_conf_location} {healthy}' + '\n'
+        loop += 'while true; do' + '\n'
+        loop += f'    cp {healthy} {candidate}' + '\n'
+        for ip in upstreams:
+            loop += f'    curl -sf -m 2 -o /dev/null ' \
+                    f'http://{ip}:80/ready || ' \
+                    f'sed -i "s/server {ip}:80 /server {ip}:80 down /" ' \
+                    f'{candidate}' + '\n'
+        # the file is bind mounted, so it has to be written in place
+        loop += f'    if ! cmp -s {candidate} {nginx_conf_location}; then' \
+                + '\n'
+        loop += f'        cat {candidate} > {nginx_conf_location}' + '\n'
+        loop += '        docker exec swag nginx -s reload' + '\n'
+        loop += '    fi' + '\n'
+        loop += f'    sleep {interval}' + '\n'
+        loop += 'done' + '\n'
+
+        loop_location = os.path.join(
+            os.path.dirname(nginx_conf_location), 'healthcheck.sh')
+        script = f"cat > {loop_location} <<'EOF'" + '\n'
+        script += loop
+        script += 'EOF' + '\n'
+        script += f'setsid nohup bash {loop_location} > ' \
+                  '/var/log/budgetml-healthcheck.log 2>&1 &' + '\n'
+        return script
+
+    def get_predictor_gcs_path(self, predictor_class: Any,
+                               instance_name: Text = None):
+        entrypoint = predictor_class.__name__
+        if instance_name is not None:
+            # instances of a fleet share a bucket
+            return f'predictors/{self.unique_id}/{instance_name}/' \
+                   f'{entrypoint}.py'
+        return f'predictors/{self.unique_id}/{entrypoint}.py'
+
+    def upload_predictor(self, predictor_class: Any, bucket: Text,
+                         instance_name: Text = None):
+        file_name = inspect.getfile(predictor_class)
+        predictor_gcs_path = self.get_predictor_gcs_path(
+            predictor_class, instance_name)
+        upload_blob(bucket, file_name, predictor_gcs_path)
+        return predictor_gcs_path
+
+    def get_model_gcs_path(self, name: Text, predictor_class: Any,
+                           instance_name: Text = None):
+        # models may share file and class names
+        predictor_dir = os.path.dirname(
+            self.get_predictor_gcs_path(predictor_class, instance_name))
+        return f'{predictor_dir}/models/{name}/{predictor_class.__name__}.py'
+
+    def upload_models(self, models: Dict[Text, Any], bucket: Text,
+                      instance_name: Text = None):
+        for name, predictor_class in models.items():
+            upload_blob(bucket, inspect.getfile(predictor_class),
+                        self.get_model_gcs_path(
+                            name, predictor_class, instance_name))
+
+    def get_models_spec(self, models: Dict[Text, Any], bucket: Text,
+                        instance_name: Text = None):
+        """`BUDGET_MODELS` of the server, see server/app/registry.py."""
+        for name in models:
+            assert re.match(r'^[A-Za-z0-9_.-]+$', name), \
+                f'Invalid model name: {name}'
+        return ','.join(
+            f'{name}=gs://{bucket}/'
+            f'{self.get_model_gcs_path(name, cls, instance_name)}:'
+            f'{cls.__name__}' for name, cls in models.items())
+
+    def get_mark_script(self, phase: Text,
+                        timestamp: Text = '$(date +%s.%N)'):
+        # appends a phase to the boot timeline, see server/app/timeline.py
+        event = f'{{\\"phase\\": \\"{phase}\\", \\"time\\": {timestamp}, ' \
+                '\\"source\\": \\"host\\"}'
+        return f'echo "{event}" >> {BUDGET_BOOT_TIMELINE_PATH}' + '\n'
+
+    def get_install_docker_script(self):
+        script = f'if [ -x "$(command -v docker)" ]; then' + '\n'
+        script += '    echo "Docker already installed"' + '\n'
+        script += f'else' + '\n'
+        script += '    sudo apt-get update' + '\n'
+        script += '    sudo apt-get -y install apt-transport-https ' \
+                  'ca-certificates curl gnupg-agent ' \
+                  'software-properties-common' + '\n'
+        script += '    curl -fsSL ' \
+                  'https://download.docker.com/linux/ubuntu/gpg | sudo ' \
+                  'apt-key add -' + '\n'
+        script += '    sudo add-apt-repository "deb [arch=amd64] ' \
+                  'https://download.docker.com/linux/ubuntu $(lsb_release ' \
+                  '-cs) stable"' + '\n'
+        script += '    sudo apt-get update' + '\n'
+        script += '    sudo apt-get -y install docker-ce docker-ce-cli ' \
+                  'containerd.io' + '\n'
+        script += 'fi' + '\n'
+        return script
+
+    def get_pull_image_script(self, image: Text):
+        script = ''
+        registry = image.split('/')[0]
+        if registry.endswith('gcr.io') or registry.endswith('pkg.dev'):
+            # log in with the token of the instance's service account
+            script += self.get_registry_login_script(registry)
+        script += f'docker pull {image}' + '\n'
+        return script
+
+    def get_access_token_script(self):
+        # token of the instance's service account, from the metadata server
+        return '$(curl -s ' \
+               'http://metadata.google.internal/computeMetadata/v1' \
+               '/instance/service-accounts/default/token -H ' \
+               '"Metadata-Flavor: Google" | python3 -c ' \
+               '"import json,sys; print(json.load(sys.stdin)[' \
+               '\'access_token\'])")'
+
+    def get_registry_login_script(self, registry: Text):
+        return 'docker login -u oauth2accesstoken -p ' \
+               f'"{self.get_access_token_script()}" https://{registry}' + '\n'
+
     def create_start_up(self,
                         predictor_class: Any,
                         bucket: Text,
                         domain: Text,
                         subdomain: Text,
                         username: Text,
-                        password: Text):
-        file_name = inspect.getfile(predictor_class)
+                        password: Text,
+                        instance_name: Text = None,
+                        image: Text = None,
+                        services: List[Text] = None,
+                        upstreams: List[Text] = None,
+                        token: Text = None,
+                        models: Dict[Text, Any] = None,
+                        api_keys: List[ApiKey] = None):
+        """
+        :param services: compose services to start, all by default.
+        Replicas only run the server, without the proxy.
+        :param upstreams: internal IPs of all replicas, if this instance
+        load balances between them.
+        :param token: API token, has to be the same for all replicas.
+        :param models: further predictor classes by name, served under
+        `/models/{name}/` and uploaded separately, see upload_models.
+        :param api_keys: further keys accepted by the server.
+        """
         entrypoint = predictor_class.__name__
 
-        # upload predictor to gcs
-        predictor_gcs_path = f'predictors/{self.unique_id}/{entrypoint}.py'
-        upload_blob(bucket, file_name, predictor_gcs_path)
+        # the predictor is uploaded to gcs separately, see upload_predictor,
+        # or baked into the image, see build_and_push_image
+        if image is None:
+            predictor_gcs_path = self.get_predictor_gcs_path(
+                predictor_class, instance_name)
+            predictor_path = f'gs://{bucket}/{predictor_gcs_path}'
+        else:
+            predictor_path = PREDICTOR_IMAGE_PATH
 
         context_dir = '/home/budgetml'
         template_dockerfile_location = f'{context_dir}/template.Dockerfile'
@@ -139,6 +317,13 @@ class BudgetML:
         # create context
         script += f'mkdir {context_dir}' + '\n'
 
+        # timestamp the boot phases
+        script += f'mkdir -p {os.path.dirname(BUDGET_BOOT_TIMELINE_PATH)}' \
+                  + '\n'
+        script += self.get_mark_script(
+            'kernel_boot', '$(($(date +%s) - $(cut -d. -f1 /proc/uptime)))')
+        script += self.get_mark_script('startup_script')
+
         # go into tmp directory
         script += f'cd {context_dir}' + '\n'
 
@@ -167,6 +352,8 @@ class BudgetML:
                   '"Metadata-Flavor: ' \
                   'Google")' + '\n'
 
+        script += self.get_mark_script('metadata_fetched')
+
         # delete temporary files
         script += f'rm {template_dockerfile_location}' + '\n'
         script += f'rm {requirements_location}' + '\n'
@@ -184,8 +371,7 @@ class BudgetML:
                   f'decode >> {nginx_conf_location}' + '\n'
 
         # export env variables
-        script += f'export BUDGET_PREDICTOR_PATH=gs://{bucket}/' \
-                  f'{predictor_gcs_path}' + '\n'
+        script += f'export BUDGET_PREDICTOR_PATH={predictor_path}' + '\n'
         script += f'export BUDGET_PREDICTOR_ENTRYPOINT={entrypoint}' + '\n'
         script += f'export BUDGET_DOMAIN={domain}' + '\n'
         script += f'export BUDGET_USERNAME={username}' + '\n'
@@ -194,29 +380,24 @@ class BudgetML:
         script += f'export BUDGET_NGINX_PATH={nginx_conf_location}' + '\n'
         script += f'export BUDGET_CERTS_PATH={certs_path}' + '\n'
         script += f'export BASE_IMAGE={BUDGETML_BASE_IMAGE_NAME}' + '\n'
+        script += f'export BUDGET_IMAGE={image or ""}' + '\n'
+        script += 'export BUDGET_MODELS=' + self.get_models_spec(
+            models or {}, bucket, instance_name) + '\n'
 
         # This generates a unique token for this instance and passes to
         # gunicorn to be picked up later in app:main
-        script += f'export BUDGET_TOKEN={str(uuid4())}' + '\n'
+        script += f'export BUDGET_TOKEN={token or str(uuid4())}' + '\n'
+        script += 'export BUDGET_API_KEYS=' + ','.join(
+            key.to_spec() for key in api_keys or []) + '\n'
 
         # install docker if it doesnt exist
-        script += f'if [ -x "$(command -v docker)" ]; then' + '\n'
-        script += '    echo "Docker already installed"' + '\n'
-        script += f'else' + '\n'
-        script += '    sudo apt-get update' + '\n'
-        script += '    sudo apt-get -y install apt-transport-https ' \
-                  'ca-certificates curl gnupg-agent ' \
-                  'software-properties-common' + '\n'
-        script += '    curl -fsSL ' \
-                  'https://download.docker.com/linux/ubuntu/gpg | sudo ' \
-                  'apt-key add -' + '\n'
-        script += '    sudo add-apt-repository "deb [arch=amd64] ' \
-                  'https://download.docker.com/linux/ubuntu $(lsb_release ' \
-                  '-cs) stable"' + '\n'
-        script += '    sudo apt-get update' + '\n'
-        script += '    sudo apt-get -y install docker-ce docker-ce-cli ' \
-                  'containerd.io' + '\n'
-        script += 'fi' + '\n'
+        script += self.get_install_docker_script()
+        script += self.get_mark_script('docker_installed')
+
+        if image is not None:
+            # pull the prebuilt image instead of building it on every boot
+            script += self.get_pull_image_script(image)
+            script += self.get_mark_script('image_pulled')
 
         # run docker-compose
         script += \
@@ -231,40 +412,105 @@ class BudgetML:
             f'-e BUDGET_CERTS_PATH=$BUDGET_CERTS_PATH ' \
             f'-e BASE_IMAGE=$BASE_IMAGE ' \
             f'-e BUDGET_TOKEN=$BUDGET_TOKEN ' \
+            f'-e BUDGET_IMAGE=$BUDGET_IMAGE ' \
+            f'-e BUDGET_MODELS=$BUDGET_MODELS ' \
+            f'-e BUDGET_API_KEYS=$BUDGET_API_KEYS ' \
             '--rm -v /var/run/docker.sock:/var/run/docker.sock -v ' \
-            '"$PWD:$PWD" -w="$PWD" docker/compose:1.24.0 up -d' + '\n'
+            '"$PWD:$PWD" -w="$PWD" docker/compose:1.24.0 up -d ' \
+            f'{" ".join(services or [])}' + '\n'
+        # includes building the image, if not pulled
+        script += self.get_mark_script('containers_started')
 
-        script += 'docker pull google/cloud-sdk:324.0.0' + '\n'
+        if upstreams:
+            script += self.get_health_check_script(
+                nginx_conf_location, upstreams)
 
         logging.debug(f'Startup script: {script}')
         return script
 
-    def create_shut_down(self, topic):
+    def create_shut_down(self, topic, instance_name: Text = None):
+        # tells the autostarter which instance to restart, and since when
+        # it is down
+        message = '{\\"time\\": $(date +%s.%N)}' if instance_name is None \
+            else f'{{\\"instance\\": \\"{instance_name}\\", ' \
+                 '\\"time\\": $(date +%s.%N)}'
         shutdown_script = '#!/bin/bash' + '\n'
         shutdown_script += 'sudo -s' + '\n'
         shutdown_script += 'cd /tmp' + '\n'
         shutdown_script += 'echo "+++ Running shutdown script +++"' + '\n'
-        shutdown_script += f'docker run -it google/cloud-sdk:324.0.0 gcloud ' \
-                           f'pubsub topics publish {topic} ' \
-                           '--message "{}"'
+        # Preempted instances get 30 seconds to shut down, so publish with
+        # curl right away instead of pulling and running the cloud sdk
+        shutdown_script += f'MESSAGE=$(echo -n "{message}" | base64 -w0)' \
+                           + '\n'
+        shutdown_script += 'curl -s -X POST -H "Authorization: Bearer ' \
+                           f'{self.get_access_token_script()}" ' \
+                           '-H "Content-Type: application/json" ' \
+                           '-d "{\\"messages\\": [{\\"data\\": ' \
+                           '\\"$MESSAGE\\"}]}" ' \
+                           'https://pubsub.googleapis.com/v1/projects/' \
+                           f'{self.project}/topics/{topic}:publish' + '\n'
+        shutdown_script += self.get_mark_script('shutdown')
         logging.debug(f'Shutdown script: {shutdown_script}')
         return shutdown_script
 
-    def create_cloud_function(self, instance_name, topic):
+    def create_cloud_function(self, instance_name, topic,
+                              create_topic: bool = True,
+                              instance_names: List[Text] = None,
+                              zones: List[Text] = None):
         function_name = 'function-' + instance_name
-        create_gcp_function(
+        operation = create_gcp_function(
             self.project,
             self.region,
             function_name,
             self.zone,
             instance_name,
-            topic
+            topic,
+            create_pubsub_topic=create_topic,
+            instance_names=instance_names,
+            # the autostarter looks for instances in these zones, too
+            fallback_zones=list(dict.fromkeys(
+                [z for z in zones or [] if z != self.zone] +
+                self.fallback_zones)),
         )
+        wait_for_function_operation(operation['name'])
         return function_name
 
     def create_scheduler_job(self, project_id, topic, schedule, region):
         create_gcp_scheduler_job(project_id, topic, schedule, region)
 
+    def create_boot_image(self,
+                          image_name: Text = None,
+                          images: List[Text] = None,
+                          family: Text = 'budgetml'):
+        """
+        Creates a disk image with docker and the serving images
+        preinstalled, to pass as `boot_image` to `launch`. Instances booting
+        from it skip the docker installation and most image pulls.
+
+        :param image_name: name of the disk image.
+        :param images: additional docker images to pull into the disk
+        image, e.g. baked predictor images.
+        :param family: image family, `family/<family>` always refers to the
+        latest image of it.
+        :return: the name of the disk image.
+        """
+        if image_name is None:
+            image_name = f'budgetml-{str(uuid4())[:8]}'
+        images = [BUDGETML_BASE_IMAGE_NAME,
+                  'ghcr.io/linuxserver/swag',
+                  'docker/compose:1.24.0'] + (images or [])
+
+        script = '#!/bin/bash' + '\n'
+        script += self.get_install_docker_script()
+        for image in images:
+            script += self.get_pull_image_script(image)
+        script += 'shutdown -h now' + '\n'
+
+        create_boot_image(
+            self.compute, self.project, self.zone, image_name, script,
+            family)
+        return image_name
+
     def launch(self,
                predictor_class,
                domain: Text,
@@ -277,7 +523,16 @@ class BudgetML:
                instance_name: Text = None,
                machine_type: Text = 'e2-medium',
                preemptible: bool = True,
-               static_ip: Text = None):
+               static_ip: Text = None,
+               autostart_topic: Text = None,
+               bake: bool = False,
+               image_repository: Text = None,
+               boot_image: Text = None,
+               replicas: int = 1,
+               replica_zones: List[Text] = None,
+               autoscaling: AutoscalingPolicy = None,
+               models: Dict[Text, Any] = None,
+               api_keys: List[ApiKey] = None):
         """
         Launches the VM, setups up https endpoint.
 
@@ -293,49 +548,107 @@ class BudgetML:
         :param instance_name: name of server instance.
         :param machine_type: machine type of server instance
         :param preemptible: whether machine is preemtible or not
+        :param static_ip: static ip address to use instead of creating one.
+        :param autostart_topic: Pub/Sub topic of an existing autostarter
+        function to use instead of creating one, e.g. shared by a fleet.
+        :param bake: build the serving image with requirements and predictor
+        locally, push it and let the instance pull it, instead of building
+        it on every boot. Needs a local docker daemon.
+        :param image_repository: repository for baked images, defaults to
+        gcr.io/<project>/budgetml.
+        :param boot_image: disk image to boot from, e.g. one created with
+        `create_boot_image`, or `family/<name>` for the latest of a family.
+        :param replicas: number of instances serving the predictor. The
+        first one, with the static ip, load balances between all of them.
+        :param replica_zones: zones of the region to spread the replicas
+        across, the client's zone by default.
+        :param autoscaling: starts and stops replicas, up to `replicas`,
+        with the load.
+        :param models: further predictor classes by name, served by the
+        same server under `/models/{name}/`. They are loaded on first use
+        and the least recently used ones are unloaded when memory runs out.
+        :param api_keys: keys accepted by the server in addition to the
+        token of `/token`, each with its own rate limit and quota.
         :return: tuple of username and password
         """
+        report = self._launch(
+            predictor_class, domain, subdomain, username, password,
+            requirements, dockerfile_path, bucket_name, instance_name,
+            machine_type, preemptible, static_ip, autostart_topic, bake,
+            image_repository, boot_image, replicas, replica_zones,
+            autoscaling, models, api_keys)
+        self.launch_timings = report['timings']
+        return username, password
+
+    def update_predictor(self,
+                         predictor_class,
+                         domain: Text,
+                         password: Text,
+                         subdomain: Text = 'budget',
+                         bucket_name: Text = None,
+                         instance_name: Text = None):
+        """
+        Rolls out a new version of a launched predictor without downtime.
+        The source is uploaded over the launched one, then the server loads
+        and warms up the new version next to the old one and swaps them.
+        Only for predictors launched without `bake`, with the same
+        `unique_id`.
+
+        :param predictor_class: new version of the launched class.
+        :param domain: domain e.g. lol.com
+        :param password: password of the launch, which signs the request.
+        :param subdomain: subdomain e.g. model
+        :param bucket_name: bucket of the launch, if not the default.
+        :param instance_name: only for predictors launched with
+        `launch_many`, where instances share the bucket.
+        """
+        if bucket_name is None:
+            bucket_name = f'budget_bucket_{self.unique_id}'
+        self.upload_predictor(predictor_class, bucket_name, instance_name)
+
+        # Other replicas notice the new version within
+        # BUDGET_RELOAD_INTERVAL
+        res = requests.post(
+            f'https://{subdomain}.{domain}/admin/reload',
+            headers=get_signature_headers(password))
+        res.raise_for_status()
+        logging.info(f'Requested a reload of {subdomain}.{domain}')
+
+    def _launch(self,
+                predictor_class,
+                domain: Text,
+                subdomain: Text,
+                username: Text,
+                password: Text,
+                requirements: Union[Text, List],
+                dockerfile_path: Text,
+                bucket_name: Text,
+                instance_name: Text,
+                machine_type: Text,
+                preemptible: bool,
+                static_ip: Text,
+                autostart_topic: Text,
+                bake: bool = False,
+                image_repository: Text = None,
+                boot_image: Text = None,
+                replicas: int = 1,
+                replica_zones: List[Text] = None,
+                autoscaling: AutoscalingPolicy = None,
+                models: Dict[Text, Any] = None,
+                api_keys: List[ApiKey] = None) -> Dict:
         if bucket_name is None:
             bucket_name = f'budget_bucket_{self.unique_id}'
         if instance_name is None:
             instance_name = f'budget-instance-' \
                             f'{self.unique_id.replace("_", "-")}'
+        instance_names = self.get_replica_names(instance_name, replicas)
+        zones = replica_zones or [self.zone]
 
         static_ip_name = f'ip-{instance_name}'
 
-        if static_ip is None:
-            self.create_static_ip(static_ip_name)
-        else:
-            self.static_ip = static_ip
-
-        # create bucket if it doesnt exist
-        create_bucket_if_not_exists(bucket_name)
-
         # create topic name
-        topic = 'topic-' + instance_name
-
-        # create cloud function
-        self.create_cloud_function(instance_name, topic)
-
-        # Create scheduler function
-        self.create_scheduler_job(
-            project_id=self.project,
-            topic=topic,
-            schedule='*/5 * * * *',  # every fifth minute
-            region=self.region,
-        )
-
-        # create startup
-        startup_script = self.create_start_up(
-            predictor_class,
-            bucket_name,
-            domain,
-            subdomain,
-            username,
-            password)
-
-        # create shutdown
-        shutdown_script = self.create_shut_down(topic)
+        shared = autostart_topic is not None
+        topic = autostart_topic if shared else 'topic-' + instance_name
 
         # create docker template content
         docker_template_content = self.get_docker_file_contents(
@@ -348,8 +661,37 @@ class BudgetML:
             requirements_content = self.get_requirements_file_contents(
                 requirements)
 
+        # the tag is a content hash, so it is known before the build
+        image = None
+        if bake:
+            if image_repository is None:
+                image_repository = f'gcr.io/{self.project}/budgetml'
+            with open(inspect.getfile(predictor_class), 'r') as f:
+                predictor_source = f.read()
+            image = f'{image_repository}:' + get_image_tag(
+                docker_template_content, requirements_content,
+                predictor_source)
+
+        token = str(uuid4())
+
+        def get_start_up(replica, upstreams=None):
+            return self.create_start_up(
+                predictor_class,
+                bucket_name,
+                domain,
+                subdomain,
+                username,
+                password,
+                instance_name if shared else None,
+                image,
+                services=['budgetml'] if replica else None,
+                upstreams=upstreams,
+                # a token from any replica is valid on all of them
+                token=token,
+                models=models,
+                api_keys=api_keys)
+
         docker_compose_content = self.get_docker_compose_contents()
-        nginx_conf_content = self.get_nginx_conf_contents(domain, subdomain)
 
         # encode the files to preserve the structure like newlines
         requirements_content = base64.b64encode(
@@ -358,30 +700,291 @@ class BudgetML:
             docker_template_content.encode()).decode()
         docker_compose_content = base64.b64encode(
             docker_compose_content.encode()).decode()
-        nginx_conf_content = base64.b64encode(
-            nginx_conf_content.encode()).decode()
-
-        logging.info(
-            f'Launching GCP Instance {instance_name} with IP: '
-            f'{self.static_ip} in project: {self.project}, zone: '
-            f'{self.zone}. The machine type is: {machine_type}')
-        create_instance(
-            self.compute,
-            self.project,
-            self.zone,
-            self.static_ip,
-            instance_name,
-            machine_type,
-            startup_script,
-            shutdown_script,
-            preemptible,
-            requirements_content,
-            docker_template_content,
-            docker_compose_content,
-            nginx_conf_content,
-        )
+
+        def get_nginx_conf(upstreams=None):
+            return base64.b64encode(self.get_nginx_conf_contents(
+                domain, subdomain, upstreams=upstreams).encode()).decode()
+
+        def get_static_ip():
+            if static_ip is None:
+                return self.create_static_ip(static_ip_name)
+            self.static_ip = static_ip
+            return static_ip
+
+        source_image = None
+        if boot_image is not None:
+            source_image = get_boot_image(
+                self.compute, self.project, boot_image)
+
+        def launch_instance(index, static_ip=None, internal_ips=None):
+            name = instance_names[index]
+            zone = zones[index % len(zones)]
+            logging.info(
+                f'Launching GCP Instance {name} with IP: '
+                f'{static_ip} in project: {self.project}, zone: '
+                f'{zone}. The machine type is: {machine_type}')
+            # the first instance proxies to all replicas, including itself
+            upstreams = internal_ips if index == 0 else None
+            return create_instance(
+                self.compute,
+                self.project,
+                zone,
+                static_ip,
+                name,
+                machine_type,
+                get_start_up(index > 0, upstreams),
+                # tells the autostarter which instance to restart
+                self.create_shut_down(topic, name),
+                preemptible,
+                requirements_content,
+                docker_template_content,
+                docker_compose_content,
+                get_nginx_conf(upstreams),
+                source_image=source_image,
+                network_ip=internal_ips[index] if internal_ips else None,
+            )
+
+        # Independent steps run concurrently, each one as soon as its
+        # dependencies are done
+        steps = [
+            Step('static_ip', get_static_ip),
+            Step('bucket',
+                 lambda: create_bucket_if_not_exists(bucket_name)),
+            Step('predictor',
+                 lambda bucket: self.upload_predictor(
+                     predictor_class, bucket_name,
+                     instance_name if shared else None),
+                 depends_on=['bucket']) if image is None else
+            Step('predictor',
+                 lambda: build_and_push_image(
+                     image_repository, docker_template_content,
+                     requirements_content, inspect.getfile(predictor_class))),
+        ]
+        if models:
+            # not baked, as the server loads them from gcs on first use
+            steps.append(Step(
+                'models',
+                lambda bucket: self.upload_models(
+                    models, bucket_name, instance_name if shared else None),
+                depends_on=['bucket']))
+        if replicas == 1:
+            steps.append(Step(
+                'instance',
+                lambda static_ip, predictor: launch_instance(0, static_ip),
+                depends_on=['static_ip', 'predictor']))
+        else:
+            # fixed internal addresses, so that the upstream pool stays
+            # valid across restarts
+            steps.append(Step('internal_ips', lambda: [
+                create_internal_ip(
+                    self.compute, self.project, self.region,
+                    f'ip-{name}-internal')['address']
+                for name in instance_names]))
+            steps.append(Step(
+                'instance',
+                lambda static_ip, predictor, internal_ips: launch_instance(
+                    0, static_ip, internal_ips),
+                depends_on=['static_ip', 'predictor', 'internal_ips']))
+            for index in range(1, replicas):
+                steps.append(Step(
+                    f'replica_{index}',
+                    lambda predictor, internal_ips, index=index:
+                    launch_instance(index, internal_ips=internal_ips),
+                    depends_on=['predictor', 'internal_ips']))
+        if not shared:
+            steps += self.get_autostart_steps(
+                topic, instance_name, instance_names, zones)
+        if autoscaling is not None and replicas > 1:
+            steps += self.get_autoscaler_steps(
+                instance_name, instance_names, zones, autoscaling, token)
+        results, timings = run_steps(steps)
+        logging.info(f'Launch step timings (s): {timings}')
+
         logging.info(f'Username: {username}. Password: {password}')
-        return username, password
+        return {
+            'instance_name': instance_name,
+            'replicas': instance_names,
+            'endpoint': f'https://{subdomain}.{domain}',
+            'static_ip': results['static_ip'],
+            'username': username,
+            'password': password,
+            'timings': timings,
+        }
+
+    def get_replica_names(self, instance_name: Text, replicas: int = 1):
+        return [instance_name] + [
+            f'{instance_name}-{index}' for index in range(1, replicas)]
+
+    def get_autostart_steps(self, topic: Text, instance_name: Text,
+                            instance_names: List[Text] = None,
+                            zones: List[Text] = None):
+        """Steps creating the topic, cloud function and scheduler job that
+        restart preempted instances."""
+        return [
+            Step('pubsub_topic', lambda: create_topic(self.project, topic)),
+            Step('function',
+                 lambda pubsub_topic: self.create_cloud_function(
+                     instance_name, topic, create_topic=False,
+                     instance_names=instance_names, zones=zones),
+                 depends_on=['pubsub_topic']),
+            Step('scheduler',
+                 lambda pubsub_topic: self.create_scheduler_job(
+                     project_id=self.project,
+                     topic=topic,
+                     # a safety net, the shutdown script triggers it too
+                     schedule='* * * * *',  # every minute
+                     region=self.region),
+                 depends_on=['pubsub_topic']),
+        ]
+
+    def get_autoscaler_steps(self, instance_name: Text,
+                             instance_names: List[Text],
+                             zones: List[Text],
+                             policy: AutoscalingPolicy,
+                             token: Text):
+        """Steps creating the topic, cloud function and scheduler job that
+        start and stop replicas with the load.
+
+        :param token: API token of the replicas, `/load` requires it.
+        """
+        topic = 'autoscale-' + instance_name
+        environment = {
+            'BUDGET_ZONES': ','.join(dict.fromkeys(zones)),
+            'BUDGET_TOKEN': token,
+            **policy.to_env(len(instance_names)),
+        }
+        return [
+            Step('autoscaler_topic',
+                 lambda: create_topic(self.project, topic)),
+            Step('autoscaler_function',
+                 lambda autoscaler_topic: wait_for_function_operation(
+                     create_gcp_function(
+                         self.project,
+                         self.region,
+                         'scaler-' + instance_name,
+                         self.zone,
+                         instance_name,
+                         topic,
+                         create_pubsub_topic=False,
+                         instance_names=instance_names,
+                         source=autoscaler,
+                         entry_point='scale',
+                         environment=environment)['name']),
+                 depends_on=['autoscaler_topic']),
+            Step('autoscaler_scheduler',
+                 lambda autoscaler_topic: self.create_scheduler_job(
+                     project_id=self.project,
+                     topic=topic,
+                     schedule=policy.schedule,
+                     region=self.region),
+                 depends_on=['autoscaler_topic']),
+        ]
+
+    def launch_many(self,
+                    specs: List[Dict],
+                    max_concurrency: int = 4,
+                    launches_per_second: float = 1,
+                    retries: int = 3,
+                    bucket_name: Text = None,
+                    fleet_name: Text = None) -> List[Dict]:
+        """
+        Launches a fleet of predictors concurrently. All instances share one
+        bucket and one autostarter (topic, cloud function and scheduler job).
+
+        :param specs: one dict of `launch` arguments per predictor, e.g.
+        `{'predictor_class': Predictor, 'domain': 'lol.com', 'subdomain':
+        'model1'}`. Every spec needs its own `subdomain`.
+        :param max_concurrency: maximum number of launches in flight.
+        :param launches_per_second: rate at which launches are started, to
+        stay within API quotas.
+        :param retries: retries per launch on transient (quota, server or
+        network) errors.
+        :param bucket_name: name of the shared bucket.
+        :param fleet_name: name of the shared autostarter resources.
+        :return: one report per spec, in order, with `status` (`ok` or
+        `failed`), `endpoint`, `static_ip`, credentials, `attempts`,
+        `seconds` and per-step `timings`, or `error`.
+        """
+        if bucket_name is None:
+            bucket_name = f'budget_bucket_{self.unique_id}'
+        if fleet_name is None:
+            fleet_name = f'budget-fleet-{self.unique_id.replace("_", "-")}'
+
+        specs = [dict(spec) for spec in specs]
+        for i, spec in enumerate(specs):
+            spec.setdefault(
+                'instance_name',
+                f'budget-instance-{self.unique_id.replace("_", "-")}-{i}')
+            # the default argument would give all the same password
+            spec.setdefault('password', str(uuid4()))
+            spec['bucket_name'] = bucket_name
+
+        # shared resources first, the instances' shutdown scripts use them
+        topic = 'topic-' + fleet_name
+        instance_names = [
+            name for spec in specs for name in self.get_replica_names(
+                spec['instance_name'], spec.get('replicas', 1))]
+        zones = [zone for spec in specs
+                 for zone in spec.get('replica_zones') or []]
+        steps = [Step('bucket',
+                      lambda: create_bucket_if_not_exists(bucket_name))]
+        steps += self.get_autostart_steps(
+            topic, fleet_name, instance_names, zones)
+        run_steps(steps)
+
+        limiter = RateLimiter(launches_per_second)
+
+        def launch_one(spec):
+            start = time.time()
+            report = {
+                'instance_name': spec['instance_name'],
+                'endpoint': f"https://{spec.get('subdomain', 'budget')}."
+                            f"{spec['domain']}",
+            }
+
+            def attempt():
+                limiter.acquire()
+                kwargs = dict(spec)
+                predictor_class = kwargs.pop('predictor_class')
+                domain = kwargs.pop('domain')
+                return self._launch(
+                    predictor_class, domain,
+                    kwargs.get('subdomain', 'budget'),
+                    kwargs.get('username', 'budget'),
+                    kwargs['password'],
+                    kwargs.get('requirements'),
+                    kwargs.get('dockerfile_path'),
+                    bucket_name,
+                    kwargs['instance_name'],
+                    kwargs.get('machine_type', 'e2-medium'),
+                    kwargs.get('preemptible', True),
+                    kwargs.get('static_ip'),
+                    topic,
+                    kwargs.get('bake', False),
+                    kwargs.get('image_repository'),
+                    kwargs.get('boot_image'),
+                    kwargs.get('replicas', 1),
+                    kwargs.get('replica_zones'),
+                    kwargs.get('autoscaling'),
+                    kwargs.get('models'),
+                    kwargs.get('api_keys'))
+
+            try:
+                result, attempts = retry(attempt, retries)
+                report.update(result)
+                report.update(status='ok', attempts=attempts)
+            except Exception as e:
+                logging.exception(f'Launch of {spec["instance_name"]} failed')
+                report.update(status='failed', error=str(e))
+            report['seconds'] = time.time() - start
+            return report
+
+        with ThreadPoolExecutor(max_concurrency) as pool:
+            reports = list(pool.map(launch_one, specs))
+        failed = [r['instance_name'] for r in reports if r['status'] != 'ok']
+        logging.info(f'Launched {len(reports) - len(failed)} of '
+                     f'{len(reports)} instances. Failed: {failed}')
+        return reports
 
     def launch_local(self,
                      predictor_class,
@@ -461,12 +1064,9 @@ class BudgetML:
         #         logging.debug(f"Error parsing output from docker image "
         #                       f"build: {output}")
 
-        file_name = inspect.getfile(predictor_class)
-        entrypoint = predictor_class.__name__
-
         # upload predictor to gcs
-        predictor_gcs_path = f'predictors/{self.unique_id}/{entrypoint}.py'
-        upload_blob(bucket_name, file_name, predictor_gcs_path)
+        predictor_gcs_path = self.upload_predictor(
+            predictor_class, bucket_name)
 
         BUDGET_PREDICTOR_PATH = f'gs://{bucket_name}/{predictor_gcs_path}'
         BUDGET_PREDICTOR_ENTRYPOINT = predictor_class.__name__
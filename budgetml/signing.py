@@ -0,0 +1,21 @@
+import hashlib
+import hmac
+import time
+from typing import Dict, Text
+
+# Same as in server/app/signing.py
+TIMESTAMP_HEADER = 'X-Budget-Timestamp'
+SIGNATURE_HEADER = 'X-Budget-Signature'
+
+
+def sign(key: Text, timestamp: Text, body: bytes) -> Text:
+    return hmac.new(key.encode(), timestamp.encode() + b'.' + body,
+                    hashlib.sha256).hexdigest()
+
+
+def get_signature_headers(key: Text, body: bytes = b'') -> Dict[Text, Text]:
+    """Headers of a signed admin request to the server, keyed with the
+    password of the deployment."""
+    timestamp = str(time.time())
+    return {TIMESTAMP_HEADER: timestamp,
+            SIGNATURE_HEADER: sign(key, timestamp, body)}
@@ -0,0 +1,83 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Text
+
+
+class Step:
+    def __init__(self,
+                 name: Text,
+                 fn: Callable[..., Any],
+                 depends_on: List[Text] = None):
+        """
+        One provisioning step.
+
+        :param name: unique name of the step.
+        :param fn: called with the results of its dependencies as keyword
+        arguments, named after the dependency steps.
+        :param depends_on: names of the steps that have to finish first.
+        """
+        self.name = name
+        self.fn = fn
+        self.depends_on = depends_on or []
+
+
+class StepError(Exception):
+    def __init__(self, step: Text, error: Exception, timings: Dict):
+        super().__init__(f'Step {step} failed with: {str(error)}')
+        self.step = step
+        self.error = error
+        self.timings = timings
+
+
+def run_steps(steps: List[Step], max_workers: int = 8):
+    """
+    Runs steps as a dependency graph: every step starts as soon as all of
+    its dependencies are done, independent steps run concurrently in
+    threads. Stops scheduling new steps after the first failure.
+
+    :return: tuple of results and timings (seconds), both keyed by step name.
+    """
+    by_name = {step.name: step for step in steps}
+    for step in steps:
+        for dep in step.depends_on:
+            if dep not in by_name:
+                raise ValueError(f'Step {step.name} depends on unknown {dep}')
+
+    results = {}
+    timings = {}
+    pending = list(steps)
+    running = {}
+
+    def timed(step, kwargs):
+        start = time.time()
+        try:
+            return step.fn(**kwargs)
+        finally:
+            timings[step.name] = time.time() - start
+            logging.info(
+                f'Step {step.name} took {timings[step.name]:.1f}s')
+
+    with ThreadPoolExecutor(max_workers) as pool:
+        while pending or running:
+            for step in [s for s in pending
+                         if all(d in results for d in s.depends_on)]:
+                pending.remove(step)
+                kwargs = {d: results[d] for d in step.depends_on}
+                running[pool.submit(timed, step, kwargs)] = step
+
+            if not running:
+                raise ValueError(
+                    f'Circular dependencies between '
+                    f'{[s.name for s in pending]}')
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                try:
+                    results[step.name] = future.result()
+                except Exception as e:
+                    # Let the steps in flight finish, but start no new ones
+                    wait(running)
+                    raise StepError(step.name, e, timings) from e
+    return results, timings
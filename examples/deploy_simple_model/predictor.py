@@ -8,3 +8,8 @@ class Predictor:
         # the request.payload pattern
         req = request.payload
         return self.model(req["text"])[0]
+
+    async def predict_batch(self, requests):
+        # Only used if the server runs with BUDGET_MAX_BATCH_SIZE > 1
+        texts = [req.payload["text"] for req in requests]
+        return self.model(texts)
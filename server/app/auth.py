@@ -0,0 +1,204 @@
+"""API keys, with rate limits and quotas per key.
+
+Keys are configured as `BUDGET_API_KEYS`, `name=sha256[:rate[:burst[:quota]]]`
+separated by commas, with the SHA-256 hex digest of each key, so the keys
+themselves are not part of the server's environment. `BUDGET_TOKEN`, the
+token handed out by `/token`, is the key `default`.
+
+A key is found by the digest of the presented token in a dict built once at
+startup, and checked with a constant-time comparison. Rate limits are token
+buckets (`rate` requests per second, up to `burst` at once), quotas are
+requests per `BUDGET_QUOTA_PERIOD` seconds. Both are shared by all workers
+of the server through a file in shared memory with one slot per key, each
+locked on its own, so a busy key does not hold up the others.
+"""
+import fcntl
+import glob
+import hashlib
+import hmac
+import mmap
+import os
+import struct
+from typing import Dict, List, Optional, Text
+
+from private import open_private
+
+# Defaults of keys that do not set their own, 0 is unlimited
+RATE_LIMIT = float(os.getenv('BUDGET_RATE_LIMIT', '0'))
+RATE_BURST = float(os.getenv('BUDGET_RATE_BURST', '0'))
+QUOTA = int(os.getenv('BUDGET_QUOTA', '0'))
+QUOTA_PERIOD = float(os.getenv('BUDGET_QUOTA_PERIOD', '86400'))
+# in a directory private to the server's user, see private.py
+LIMITS_PATH = os.getenv(
+    'BUDGET_RATE_LIMITS_PATH', '/dev/shm/budgetml_limits/rate_limits')
+
+# Tokens left, time of the last refill, requests in the quota period and
+# the period
+SLOT = struct.Struct('=dddd')
+
+
+class ApiKey:
+    def __init__(self, name: Text, digest: Text, rate: float = RATE_LIMIT,
+                 burst: float = RATE_BURST, quota: int = QUOTA,
+                 slot: int = 0):
+        """
+        :param digest: SHA-256 hex digest of the key.
+        :param rate: requests per second, refilling the bucket.
+        :param burst: requests at once, the size of the bucket. Defaults to
+        one second's worth.
+        :param quota: requests per quota period.
+        :param slot: index of the key in the shared limits file.
+        """
+        self.name = name
+        self.digest = digest
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.quota = quota
+        self.slot = slot
+
+    @property
+    def limited(self) -> bool:
+        return self.rate > 0 or self.quota > 0
+
+
+class RateLimitError(Exception):
+    def __init__(self, reason: Text, retry_after: float):
+        """
+        :param reason: `rate_limit` or `quota`.
+        :param retry_after: seconds until the request would be allowed.
+        """
+        super().__init__(f'{reason} exceeded, retry in {retry_after:.1f}s')
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def hash_key(key: Text) -> Text:
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def parse_api_keys(spec: Text) -> List[ApiKey]:
+    keys = []
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, limits = entry.partition('=')
+        parts = limits.split(':')
+        if not name or len(parts) > 4 or len(parts[0]) != 64:
+            raise ValueError(f'Invalid API key {name}, expected '
+                             f'name=sha256[:rate[:burst[:quota]]]')
+        digest, rate, burst, quota = parts + [''] * (4 - len(parts))
+        keys.append(ApiKey(
+            name, digest.lower(),
+            rate=float(rate) if rate else RATE_LIMIT,
+            burst=float(burst) if burst else RATE_BURST,
+            quota=int(quota) if quota else QUOTA,
+            slot=len(keys)))
+    return keys
+
+
+class LimitStore:
+    def __init__(self, path: Text, slots: int,
+                 quota_period: float = QUOTA_PERIOD):
+        """
+        Rate limit and quota state of all keys, shared by the workers. The
+        file is opened on first use, so that every worker maps its own.
+
+        :param path: file, preferably on a tmpfs like /dev/shm.
+        :param slots: number of keys.
+        """
+        self.path = path
+        self.size = max(slots, 1) * SLOT.size
+        self.quota_period = quota_period
+        self.fd = None
+        self.mmap = None
+
+    def _open(self):
+        self.fd = open_private(self.path)
+        if os.fstat(self.fd).st_size < self.size:
+            # new slots are zeros, i.e. full buckets
+            os.ftruncate(self.fd, self.size)
+        self.mmap = mmap.mmap(self.fd, self.size)
+
+    def acquire(self, key: ApiKey, now: float):
+        """Takes a request from the key's bucket and quota.
+
+        :raises RateLimitError: if either is used up.
+        """
+        if self.mmap is None:
+            self._open()
+        offset = key.slot * SLOT.size
+        error = None
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, SLOT.size, offset)
+        try:
+            tokens, updated, used, period = SLOT.unpack_from(
+                self.mmap, offset)
+            if key.rate > 0:
+                tokens = key.burst if updated == 0 else min(
+                    key.burst, tokens + (now - updated) * key.rate)
+                updated = now
+            current = now // self.quota_period
+            if period != current:
+                used, period = 0, current
+            if key.quota > 0 and used >= key.quota:
+                error = RateLimitError(
+                    'quota', (current + 1) * self.quota_period - now)
+            elif key.rate > 0 and tokens < 1:
+                error = RateLimitError('rate_limit', (1 - tokens) / key.rate)
+            else:
+                tokens -= 1
+                used += 1
+            SLOT.pack_into(self.mmap, offset, tokens, updated, used, period)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, SLOT.size, offset)
+        if error is not None:
+            raise error
+
+
+class Authenticator:
+    def __init__(self, keys: List[ApiKey], store: LimitStore):
+        # digests are unique, tokens are looked up by theirs
+        self.keys: Dict[Text, ApiKey] = {key.digest: key for key in keys}
+        self.store = store
+
+    def authenticate(self, token: Optional[Text]) -> Optional[ApiKey]:
+        if not token:
+            return None
+        digest = hash_key(token)
+        key = self.keys.get(digest)
+        if key is None or not hmac.compare_digest(key.digest, digest):
+            return None
+        return key
+
+    def check(self, key: ApiKey, now: float):
+        """:raises RateLimitError: if the key is over its limits."""
+        if key.limited:
+            self.store.acquire(key, now)
+
+
+def create_authenticator(spec: Text, token: Optional[Text] = None,
+                         path: Text = LIMITS_PATH) -> Authenticator:
+    """
+    :param spec: `BUDGET_API_KEYS`.
+    :param token: key with the default limits, named `default`.
+    :param path: prefix of the limits file. Its name includes a hash of the
+    keys, so that a changed configuration starts from fresh slots.
+    """
+    if token:
+        spec = f'default={hash_key(token)},{spec}'
+    keys = parse_api_keys(spec)
+    if len({key.digest for key in keys}) < len(keys):
+        raise ValueError('API keys have to be unique')
+    limits = ','.join(
+        f'{key.digest}:{key.rate}:{key.burst}:{key.quota}' for key in keys)
+    store = LimitStore(f'{path}-{hash_key(limits)[:12]}', len(keys))
+    return Authenticator(keys, store)
+
+
+def remove_limits(path: Text = LIMITS_PATH):
+    """Limits files of a previous run."""
+    for name in glob.glob(f'{path}-*'):
+        try:
+            os.unlink(name)
+        except OSError:
+            pass
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from typing import Any, Callable, List, Tuple
+
+
+class Batcher:
+    def __init__(self,
+                 predict_batch: Callable,
+                 max_batch_size: int = 8,
+                 max_wait_ms: float = 5):
+        """
+        Collects concurrent requests of one worker into batches and runs
+        them through a single `predict_batch` call.
+
+        :param predict_batch: coroutine function taking a list of requests
+        and returning a list of responses of the same length.
+        :param max_batch_size: flush once this many requests are queued.
+        :param max_wait_ms: flush at the latest this many milliseconds
+        after the first request of a batch arrived.
+        """
+        assert max_batch_size > 0
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = None
+        self.task = None
+
+    def start(self):
+        # The queue has to be created inside the running event loop.
+        self.queue = asyncio.Queue()
+        self.task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def submit(self, request: Any) -> Any:
+        """Queues a request and waits for its slice of the batch result."""
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((request, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[Any, asyncio.Future]]:
+        loop = asyncio.get_event_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(
+                    await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush(self, batch: List[Tuple[Any, asyncio.Future]]):
+        requests = [request for request, _ in batch]
+        try:
+            responses = await self.predict_batch(requests)
+            if len(responses) != len(requests):
+                raise ValueError(
+                    f'predict_batch returned {len(responses)} responses for '
+                    f'{len(requests)} requests')
+        except Exception as e:
+            logging.exception('Batch prediction failed')
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), response in zip(batch, responses):
+            # The client may have gone away while the batch was running.
+            if not future.done():
+                future.set_result(response)
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            logging.debug(f'Flushing batch of size {len(batch)}')
+            await self._flush(batch)
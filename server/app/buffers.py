@@ -0,0 +1,188 @@
+"""Reusable buffers in shared memory for large request bodies.
+
+An .npy request body of at least `BUDGET_SHM_MIN_BYTES` is streamed
+straight into one of these buffers, and the predictor gets an array viewing
+the buffer: there is no copy of the body as bytes, and none for decoding.
+With inference workers, the array is passed on as a handle (file, offset,
+dtype and shape), which the inference worker maps.
+
+Each HTTP worker keeps up to `BUDGET_SHM_BUFFERS` idle buffers for later
+requests, so large requests do not allocate memory every time. As all
+workers share the size of /dev/shm (the `shm_size` of the container), no
+buffer is kept once less than a quarter of it is free. A buffer is
+only reused once nothing in the HTTP worker refers to the arrays of its last
+request any more, so a predictor may keep them. Inference workers can not
+be tracked from here: they give arrays they keep their own copy before the
+call returns, see `inference.detach`.
+"""
+import atexit
+import glob
+import logging
+import mmap
+import os
+import sys
+from collections import OrderedDict
+from typing import Any, Optional, Text, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SHM_DIR = os.getenv('BUDGET_SHM_DIR', '/dev/shm')
+SHM_MIN_BYTES = int(os.getenv('BUDGET_SHM_MIN_BYTES', str(64 * 1024)))
+MAX_IDLE = int(os.getenv('BUDGET_SHM_BUFFERS', '2'))
+PREFIX = 'budgetml-buffer-'
+
+# Sizes are rounded up to this, so that similar requests share buffers
+GRANULARITY = 1024 * 1024
+
+
+class Buffer:
+    def __init__(self, path: Text, size: int):
+        """A file in shared memory, mapped writable."""
+        self.path = path
+        self.size = size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            # Fails now rather than with SIGBUS on a write if the tmpfs is
+            # full
+            os.posix_fallocate(fd, 0, size)
+            self.mmap = mmap.mmap(fd, size)
+        except BaseException:
+            os.close(fd)
+            os.unlink(path)
+            raise
+        os.close(fd)
+        # All arrays handed out are views of this one, which they keep
+        # referenced as their base
+        self.root = np.frombuffer(self.mmap, dtype=np.uint8)
+        self.address = self.root.ctypes.data
+
+    def view(self, offset: int, dtype: Any, shape: Tuple,
+             fortran_order: bool = False) -> Any:
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape, dtype=np.int64))
+        return self.root[offset:offset + count * dtype.itemsize] \
+            .view(dtype).reshape(shape, order='F' if fortran_order else 'C')
+
+    def in_use(self) -> bool:
+        # self.root and the argument of getrefcount
+        return sys.getrefcount(self.root) > 2
+
+    def close(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        if not self.in_use():
+            # otherwise the mapping goes once the arrays are collected
+            self.root = None
+            self.mmap.close()
+
+
+class BufferPool:
+    def __init__(self, max_idle: int = MAX_IDLE, directory: Text = SHM_DIR):
+        """
+        Buffers of this process.
+
+        :param max_idle: buffers kept for later requests when released.
+        Beyond that, still referenced ones and then the least recently used
+        ones are closed.
+        """
+        self.max_idle = max_idle
+        self.directory = directory
+        self.idle = OrderedDict()
+        self.referenced = OrderedDict()
+        self.used = {}
+        self.created = 0
+
+    @property
+    def enabled(self) -> bool:
+        return np is not None and self.max_idle > 0
+
+    def acquire(self, nbytes: int) -> Buffer:
+        """A buffer of at least `nbytes`, and at most twice as large if an
+        idle one is reused."""
+        self._collect()
+        fits = [b for b in self.idle.values()
+                if nbytes <= b.size <= 2 * max(nbytes, GRANULARITY)]
+        if fits:
+            buffer = min(fits, key=lambda b: b.size)
+            del self.idle[buffer.path]
+        else:
+            size = -(-max(nbytes, 1) // GRANULARITY) * GRANULARITY
+            self.created += 1
+            buffer = Buffer(os.path.join(
+                self.directory,
+                f'{PREFIX}{os.getpid()}-{self.created}'), size)
+        self.used[buffer.address] = buffer
+        return buffer
+
+    def release(self, buffer: Buffer):
+        """Keeps the buffer for later requests. One whose arrays are still
+        referenced is only reused once they are gone, e.g. a thread of the
+        executor may hold the request a moment longer."""
+        self.used.pop(buffer.address, None)
+        if buffer.in_use():
+            self.referenced[buffer.path] = buffer
+        elif self._low_on_space():
+            buffer.close()
+        else:
+            self.idle[buffer.path] = buffer
+        self._trim()
+
+    def _low_on_space(self) -> bool:
+        """Whether less than a quarter of the file system is free, which is
+        left to other workers and requests."""
+        try:
+            st = os.statvfs(self.directory)
+        except OSError:
+            return False
+        return st.f_bavail * 4 < st.f_blocks
+
+    def _collect(self):
+        for path, buffer in list(self.referenced.items()):
+            if not buffer.in_use():
+                del self.referenced[path]
+                self.idle[path] = buffer
+
+    def _trim(self):
+        while len(self.idle) + len(self.referenced) > self.max_idle:
+            if self.referenced:
+                # e.g. kept by the predictor, which must not see it change
+                path, buffer = self.referenced.popitem(last=False)
+                logging.debug(f'{path} is still referenced, dropping it')
+            else:
+                _, buffer = self.idle.popitem(last=False)
+            buffer.close()
+
+    def find(self, array: Any) -> Optional[Tuple[Buffer, int]]:
+        """The buffer in use that holds a contiguous array, and the offset
+        of the array in it."""
+        if not isinstance(array.base, np.ndarray) or not (
+                array.flags.c_contiguous or array.flags.f_contiguous):
+            return None
+        buffer = self.used.get(array.base.ctypes.data)
+        if buffer is None or buffer.root is not array.base:
+            return None
+        return buffer, array.ctypes.data - buffer.address
+
+    def close(self):
+        for buffers in (self.idle, self.referenced, self.used):
+            for buffer in buffers.values():
+                buffer.close()
+            buffers.clear()
+
+
+def remove_buffers(pid: Any = '*', directory: Text = SHM_DIR):
+    """Files of buffers left behind, e.g. by a worker that was killed."""
+    for path in glob.glob(os.path.join(directory, f'{PREFIX}{pid}-*')):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+POOL = BufferPool()
+atexit.register(POOL.close)
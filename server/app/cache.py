@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Text
+
+from private import open_private
+
+# Returned by `get` on a miss, as None is a valid prediction
+MISSING = object()
+
+
+def _canonical(obj: Any) -> Any:
+    # Binary values, e.g. arrays decoded from msgpack or .npy bodies
+    if hasattr(obj, 'tobytes') and hasattr(obj, 'dtype'):
+        return [str(obj.dtype), list(obj.shape),
+                hashlib.sha256(obj.tobytes()).hexdigest()]
+    if isinstance(obj, bytes):
+        return hashlib.sha256(obj).hexdigest()
+    return str(obj)
+
+
+def cache_key(payload: Any) -> Text:
+    """Canonical hash of a JSON-style request body: equal dicts give equal
+    keys regardless of key order or formatting."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'),
+                           default=_canonical)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class LRUCache:
+    def __init__(self, max_size: int = 1024, ttl: float = 300):
+        """
+        In-process cache with least-recently-used eviction and a time to
+        live per entry.
+
+        :param max_size: maximum number of entries.
+        :param ttl: seconds after which an entry expires.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.data = OrderedDict()
+
+    def get(self, key: Text) -> Any:
+        entry = self.data.get(key)
+        if entry is None:
+            return MISSING
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.data[key]
+            return MISSING
+        self.data.move_to_end(key)
+        return value
+
+    def set(self, key: Text, value: Any):
+        self.data[key] = (time.monotonic() + self.ttl, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+
+
+class SharedCache:
+    def __init__(self,
+                 path: Text = '/dev/shm/budgetml_cache/cache.sqlite',
+                 max_size: int = 1024,
+                 ttl: float = 300):
+        """
+        Same as LRUCache, but backed by an SQLite file so that all gunicorn
+        workers on the machine share one cache. Values must be picklable.
+
+        Values are unpickled, so whoever can write the file can run code in
+        the server: it is kept in a directory private to the user, and only
+        the user can read and write it.
+
+        :param path: database file, preferably on a tmpfs like /dev/shm.
+        Its directory is created if needed.
+        :param max_size: maximum number of entries.
+        :param ttl: seconds after which an entry expires.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        # SQLite creates its journal files with the mode of the database
+        os.close(open_private(path))
+        self.conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, '
+            'value BLOB, expires REAL, accessed REAL)')
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+
+    def get(self, key: Text) -> Any:
+        now = time.time()
+        row = self.conn.execute(
+            'SELECT value FROM cache WHERE key = ? AND expires > ?',
+            (key, now)).fetchone()
+        if row is None:
+            return MISSING
+        self.conn.execute(
+            'UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        return pickle.loads(row[0])
+
+    def set(self, key: Text, value: Any):
+        now = time.time()
+        self.conn.execute(
+            'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+            (key, pickle.dumps(value), now + self.ttl, now))
+        self.conn.execute(
+            'DELETE FROM cache WHERE expires <= ? OR key IN (SELECT key FROM '
+            'cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+            (now, self.max_size))
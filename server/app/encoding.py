@@ -0,0 +1,349 @@
+import inspect
+import io
+import json
+import logging
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, Text, \
+    Tuple
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import APIRoute
+from starlette.background import BackgroundTask
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+from buffers import POOL, SHM_MIN_BYTES, Buffer, BufferPool
+
+# All of these are optional: formats whose library is missing are simply
+# not negotiated.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+NPY = 'application/x-npy'
+# Larger .npy bodies are rejected by routes that buffer them
+MAX_BUFFERED_BYTES = int(
+    os.getenv('BUDGET_MAX_BUFFERED_BYTES', str(256 * 1024 * 1024)))
+SSE = 'text/event-stream'
+MEDIA_TYPES = {
+    JSON: JSON,
+    MSGPACK: MSGPACK,
+    'application/x-msgpack': MSGPACK,
+    NPY: NPY,
+}
+
+
+def _media_type(header: Optional[Text]) -> Text:
+    return (header or '').split(';')[0].strip().lower()
+
+
+def _is_binary(media_type: Text) -> bool:
+    # Binary formats whose library is installed
+    media_type = MEDIA_TYPES.get(media_type)
+    return (media_type == MSGPACK and msgpack is not None) or \
+           (media_type == NPY and np is not None)
+
+
+def _ndarray_hook(obj: dict) -> Any:
+    # Zero-copy view on the message buffer, no intermediate Python lists
+    if '__ndarray__' in obj and np is not None:
+        return np.frombuffer(
+            obj['__ndarray__'], dtype=obj['dtype']).reshape(obj['shape'])
+    return obj
+
+
+def _ndarray_default(obj: Any) -> Any:
+    if np is not None and isinstance(obj, np.ndarray):
+        obj = np.ascontiguousarray(obj)
+        return {'__ndarray__': obj.tobytes(), 'dtype': obj.dtype.str,
+                'shape': list(obj.shape)}
+    raise TypeError(f'Cannot serialize {type(obj)}')
+
+
+def _npy_header(data: bytes) -> Tuple[int, Tuple, bool, Any]:
+    """Offset of the data, shape, order and dtype of an .npy file."""
+    f = io.BytesIO(data)
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    elif version == (2, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    else:
+        raise ValueError(f'Unsupported .npy version {version}')
+    return f.tell(), shape, fortran_order, dtype
+
+
+def decode_body(body: bytes, media_type: Text) -> Any:
+    """Decodes a request body. An .npy body becomes
+    `{"payload": {"array": <ndarray>}}`, so it fits the Payload model."""
+    media_type = MEDIA_TYPES.get(media_type, JSON)
+    if media_type == MSGPACK:
+        return msgpack.unpackb(body, object_hook=_ndarray_hook, raw=False)
+    if media_type == NPY:
+        return {'payload': {'array': np.load(io.BytesIO(body))}}
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def negotiate(accept: Optional[Text]) -> Text:
+    """Picks the first supported media type of an Accept header."""
+    for value in (accept or '').split(','):
+        media_type = MEDIA_TYPES.get(_media_type(value))
+        if media_type == JSON or _is_binary(media_type):
+            return media_type
+    return JSON
+
+
+def encode_response(content: Any, accept: Optional[Text]) -> Response:
+    """Serializes a predictor result according to the Accept header.
+    Response objects are passed through untouched."""
+    if isinstance(content, Response):
+        return content
+
+    media_type = negotiate(accept)
+    if media_type == NPY and isinstance(content, np.ndarray):
+        buffer = io.BytesIO()
+        np.save(buffer, content, allow_pickle=False)
+        return Response(buffer.getvalue(), media_type=NPY)
+    if media_type == MSGPACK:
+        return Response(
+            msgpack.packb(content, default=_ndarray_default,
+                          use_bin_type=True),
+            media_type=MSGPACK)
+
+    if orjson is not None:
+        try:
+            return Response(
+                orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY),
+                media_type=JSON)
+        except TypeError:
+            # e.g. pydantic models, which only the FastAPI encoder knows
+            pass
+    custom_encoder = {}
+    if np is not None:
+        custom_encoder[np.ndarray] = lambda a: a.tolist()
+        custom_encoder[np.generic] = lambda a: a.item()
+    return Response(
+        json.dumps(jsonable_encoder(content, custom_encoder=custom_encoder)),
+        media_type=JSON)
+
+
+def is_stream(content: Any) -> bool:
+    """Whether a predictor returned a generator to be streamed."""
+    return inspect.isasyncgen(content) or inspect.isgenerator(content)
+
+
+def _chunk_text(chunk: Any) -> Text:
+    if isinstance(chunk, str):
+        return chunk
+    if isinstance(chunk, bytes):
+        return chunk.decode()
+    if orjson is not None:
+        return orjson.dumps(chunk, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    return json.dumps(jsonable_encoder(chunk))
+
+
+async def _events(chunks: AsyncIterator[Any]) -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+        lines = _chunk_text(chunk).split('\n')
+        yield ''.join(f'data: {line}\n' for line in lines).encode() + b'\n'
+    yield b'event: done\ndata: \n\n'
+
+
+async def _chunks(chunks: AsyncIterator[Any]) -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+        if isinstance(chunk, bytes):
+            yield chunk
+        elif isinstance(chunk, str):
+            yield chunk.encode()
+        else:
+            # Objects are sent as JSON lines
+            yield _chunk_text(chunk).encode() + b'\n'
+
+
+def stream_response(chunks: AsyncIterator[Any],
+                    accept: Optional[Text]) -> StreamingResponse:
+    """Streams generator output as server-sent events if the client
+    accepts them, and as a plain chunked response otherwise."""
+    # Keeps nginx from buffering the whole response
+    headers = {'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'}
+    if SSE in (accept or ''):
+        return StreamingResponse(
+            _events(chunks), media_type=SSE, headers=headers)
+    return StreamingResponse(
+        _chunks(chunks), media_type='text/plain',
+        headers=headers)
+
+
+def release_after(response: StreamingResponse,
+                  release: Callable[[], Any]) -> StreamingResponse:
+    """Calls `release` once the response was streamed, also if the stream
+    fails or the client goes away, possibly before it started."""
+    chunks = response.body_iterator
+    background = response.background
+
+    async def body():
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            release()
+
+    async def done():
+        try:
+            if background is not None:
+                await background()
+        finally:
+            release()
+
+    response.body_iterator = body()
+    response.background = BackgroundTask(done)
+    return response
+
+
+class EncodedRequest(Request):
+    @property
+    def content_type(self) -> Text:
+        """The media type sent by the client."""
+        return self.scope.get('budget.content_type', _media_type(
+            self.headers.get('content-type')))
+
+    async def json(self) -> Any:
+        if not hasattr(self, '_json'):
+            self._json = decode_body(await self.body(), self.content_type)
+        return self._json
+
+    async def read_into_buffer(self, pool: BufferPool,
+                               max_bytes: int = MAX_BUFFERED_BYTES
+                               ) -> Optional[Buffer]:
+        """
+        Streams a large .npy body into a buffer of the pool and decodes it
+        in place, see buffers.py. `json()` then returns an array viewing
+        the buffer, which has to be released once the response is sent.
+
+        :return: the buffer, None if the body is too small or of unknown
+        length, or if there is no buffer to be had.
+        :raises HTTPException: 413 if the body is larger than `max_bytes`.
+        """
+        try:
+            length = int(self.headers.get('content-length') or 0)
+        except ValueError:
+            raise HTTPException(
+                status_code=400, detail='Invalid Content-Length')
+        if length < SHM_MIN_BYTES:
+            return None
+        if length > max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f'Body is larger than {max_bytes} bytes')
+        try:
+            buffer = pool.acquire(length)
+        except OSError as e:
+            # e.g. /dev/shm is full
+            logging.warning(f'No buffer for a body of {length} bytes: '
+                            f'{str(e)}')
+            return None
+        try:
+            offset = 0
+            async for chunk in self.stream():
+                if offset + len(chunk) > length:
+                    raise HTTPException(
+                        status_code=400,
+                        detail='Body is longer than its Content-Length')
+                buffer.mmap[offset:offset + len(chunk)] = chunk
+                offset += len(chunk)
+            if offset != length:
+                raise HTTPException(
+                    status_code=400,
+                    detail='Body is shorter than its Content-Length')
+            try:
+                start, shape, fortran_order, dtype = _npy_header(
+                    buffer.mmap[:min(length, 16 * 1024)])
+            except ValueError as e:
+                raise HTTPException(
+                    status_code=400, detail=f'Invalid .npy body: {str(e)}')
+            if dtype.hasobject or start + dtype.itemsize * int(
+                    np.prod(shape, dtype=np.int64)) != length:
+                raise HTTPException(
+                    status_code=400,
+                    detail='.npy body has objects or a wrong size')
+        except BaseException:
+            pool.release(buffer)
+            raise
+        array = buffer.view(start, dtype, shape, fortran_order)
+        self._json = {'payload': {'array': array}}
+        # For anything reading the raw body, FastAPI only checks that there
+        # is one
+        self._body = memoryview(buffer.root[:length])
+        return buffer
+
+    def release_buffer(self, pool: BufferPool, buffer: Buffer):
+        del self._json, self._body
+        pool.release(buffer)
+
+
+class EncodedRoute(APIRoute):
+    # Routes reading large .npy bodies into pooled buffers set this to a
+    # check of the request, e.g. its authentication, that runs first, so
+    # that rejected requests do not take up shared memory
+    authenticate: Optional[Callable[[Request], Awaitable[Any]]] = None
+
+    def get_route_handler(self) -> Callable:
+        """
+        Lets FastAPI parse msgpack and .npy bodies like JSON ones: the
+        request claims to be JSON, and `json()` decodes the actual format.
+        Routes with `authenticate` read large .npy bodies into a pooled
+        buffer, which is released after the response is sent.
+        """
+        handler = super().get_route_handler()
+
+        async def encoded_handler(request: Request) -> Response:
+            scope = request.scope
+            media_type = _media_type(request.headers.get('content-type'))
+            if _is_binary(media_type):
+                scope['budget.content_type'] = media_type
+                scope['headers'] = [
+                    (k, v) for k, v in scope['headers']
+                    if k != b'content-type'
+                ] + [(b'content-type', JSON.encode())]
+            request = EncodedRequest(scope, request.receive)
+            buffer = None
+            if self.authenticate is not None and np is not None and \
+                    MEDIA_TYPES.get(media_type) == NPY and POOL.enabled:
+                await self.authenticate(request)
+                buffer = await request.read_into_buffer(POOL)
+            if buffer is None:
+                return await handler(request)
+
+            try:
+                response = await handler(request)
+            except BaseException:
+                request.release_buffer(POOL, buffer)
+                raise
+            # Streamed responses may still read the array until they end
+            background = response.background
+
+            async def release():
+                try:
+                    if background is not None:
+                        await background()
+                finally:
+                    request.release_buffer(POOL, buffer)
+
+            response.background = BackgroundTask(release)
+            return response
+
+        return encoded_handler
@@ -0,0 +1,135 @@
+import asyncio
+import inspect
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, \
+    ThreadPoolExecutor
+from typing import Any, Text
+
+from starlette.requests import Request
+
+from metrics import EXECUTOR_PENDING
+from uploads import StreamingUpload
+
+# Predictor of a process of a process pool. Each pool passes its own to the
+# processes it forks, which inherit it instead of unpickling it.
+_PREDICTOR: Any = None
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def _call(predictor: Any, method: Text, request: Any) -> Any:
+    fn = getattr(predictor, method)
+    if asyncio.iscoroutinefunction(fn):
+        # Blocking code inside a coroutine gets its own loop in this thread
+        return asyncio.run(fn(request))
+    return fn(request)
+
+
+def _init_process(predictor: Any):
+    global _PREDICTOR
+    _PREDICTOR = predictor
+
+
+def _call_in_process(method: Text, request: Any) -> Any:
+    return _call(_PREDICTOR, method, request)
+
+
+class PredictExecutor:
+    def __init__(self,
+                 predictor: Any,
+                 kind: Text = 'thread',
+                 max_workers: int = 1,
+                 max_queue: int = 64,
+                 offload_async: bool = False):
+        """
+        Runs blocking predictor methods off the event loop in a bounded
+        pool, so that other requests and the health check keep being served.
+
+        :param predictor: loaded predictor instance.
+        :param kind: `thread` or `process`. Process pools require picklable
+        requests and responses, e.g. the Payload of `/predict_dict/`.
+        :param max_workers: number of threads or processes.
+        :param max_queue: number of requests allowed to wait for a free
+        worker. Any further request raises QueueFullError.
+        :param offload_async: also offload `async` methods, for predictors
+        that block inside a coroutine. Except for calls with a live request
+        or stream (`/predict/`, streaming uploads), which can only be read
+        on the server's event loop.
+        """
+        assert kind in ('thread', 'process')
+        assert max_workers > 0 and max_queue >= 0
+        self.predictor = predictor
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.offload_async = offload_async
+        self.pending = 0
+        # calls in progress, including the ones not offloaded
+        self.active = 0
+        self._pool = None
+
+    @property
+    def pool(self) -> Executor:
+        if self._pool is None:
+            if self.kind == 'process':
+                # Bound to this predictor also for processes forked later,
+                # e.g. on demand, while other pools exist
+                self._pool = ProcessPoolExecutor(
+                    self.max_workers,
+                    mp_context=multiprocessing.get_context('fork'),
+                    initializer=_init_process,
+                    initargs=(self.predictor,))
+            else:
+                self._pool = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix='predict')
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    async def drain(self, timeout: float = 60):
+        """Waits for the calls in progress to finish, e.g. before the
+        predictor is replaced."""
+        deadline = time.monotonic() + timeout
+        while self.active and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return self.active == 0
+
+    async def __call__(self, method: Text, request: Any) -> Any:
+        self.active += 1
+        try:
+            return await self._call(method, request)
+        finally:
+            self.active -= 1
+
+    async def _call(self, method: Text, request: Any) -> Any:
+        fn = getattr(self.predictor, method)
+        if inspect.isasyncgenfunction(fn):
+            # Only creates the generator, it is consumed by the response
+            return fn(request)
+        if asyncio.iscoroutinefunction(fn) and (
+                not self.offload_async or
+                isinstance(request, (Request, StreamingUpload))):
+            return await fn(request)
+
+        # Only touched from the event loop thread, so no lock needed
+        if self.pending >= self.max_workers + self.max_queue:
+            raise QueueFullError(
+                f'{self.pending} requests are already pending')
+        self.pending += 1
+        EXECUTOR_PENDING.inc()
+        try:
+            loop = asyncio.get_event_loop()
+            if self.kind == 'process':
+                return await loop.run_in_executor(
+                    self.pool, _call_in_process, method, request)
+            return await loop.run_in_executor(
+                self.pool, _call, self.predictor, method, request)
+        finally:
+            self.pending -= 1
+            EXECUTOR_PENDING.dec()
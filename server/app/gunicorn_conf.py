@@ -1,6 +1,11 @@
 import json
 import multiprocessing
 import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
 
 workers_per_core_str = os.getenv("WORKERS_PER_CORE", "1")
 max_workers_str = os.getenv("MAX_WORKERS")
@@ -35,6 +40,11 @@ use_errorlog = errorlog_var or None
 graceful_timeout_str = os.getenv("GRACEFUL_TIMEOUT", "300")
 timeout_str = os.getenv("TIMEOUT", "300")
 keepalive_str = os.getenv("KEEP_ALIVE", "600")
+preload_str = os.getenv("BUDGET_PRELOAD", "0")
+# Workers write their metrics here so /metrics can aggregate all of them.
+# This has to be set before the app (and prometheus_client) is imported.
+metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", "/dev/shm/budgetml_metrics")
 
 # Gunicorn config variables
 loglevel = use_loglevel
@@ -46,6 +56,16 @@ accesslog = use_accesslog
 graceful_timeout = int(graceful_timeout_str)
 timeout = int(timeout_str)
 keepalive = int(keepalive_str)
+preload_app = preload_str == "1"
+# Inherited by the workers, to report ready only once all of them are
+os.environ["BUDGET_WORKERS"] = str(workers)
+# Inference workers shared by the HTTP workers, see inference.py
+inference_workers = int(os.getenv("BUDGET_INFERENCE_WORKERS", "0"))
+# Same default as inference.py, which is not imported by the master
+inference_socket = os.getenv(
+    "BUDGET_INFERENCE_SOCKET", "/tmp/budgetml/inference.sock")
+inference_process = None
+stopping = False
 
 # For debugging and testing
 log_data = {
@@ -55,6 +75,9 @@ log_data = {
     "graceful_timeout": graceful_timeout,
     "timeout": timeout,
     "keepalive": keepalive,
+    "preload_app": preload_app,
+    "metrics_dir": metrics_dir,
+    "inference_workers": inference_workers,
     "errorlog": errorlog,
     "accesslog": accesslog,
     # Additional, non-gunicorn variables
@@ -64,3 +87,60 @@ log_data = {
     "port": port,
 }
 print(json.dumps(log_data))
+
+
+# Gunicorn server hooks
+def on_starting(server):
+    # Drop metrics of a previous run
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+    # and their rate limits
+    from auth import remove_limits
+    remove_limits()
+    if inference_workers > 0:
+        global inference_process
+        inference_process = start_inference()
+        threading.Thread(
+            target=watch_inference, args=(server,), daemon=True).start()
+
+
+def start_inference():
+    return subprocess.Popen([
+        sys.executable,
+        os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                     "inference.py")])
+
+
+def watch_inference(server):
+    """Restarts the inference process if it dies, e.g. killed for memory, as
+    the HTTP workers can not serve without it."""
+    global inference_process
+    while True:
+        code = inference_process.wait()
+        if stopping:
+            return
+        server.log.warning(
+            f"Inference process exited with {code}, restarting it")
+        # /ready fails until the new process listens
+        try:
+            os.unlink(inference_socket)
+        except OSError:
+            pass
+        time.sleep(1)
+        inference_process = start_inference()
+
+
+def on_exit(server):
+    global stopping
+    stopping = True
+    if inference_process is not None:
+        inference_process.terminate()
+        inference_process.wait(graceful_timeout)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+    # Request buffers of the worker, in case it did not exit cleanly
+    from buffers import remove_buffers
+    remove_buffers(worker.pid)
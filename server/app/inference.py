@@ -0,0 +1,441 @@
+"""Inference workers shared by all HTTP workers of the server.
+
+With `BUDGET_INFERENCE_WORKERS` > 0, gunicorn starts this module as a
+separate process (see gunicorn_conf.py). It loads the predictor once and
+forks that many inference workers, which take calls from the HTTP workers
+over a unix socket, one at a time each. The HTTP workers then only handle
+connections, so both can be sized independently and the model is only held
+by the inference workers.
+
+Calls and results are pickled, except for NumPy arrays above
+`BUDGET_SHM_MIN_BYTES`. These are written once to a file in shared memory
+(`BUDGET_SHM_DIR`) and mapped by the receiving side instead of being copied
+through the socket. Arrays already in a pooled buffer (see buffers.py) are
+only referred to by their buffer and offset. Uploaded files are sent with
+their content and arrive as an UploadFile reading from memory.
+
+Live requests and streams, i.e. the Request of `/predict/` and the
+StreamingUpload of `/predict_image/` with `BUDGET_STREAM_UPLOADS`, can not
+be sent, these routes are not available with inference workers.
+"""
+import asyncio
+import gc
+import inspect
+import io
+import logging
+import mmap
+import os
+import pickle
+import signal
+import socket
+import struct
+import sys
+import tempfile
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, \
+    Text
+
+from starlette.datastructures import UploadFile
+
+from buffers import POOL, SHM_DIR, SHM_MIN_BYTES
+from executor import QueueFullError, _call
+from load import create_predictor, has_predict_batch
+from metrics import EXECUTOR_PENDING
+from private import private_directory
+from timeline import mark
+from warmup import get_warmup_requests
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Calls are unpickled, so only the server's user may connect
+SOCKET_PATH = os.getenv('BUDGET_INFERENCE_SOCKET',
+                        '/tmp/budgetml/inference.sock')
+SHM_PREFIX = 'budgetml-array-'
+# Array files not mapped by then were sent to a side that gave up on the
+# call, and are removed by the inference workers every SWEEP_INTERVAL
+ARRAY_MAX_AGE = float(os.getenv('BUDGET_SHM_ARRAY_MAX_AGE', '600'))
+SWEEP_INTERVAL = 60
+
+# Asks an inference worker for what the HTTP workers need to know about the
+# predictor
+DESCRIBE = '__describe__'
+
+# Length of the frame that follows
+HEADER = struct.Struct('!Q')
+
+
+class _Pickler(pickle.Pickler):
+    def __init__(self, file: Any, protocol: int,
+                 written: Optional[List[Text]] = None):
+        """:param written: collects the files of the arrays written."""
+        super().__init__(file, protocol)
+        self.written = written
+
+    def persistent_id(self, obj: Any) -> Optional[tuple]:
+        if isinstance(obj, UploadFile):
+            # read by the time the call is sent
+            obj.file.seek(0)
+            return 'upload', obj.filename, obj.content_type, obj.file.read()
+        if np is None or not isinstance(obj, np.ndarray) or \
+                obj.nbytes < SHM_MIN_BYTES or obj.dtype.hasobject:
+            return None
+        found = POOL.find(obj)
+        if found is not None:
+            # in use until the call returns, so it can be mapped as is
+            buffer, offset = found
+            order = 'C' if obj.flags.c_contiguous else 'F'
+            return 'buffer', buffer.path, offset, obj.dtype.str, obj.shape, \
+                order
+        fd, path = tempfile.mkstemp(prefix=SHM_PREFIX, dir=SHM_DIR)
+        if self.written is not None:
+            self.written.append(path)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(np.ascontiguousarray(obj).data)
+        return 'ndarray', path, obj.dtype.str, obj.shape
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file: Any, mapped: Optional[List[Any]] = None):
+        """:param mapped: collects the arrays mapping pooled buffers."""
+        super().__init__(file)
+        self.mapped = mapped
+
+    def persistent_load(self, pid: tuple) -> Any:
+        if pid[0] == 'upload':
+            _, filename, content_type, data = pid
+            return UploadFile(filename, io.BytesIO(data), content_type)
+        if pid[0] == 'buffer':
+            _, path, offset, dtype, shape, order = pid
+            array = np.memmap(path, dtype=dtype, mode='c', offset=offset,
+                              shape=shape, order=order)
+            if self.mapped is not None:
+                self.mapped.append(array)
+            return array
+        _, path, dtype, shape = pid
+        # copy-on-write, so that the receiver may modify it
+        array = np.memmap(path, dtype=dtype, mode='c', shape=shape)
+        # the mapping keeps the memory until the array is garbage collected
+        os.unlink(path)
+        return array
+
+
+def dumps(obj: Any, written: Optional[List[Text]] = None) -> bytes:
+    buffer = io.BytesIO()
+    _Pickler(buffer, pickle.HIGHEST_PROTOCOL, written).dump(obj)
+    data = buffer.getvalue()
+    return HEADER.pack(len(data)) + data
+
+
+def loads(data: bytes, mapped: Optional[List[Any]] = None) -> Any:
+    return _Unpickler(io.BytesIO(data), mapped).load()
+
+
+def detach(mapped: List[Any]):
+    """Gives arrays of pooled buffers that are still referenced, e.g. kept
+    by the predictor, their own copy of the data. The HTTP worker reuses
+    the buffer once the call returns, and the private mapping would show
+    the next request wherever it was not written to."""
+    while mapped:
+        array = mapped.pop()
+        # the local variable and the argument of getrefcount
+        if sys.getrefcount(array) > 2:
+            data = array.reshape(-1, order='A').view(np.uint8)
+            # a write to every page copies it
+            data[::mmap.PAGESIZE] += 0
+            data[-1:] += 0
+
+
+def remove_arrays(paths: List[Text]):
+    """Array files of a call that was not sent, or given up on. The other
+    side no longer needs them once it mapped them."""
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def remove_stale_arrays(max_age: float = 0):
+    """Arrays of calls that were cut off, e.g. by a crashed worker or a
+    client that went away before the result was read.
+
+    :param max_age: seconds since a file was written, 0 for all files.
+    """
+    now = time.time()
+    for name in os.listdir(SHM_DIR):
+        if not name.startswith(SHM_PREFIX):
+            continue
+        path = os.path.join(SHM_DIR, name)
+        try:
+            if not max_age or now - os.stat(path).st_mtime > max_age:
+                os.unlink(path)
+        except OSError:
+            pass
+
+
+def describe(predictor: Any) -> Dict[Text, Any]:
+    return {
+        'cacheable': getattr(predictor, 'cacheable', False),
+        'predict_batch': has_predict_batch(predictor),
+    }
+
+
+def iterate(chunks: Any) -> Iterator[Any]:
+    """Iterates a sync or async generator, the latter on its own loop."""
+    if not inspect.isasyncgen(chunks):
+        yield from chunks
+        return
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(chunks.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(chunks.aclose())
+        loop.close()
+
+
+def send(wfile: Any, kind: Text, obj: Any = None):
+    written = []
+    try:
+        data = dumps((kind, obj), written)
+    except Exception as e:
+        remove_arrays(written)
+        if kind != 'error':
+            raise
+        # e.g. an exception holding a lock
+        data = dumps(('error', RuntimeError(repr(e))))
+    try:
+        wfile.write(data)
+        wfile.flush()
+    except BaseException:
+        remove_arrays(written)
+        raise
+
+
+def handle(predictor: Any, conn: socket.socket):
+    """Serves one call: a result, a stream of chunks or an error."""
+    with conn, conn.makefile('rb') as rfile, conn.makefile('wb') as wfile:
+        header = rfile.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return
+        mapped = []
+        method, request = loads(
+            rfile.read(HEADER.unpack(header)[0]), mapped)
+        try:
+            if method == DESCRIBE:
+                result = describe(predictor)
+            else:
+                result = _call(predictor, method, request)
+            request = None
+            if inspect.isasyncgen(result) or inspect.isgenerator(result):
+                send(wfile, 'stream')
+                for chunk in iterate(result):
+                    send(wfile, 'chunk', chunk)
+                detach(mapped)
+                send(wfile, 'end')
+            else:
+                detach(mapped)
+                send(wfile, 'result', result)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client went away
+            request = None
+            detach(mapped)
+        except Exception as e:
+            logging.exception(f'Inference call {method} failed')
+            request = None
+            detach(mapped)
+            try:
+                send(wfile, 'error', e)
+            except OSError:
+                pass
+
+
+def warm_up(predictor: Any):
+    requests = get_warmup_requests(predictor)
+    if hasattr(predictor, 'warmup'):
+        _call(predictor, 'warmup', requests)
+    else:
+        for request in requests:
+            result = _call(predictor, 'predict', request)
+            if inspect.isasyncgen(result) or inspect.isgenerator(result):
+                for _ in iterate(result):
+                    pass
+
+
+def run_worker(predictor: Any, sock: socket.socket):
+    if hasattr(predictor, 'post_fork'):
+        # Re-create state that does not survive a fork (threads, sessions)
+        predictor.post_fork()
+    if os.getenv('BUDGET_WARMUP', '1') == '1':
+        start = time.perf_counter()
+        try:
+            warm_up(predictor)
+            mark('warmed_up', seconds=round(time.perf_counter() - start, 3))
+        except Exception:
+            logging.exception('Warmup failed')
+    # Only accepts once warm, idle workers take the next connection
+    swept = time.monotonic()
+    while True:
+        conn, _ = sock.accept()
+        handle(predictor, conn)
+        if time.monotonic() - swept > SWEEP_INTERVAL:
+            swept = time.monotonic()
+            remove_stale_arrays(ARRAY_MAX_AGE)
+
+
+def serve(workers: int, socket_path: Text = SOCKET_PATH):
+    """Loads the predictor and keeps `workers` inference workers running,
+    which share it copy-on-write."""
+    remove_stale_arrays()
+    predictor = create_predictor(
+        os.environ['BUDGET_PREDICTOR_PATH'],
+        os.getenv('BUDGET_PREDICTOR_ENTRYPOINT', 'Predictor'))
+    mark('predictor_loaded')
+    # Keeps the workers' collections from copying the shared pages
+    gc.collect()
+    gc.freeze()
+
+    private_directory(os.path.dirname(socket_path))
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    sock.listen(1024)
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                run_worker(predictor, sock)
+            except Exception:
+                logging.exception('Inference worker failed')
+                code = 1
+            finally:
+                os._exit(code)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+
+    while children:
+        pid, status = os.wait()
+        children.discard(pid)
+        if not stopping:
+            logging.warning(f'Inference worker {pid} exited with {status}, '
+                            f'restarting it')
+            spawn()
+    sock.close()
+    os.unlink(socket_path)
+
+
+class RemotePredictor:
+    """Stands in for the predictor in the HTTP workers, which only forward
+    calls to the inference workers."""
+    cacheable = False
+
+
+class RemoteExecutor:
+    def __init__(self, socket_path: Text = SOCKET_PATH,
+                 max_pending: int = 64):
+        """
+        Same interface as PredictExecutor, but runs the calls in the
+        inference workers.
+
+        :param max_pending: calls allowed to be in progress or waiting for
+        a free inference worker. Any further call raises QueueFullError.
+        """
+        self.socket_path = socket_path
+        self.max_pending = max_pending
+        self.pending = 0
+        self.active = 0
+
+    async def _read(self, reader: asyncio.StreamReader) -> tuple:
+        header = await reader.readexactly(HEADER.size)
+        return loads(await reader.readexactly(HEADER.unpack(header)[0]))
+
+    async def _stream(self, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter) -> AsyncIterator[Any]:
+        try:
+            while True:
+                kind, chunk = await self._read(reader)
+                if kind == 'end':
+                    return
+                if kind == 'error':
+                    raise chunk
+                yield chunk
+        finally:
+            writer.close()
+
+    async def __call__(self, method: Text, request: Any) -> Any:
+        if self.pending >= self.max_pending:
+            raise QueueFullError(
+                f'{self.pending} requests are already pending')
+        self.pending += 1
+        self.active += 1
+        EXECUTOR_PENDING.inc()
+        try:
+            try:
+                reader, writer = await asyncio.open_unix_connection(
+                    self.socket_path)
+            except (FileNotFoundError, ConnectionRefusedError) as e:
+                raise QueueFullError(
+                    f'inference workers are not available: {str(e)}')
+            written = []
+            try:
+                writer.write(dumps((method, request), written))
+                kind, result = await self._read(reader)
+            except BaseException:
+                writer.close()
+                # unless already mapped by the inference worker
+                remove_arrays(written)
+                raise
+        finally:
+            self.pending -= 1
+            self.active -= 1
+            EXECUTOR_PENDING.dec()
+
+        if kind == 'stream':
+            # the connection stays open until the stream is consumed
+            return self._stream(reader, writer)
+        writer.close()
+        if kind == 'error':
+            raise result
+        return result
+
+    async def describe(self) -> Dict[Text, Any]:
+        return await self(DESCRIBE, None)
+
+    async def drain(self, timeout: float = 60):
+        deadline = time.monotonic() + timeout
+        while self.active and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return self.active == 0
+
+    def shutdown(self):
+        pass
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    serve(int(os.getenv('BUDGET_INFERENCE_WORKERS', '1')))
@@ -1,17 +1,34 @@
+import base64
+import fcntl
+import hashlib
+import logging
+import os
 import sys
 from importlib import util
 from importlib.machinery import SourceFileLoader
-from tempfile import NamedTemporaryFile
-from typing import Text, Type, Any
+from typing import Text, Type, Any, Dict, Iterable, Tuple, Optional
 
+from google.api_core.exceptions import PreconditionFailed
 from google.cloud import storage
 
+CACHE_DIR = os.getenv('BUDGET_CACHE_DIR', '/root/.cache/budgetml')
 
-def import_class_from_source(source_path: Text, class_name: Text) -> Type[Any]:
+_STORAGE_CLIENT: Optional[storage.Client] = None
+
+
+def get_storage_client() -> storage.Client:
+    global _STORAGE_CLIENT
+    if _STORAGE_CLIENT is None:
+        _STORAGE_CLIENT = storage.Client()
+    return _STORAGE_CLIENT
+
+
+def import_class_from_source(source_path: Text, class_name: Text,
+                             module_name: Text = 'user_module') -> Type[Any]:
     """Imports a class from a module provided as source file."""
     try:
         loader = SourceFileLoader(
-            fullname='user_module',
+            fullname=module_name,
             path=source_path,
         )
         spec = util.spec_from_loader(
@@ -26,13 +43,25 @@ def import_class_from_source(source_path: Text, class_name: Text) -> Type[Any]:
                 class_name, source_path))
 
 
-def download_blob(bucket_name, source_blob_name, destination_file_name):
-    """Downloads a blob from the bucket."""
+def split_gcs_path(path: Text) -> Tuple[Text, Text]:
+    assert path.startswith('gs://')
+    bucket_name = path.replace('gs://', '').split('/')[0]
+    source_blob_name = '/'.join(path.replace('gs://', '').split('/')[1:])
+    return bucket_name, source_blob_name
+
+
+def download_blob(bucket_name, source_blob_name, destination_file_name,
+                  generation=None):
+    """Downloads a blob from the bucket.
+
+    :param generation: only download this generation of the blob, raises
+    PreconditionFailed if it was overwritten since.
+    """
     # bucket_name = "your-bucket-name"
     # source_blob_name = "storage-object-name"
     # destination_file_name = "local/path/to/file"
 
-    storage_client = storage.Client()
+    storage_client = get_storage_client()
 
     bucket = storage_client.bucket(bucket_name)
 
@@ -41,7 +70,8 @@ def download_blob(bucket_name, source_blob_name, destination_file_name):
     # any content from Google Cloud Storage. As we don't need additional data,
     # using `Bucket.blob` is preferred here.
     blob = bucket.blob(source_blob_name)
-    blob.download_to_filename(destination_file_name)
+    blob.download_to_filename(
+        destination_file_name, if_generation_match=generation)
 
     print(
         "Blob {} downloaded to {}.".format(
@@ -50,15 +80,162 @@ def download_blob(bucket_name, source_blob_name, destination_file_name):
     )
 
 
-def get_predictor_class(path: Text, entrypoint: Text):
-    assert path.startswith('gs://')
-    bucket_name = path.replace('gs://', '').split('/')[0]
-    source_blob_name = '/'.join(path.replace('gs://', '').split('/')[1:])
+def _content_key(bucket_name: Text, source_blob_name: Text) -> Text:
+    """Returns a key identifying the current content of a blob. Only fetches
+    the blob metadata, not the content."""
+    return _blob_key(_get_blob(bucket_name, source_blob_name))
+
+
+def _get_blob(bucket_name: Text, source_blob_name: Text) -> storage.Blob:
+    blob = get_storage_client().bucket(bucket_name).get_blob(source_blob_name)
+    if blob is None:
+        raise FileNotFoundError(f'gs://{bucket_name}/{source_blob_name}')
+    return blob
+
+
+def _blob_key(blob: storage.Blob) -> Text:
+    bucket_name, source_blob_name = blob.bucket.name, blob.name
+    if blob.md5_hash:
+        return base64.b64decode(blob.md5_hash).hex()
+    # Composite objects have no md5, but the generation changes on every
+    # overwrite of the blob
+    return hashlib.md5(
+        f'{bucket_name}/{source_blob_name}#{blob.generation}'.encode()
+    ).hexdigest()
+
+
+def cached_download(path: Text, attempts: int = 3) -> Text:
+    """
+    Downloads a gs:// path into the local cache, unless its current content
+    is already cached, and returns the local file path.
+
+    Files are stored under the md5 of their content, so unchanged blobs are
+    never downloaded twice. Only the generation whose md5 was fetched is
+    downloaded, so a blob overwritten in between is not stored under the
+    key of the previous content; it is checked again instead. Concurrent
+    workers share one download via a file lock. If GCS cannot be reached,
+    the last cached version is used.
+
+    :param attempts: times the blob is checked and downloaded if it keeps
+    being overwritten meanwhile.
+    """
+    bucket_name, source_blob_name = split_gcs_path(path)
+    _, extension = os.path.splitext(source_blob_name)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+
+    # Remembers the content key last seen for this path, for offline starts
+    ref_path = os.path.join(
+        CACHE_DIR, hashlib.md5(path.encode()).hexdigest() + '.ref')
+
+    for attempt in range(attempts):
+        generation = None
+        try:
+            blob = _get_blob(bucket_name, source_blob_name)
+            key, generation = _blob_key(blob), blob.generation
+        except FileNotFoundError:
+            raise
+        except Exception as e:
+            if not os.path.exists(ref_path):
+                raise
+            with open(ref_path, 'r') as f:
+                key = f.read().strip()
+            logging.warning(f'Could not check {path} with: {str(e)}. '
+                            f'Using cached version.')
+
+        local_path = os.path.join(CACHE_DIR, key + extension)
+        try:
+            _download_once(bucket_name, source_blob_name, local_path,
+                           generation)
+        except PreconditionFailed:
+            if attempt == attempts - 1:
+                raise
+            logging.info(f'{path} was overwritten while downloading it, '
+                         f'checking it again')
+            continue
+
+        with open(ref_path, 'w') as f:
+            f.write(key)
+        return local_path
+
+
+def _download_once(bucket_name: Text, source_blob_name: Text,
+                   local_path: Text, generation: Optional[int]):
+    if os.path.exists(local_path):
+        logging.debug(f'Using cached gs://{bucket_name}/{source_blob_name} '
+                      f'at {local_path}')
+        return
+    with open(local_path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            # Another worker may have finished while we were waiting
+            if not os.path.exists(local_path):
+                tmp_path = f'{local_path}.{os.getpid()}.tmp'
+                try:
+                    download_blob(bucket_name, source_blob_name, tmp_path,
+                                  generation)
+                except BaseException:
+                    if os.path.exists(tmp_path):
+                        os.unlink(tmp_path)
+                    raise
+                os.replace(tmp_path, local_path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def get_version(paths: Iterable[Text]) -> Text:
+    """
+    Key of the current content of all paths, which changes whenever any of
+    them is overwritten. Only fetches the blob metadata.
+    """
+    keys = []
+    for path in paths:
+        if path.startswith('gs://'):
+            keys.append(_content_key(*split_gcs_path(path)))
+        else:
+            stat = os.stat(path)
+            keys.append(f'{stat.st_mtime_ns}-{stat.st_size}')
+    return hashlib.md5('|'.join(keys).encode()).hexdigest()
+
+
+def get_predictor_class(path: Text, entrypoint: Text,
+                        module_name: Text = 'user_module'):
+    # Local paths are used as is, e.g. for benchmarks
+    if not path.startswith('gs://'):
+        return import_class_from_source(path, entrypoint, module_name)
 
     # Download predictor
-    with NamedTemporaryFile(suffix='.py') as temp_file:
-        destination_file_name = temp_file.name
-        download_blob(bucket_name, source_blob_name, destination_file_name)
+    destination_file_name = cached_download(path)
+
+    # Load class
+    return import_class_from_source(
+        destination_file_name, entrypoint, module_name)
+
+
+def get_artifacts(artifacts: Dict[Text, Text]) -> Dict[Text, Text]:
+    """Resolves a predictor's `artifacts` (name to gs:// path) into local
+    paths, going through the cache."""
+    return {name: cached_download(path) for name, path in artifacts.items()}
 
-        # Load class
-        return import_class_from_source(destination_file_name, entrypoint)
+
+def create_predictor(path: Text, entrypoint: Text,
+                     module_name: Text = 'user_module') -> Any:
+    """Imports, instantiates and loads a predictor, with its declared
+    artifacts fetched through the cache."""
+    predictor = get_predictor_class(path, entrypoint, module_name)()
+    predictor.artifact_paths = get_artifacts(
+        getattr(predictor, 'artifacts', {}))
+    predictor.load()
+    return predictor
+
+
+def has_predict_batch(predictor: Any) -> bool:
+    """Whether the predictor implements `predict_batch`, rather than
+    inheriting the one of BasePredictor, which runs `predict` per request."""
+    method = getattr(type(predictor), 'predict_batch', None)
+    if method is None:
+        return False
+    try:
+        from budgetml.basepredictor import BasePredictor
+    except ImportError:
+        return True
+    return method is not BasePredictor.predict_batch
@@ -1,20 +1,48 @@
+import asyncio
+import gc
 import logging
+import math
 import os
+import time
 import traceback
-from typing import Type, Optional, Any
+from typing import Type, Optional, Any, Tuple, Union
 
 import uvicorn
-from fastapi import Depends, FastAPI, File, UploadFile, HTTPException
+from fastapi import APIRouter, Depends, FastAPI, File, UploadFile, \
+    HTTPException
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.cors import CORSMiddleware
 from starlette.requests import Request
-from starlette.responses import Response
-from starlette.status import HTTP_401_UNAUTHORIZED
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.status import HTTP_401_UNAUTHORIZED, \
+    HTTP_429_TOO_MANY_REQUESTS, HTTP_503_SERVICE_UNAVAILABLE
 
-from load import get_predictor_class
+from auth import Authenticator, RateLimitError, create_authenticator
+from batching import Batcher
+from cache import MISSING, LRUCache, SharedCache, cache_key
+from encoding import EncodedRoute, encode_response, is_stream, \
+    release_after, stream_response
+from executor import PredictExecutor, QueueFullError
+from inference import SOCKET_PATH, RemoteExecutor, RemotePredictor
+from load import get_artifacts, get_predictor_class, get_version, \
+    has_predict_batch
+from metrics import AUTH_REJECTIONS, RELOADS, RESPONSE_CACHE, \
+    WORKERS_READY, MetricsMiddleware, load_summary, metrics_response, \
+    observe_first_chunk, observe_predict, ready_workers, refresh_request_rate
 from models import Payload
+from registry import ModelLoadError, ModelRegistry, get_available_mb, \
+    parse_models
+from signing import SIGNATURE_HEADER, TIMESTAMP_HEADER, check_signature
+from timeline import get_timeline, mark
+from uploads import StreamingUpload
+from warmup import get_warmup_requests, run_warmup
+
+mark('server_started')
 
 app = FastAPI()
+# Adds orjson, msgpack and .npy support to request parsing
+app.router.route_class = EncodedRoute
 
 origins = ["*"]
 
@@ -25,42 +53,122 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 # globals
 PREDICTOR: Optional[Any] = None
+BATCHER: Optional[Batcher] = None
+RATE_TASK: Optional[asyncio.Task] = None
+WARMUP_TASK: Optional[asyncio.Task] = None
+WATCH_TASK: Optional[asyncio.Task] = None
+# content version of the predictor source and artifacts, see watch_predictor
+PREDICTOR_VERSION: Optional[str] = None
+READY = False
+EXECUTOR: Optional[Union[PredictExecutor, RemoteExecutor]] = None
+CACHE: Optional[Union[LRUCache, SharedCache]] = None
+REGISTRY: Optional[ModelRegistry] = None
 USERS_DB = {}
+AUTH: Optional[Authenticator] = None
+
+# executor
+EXECUTOR_KIND = os.getenv('BUDGET_EXECUTOR', 'thread')
+EXECUTOR_WORKERS = int(os.getenv('BUDGET_EXECUTOR_WORKERS', '1'))
+EXECUTOR_QUEUE = int(os.getenv('BUDGET_EXECUTOR_QUEUE', '64'))
+PREDICT_BLOCKING = os.getenv('BUDGET_PREDICT_BLOCKING', '0') == '1'
+
+# inference workers shared by all HTTP workers, see inference.py
+INFERENCE_WORKERS = int(os.getenv('BUDGET_INFERENCE_WORKERS', '0'))
+
+# preload
+PRELOAD = os.getenv('BUDGET_PRELOAD', '0') == '1'
+
+# uploads
+STREAM_UPLOADS = os.getenv('BUDGET_STREAM_UPLOADS', '0') == '1'
+MAX_UPLOAD_BYTES = int(os.getenv('BUDGET_MAX_UPLOAD_BYTES', '0'))
+
+# response cache
+RESPONSE_CACHE_SIZE = int(os.getenv('BUDGET_RESPONSE_CACHE_SIZE', '1024'))
+RESPONSE_CACHE_TTL = float(os.getenv('BUDGET_RESPONSE_CACHE_TTL', '300'))
+RESPONSE_CACHE_SHARED = os.getenv('BUDGET_RESPONSE_CACHE_SHARED', '0') == '1'
+
+# batching
+MAX_BATCH_SIZE = int(os.getenv('BUDGET_MAX_BATCH_SIZE', '1'))
+MAX_BATCH_WAIT_MS = float(os.getenv('BUDGET_MAX_BATCH_WAIT_MS', '5'))
+
+# models served under /models/{name}/, as `name=path:Entrypoint,...`
+MODELS = parse_models(os.getenv('BUDGET_MODELS', ''))
+# per worker, defaults to most of the memory available at startup
+MODELS_MEMORY_MB = os.getenv('BUDGET_MODELS_MEMORY_MB')
+MODELS_MAX_LOADED = int(os.getenv('BUDGET_MODELS_MAX_LOADED', '0'))
+
+# warmup
+WARMUP = os.getenv('BUDGET_WARMUP', '1') == '1'
+# Set by gunicorn_conf.py
+WORKERS = int(os.getenv('BUDGET_WORKERS', '1'))
 
-# auth
+# hot reload
+RELOAD_INTERVAL = float(os.getenv('BUDGET_RELOAD_INTERVAL', '60'))
+RELOAD_DRAIN_TIMEOUT = float(os.getenv('BUDGET_RELOAD_DRAIN_TIMEOUT', '60'))
+# written by /admin/reload, watched by all workers
+RELOAD_TRIGGER_PATH = os.getenv(
+    'BUDGET_RELOAD_TRIGGER', '/dev/shm/budgetml_reload')
+
+# auth, keys of BUDGET_API_KEYS and BUDGET_TOKEN, see auth.py
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
-async def verify(token: str = Depends(oauth2_scheme)):
-    try:
-        if token == os.getenv('BUDGET_TOKEN'):
-            return token
-        raise Exception
-    except Exception as e:
+async def verify(request: Request, token: str = Depends(oauth2_scheme)):
+    # checked once per request, PredictRoute may have checked it already
+    key = request.scope.get('budget.api_key')
+    if key is not None:
+        return key
+    key = AUTH.authenticate(token)
+    if key is None:
+        AUTH_REJECTIONS.labels('', 'invalid').inc()
         raise HTTPException(
             status_code=HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials with error {}".format(
-                str(e)),
+            detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    try:
+        AUTH.check(key, time.time())
+    except RateLimitError as e:
+        AUTH_REJECTIONS.labels(key.name, e.reason).inc()
+        raise HTTPException(
+            status_code=HTTP_429_TOO_MANY_REQUESTS, detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))})
+    request.scope['budget.api_key'] = key
+    return key
 
 
-@app.on_event("startup")
-async def startup_event():
-    global PREDICTOR
-    global USERS_DB
+async def authenticate(request: Request):
+    await verify(request, await oauth2_scheme(request))
+
+
+class PredictRoute(EncodedRoute):
+    # Large .npy bodies are read into shared memory, only once the request
+    # is authenticated, see encoding.py
+    authenticate = staticmethod(authenticate)
+
+
+# routes taking a Payload
+predict_routes = APIRouter(route_class=PredictRoute)
 
-    # Setting auth creds
-    USERS_DB = {
-        'username': os.environ['BUDGET_USERNAME'],
-        'password': os.environ['BUDGET_PWD'],
-    }
 
+def load_predictor(boot: bool = True) -> Tuple[Optional[Any],
+                                                Optional[str]]:
+    """
+    :param boot: record the phases in the boot timeline, i.e. not when
+    reloading.
+    :return: the predictor and its version, taken before it is loaded, so
+    that a later upload is a new version. Either may be None.
+    """
+    version = None
     try:
         PREDICTOR_CLASS_PATH = os.getenv('BUDGET_PREDICTOR_PATH')
+        if PREDICTOR_CLASS_PATH is None and MODELS:
+            # only serves the models of the registry
+            return None, None
         assert PREDICTOR_CLASS_PATH is not None
 
         ENV_PREDICTOR_ENTRYPOINT = os.getenv('BUDGET_PREDICTOR_ENTRYPOINT',
@@ -68,11 +176,351 @@ async def startup_event():
         # Load predictor
         predictor_class: Type[Any] = get_predictor_class(
             PREDICTOR_CLASS_PATH, ENV_PREDICTOR_ENTRYPOINT)
-        PREDICTOR = predictor_class()
-        PREDICTOR.load()
+        if boot:
+            mark('predictor_downloaded')
+        try:
+            version = get_predictor_version(predictor_class)
+        except Exception as e:
+            logging.warning(f'Could not get the predictor version: {str(e)}')
+        predictor = predictor_class()
+        # Fetch declared model artifacts through the local cache
+        predictor.artifact_paths = get_artifacts(
+            getattr(predictor, 'artifacts', {}))
+        if boot:
+            mark('artifacts_downloaded')
+        predictor.load()
+        if boot:
+            mark('predictor_loaded')
+        return predictor, version
     except Exception as e:
         logging.debug(f"Predictor class could not be loaded with: {str(e)}")
         traceback.print_exc()
+        return None, version
+
+
+# With gunicorn's preload_app, this module is imported once in the master and
+# the loaded predictor is shared copy-on-write with all forked workers.
+if PRELOAD and not INFERENCE_WORKERS:
+    PREDICTOR, PREDICTOR_VERSION = load_predictor()
+    # Move everything allocated so far out of the gc's reach, so that
+    # collections in the workers do not write to (and thereby copy) the
+    # shared pages.
+    gc.collect()
+    gc.freeze()
+
+
+def create_executor(predictor: Any) -> PredictExecutor:
+    # Synchronous predictor methods are always run in the executor, async
+    # ones only if the predictor is declared blocking
+    return PredictExecutor(
+        predictor,
+        kind=EXECUTOR_KIND,
+        max_workers=EXECUTOR_WORKERS,
+        max_queue=EXECUTOR_QUEUE,
+        offload_async=PREDICT_BLOCKING,
+    )
+
+
+def configure_predictor(cacheable: bool, batchable: bool):
+    global CACHE
+    global BATCHER
+
+    # Caching is opt-in per predictor, as only deterministic ones qualify
+    if cacheable and RESPONSE_CACHE_SIZE > 0:
+        if RESPONSE_CACHE_SHARED:
+            CACHE = SharedCache(
+                max_size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+        else:
+            CACHE = LRUCache(
+                max_size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+
+    # Batching is opt-in and only possible if the predictor supports it
+    if MAX_BATCH_SIZE > 1:
+        if batchable:
+            BATCHER = Batcher(
+                lambda requests: EXECUTOR('predict_batch', requests),
+                MAX_BATCH_SIZE, MAX_BATCH_WAIT_MS)
+            BATCHER.start()
+        else:
+            logging.warning(
+                "BUDGET_MAX_BATCH_SIZE is set but the predictor does not "
+                "implement predict_batch. Batching is disabled.")
+
+
+def set_ready():
+    global READY
+    READY = True
+    WORKERS_READY.set(1)
+    mark('ready')
+
+
+async def warm_up_predictor(predictor: Any,
+                            executor: PredictExecutor) -> Optional[float]:
+    """Sends the predictor's sample requests through it.
+
+    :return: the seconds it took, None if there was nothing to warm up.
+    """
+    requests = get_warmup_requests(predictor)
+    if not WARMUP or not (requests or hasattr(predictor, 'warmup')):
+        return None
+    start = time.perf_counter()
+    # Every process of a process pool holds its own copy of the model
+    calls = EXECUTOR_WORKERS if EXECUTOR_KIND == 'process' else 1
+    batch_size = MAX_BATCH_SIZE if BATCHER is not None else 0
+    await asyncio.gather(*[
+        run_warmup(predictor, executor, requests, batch_size)
+        for _ in range(calls)])
+    return time.perf_counter() - start
+
+
+async def warm_up():
+    """Warms up the predictor, then reports this worker ready. Runs in the
+    background, so that the liveness check is answered meanwhile."""
+    try:
+        seconds = await warm_up_predictor(PREDICTOR, EXECUTOR)
+        if seconds is not None:
+            mark('warmed_up', seconds=round(seconds, 3))
+    except Exception:
+        # Still serves, only the first requests are slower
+        logging.exception('Warmup failed')
+    set_ready()
+
+
+async def connect_inference_workers():
+    """Waits for the first inference worker to be warmed up, then configures
+    this HTTP worker for its predictor and reports ready."""
+    while True:
+        try:
+            description = await EXECUTOR.describe()
+            break
+        except QueueFullError:
+            # not started yet, or all busy with other calls
+            await asyncio.sleep(1)
+        except Exception as e:
+            logging.warning(f'Inference workers could not be reached: '
+                            f'{str(e)}')
+            await asyncio.sleep(1)
+    PREDICTOR.cacheable = description['cacheable']
+    configure_predictor(description['cacheable'],
+                        description['predict_batch'])
+    set_ready()
+
+
+def get_predictor_version(predictor: Any = None) -> str:
+    """:param predictor: predictor or its class, the current one by
+    default."""
+    if predictor is None:
+        predictor = PREDICTOR
+    paths = [os.environ['BUDGET_PREDICTOR_PATH']] + list(
+        getattr(predictor, 'artifacts', {}).values())
+    return get_version(paths)
+
+
+async def reload_predictor(version: Optional[str] = None) -> bool:
+    """
+    Loads the predictor again next to the current one and warms it up, then
+    swaps it in. The current one is retired once its calls in progress are
+    done, so that no request is dropped or sees a cold model.
+
+    :param version: version of the predictor, if it can not be taken while
+    loading it.
+    :return: whether the predictor was swapped.
+    """
+    global PREDICTOR
+    global EXECUTOR
+    global PREDICTOR_VERSION
+    start = time.perf_counter()
+    predictor, loaded_version = await run_in_threadpool(
+        load_predictor, False)
+    if predictor is None:
+        RELOADS.labels('failed').inc()
+        logging.error('Reloading the predictor failed, keeping the current '
+                      'one')
+        return False
+    executor = create_executor(predictor)
+    try:
+        await warm_up_predictor(predictor, executor)
+    except Exception:
+        logging.exception('Warmup of the reloaded predictor failed')
+
+    # Requests arriving from here on go to the new predictor, and its
+    # responses are cached under its version
+    previous, previous_executor = PREDICTOR, EXECUTOR
+    PREDICTOR, EXECUTOR = predictor, executor
+    PREDICTOR_VERSION = loaded_version or version
+    if not await previous_executor.drain(RELOAD_DRAIN_TIMEOUT):
+        logging.warning(f'{previous_executor.active} calls to the previous '
+                        f'predictor still running after '
+                        f'{RELOAD_DRAIN_TIMEOUT}s')
+    previous_executor.shutdown()
+    if hasattr(previous, 'unload'):
+        try:
+            previous.unload()
+        except Exception:
+            logging.exception('Unloading the previous predictor failed')
+    RELOADS.labels('success').inc()
+    logging.info(f'Reloaded the predictor in '
+                 f'{time.perf_counter() - start:.1f}s')
+    return True
+
+
+def read_reload_trigger() -> Optional[str]:
+    try:
+        with open(RELOAD_TRIGGER_PATH, 'r') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+async def watch_predictor():
+    """Reloads the predictor if its source or artifacts changed, checked
+    every RELOAD_INTERVAL seconds, and on request of /admin/reload to any
+    worker."""
+    trigger = read_reload_trigger()
+    checked = time.monotonic()
+    failed = None
+
+    while True:
+        await asyncio.sleep(1)
+        current = read_reload_trigger()
+        requested = current != trigger
+        trigger = current
+        if not requested and (RELOAD_INTERVAL <= 0 or
+                              time.monotonic() - checked < RELOAD_INTERVAL):
+            continue
+        checked = time.monotonic()
+        try:
+            version = await run_in_threadpool(get_predictor_version)
+        except Exception as e:
+            logging.warning(f'Could not check the predictor for changes '
+                            f'with: {str(e)}')
+            continue
+        # A version that failed to load is only retried on request
+        if requested or version not in (PREDICTOR_VERSION, failed):
+            if not await reload_predictor(version):
+                failed = version
+
+
+@app.on_event("startup")
+async def startup_event():
+    global PREDICTOR
+    global PREDICTOR_VERSION
+    global EXECUTOR
+    global USERS_DB
+    global RATE_TASK
+    global WARMUP_TASK
+    global WATCH_TASK
+    global REGISTRY
+    global AUTH
+
+    # Setting auth creds
+    USERS_DB = {
+        'username': os.environ['BUDGET_USERNAME'],
+        'password': os.environ['BUDGET_PWD'],
+    }
+    # The token is the one /token hands out
+    AUTH = create_authenticator(
+        os.getenv('BUDGET_API_KEYS', ''), os.getenv('BUDGET_TOKEN'))
+
+    if MODELS:
+        if MODELS_MEMORY_MB is not None:
+            memory_budget_mb = float(MODELS_MEMORY_MB)
+        else:
+            memory_budget_mb = 0.8 * get_available_mb() / WORKERS
+        REGISTRY = ModelRegistry(
+            MODELS,
+            create_executor,
+            memory_budget_mb=memory_budget_mb,
+            max_loaded=MODELS_MAX_LOADED,
+            warmup=WARMUP,
+        )
+
+    if INFERENCE_WORKERS:
+        # The model is only loaded by the inference workers
+        PREDICTOR = RemotePredictor()
+        EXECUTOR = RemoteExecutor(
+            max_pending=INFERENCE_WORKERS + EXECUTOR_QUEUE)
+        RATE_TASK = asyncio.ensure_future(refresh_request_rate())
+        mark('started')
+        WARMUP_TASK = asyncio.ensure_future(connect_inference_workers())
+        return
+
+    if not PRELOAD:
+        PREDICTOR, PREDICTOR_VERSION = load_predictor()
+    elif PREDICTOR is not None and hasattr(PREDICTOR, 'post_fork'):
+        # Re-create state that does not survive a fork (threads, sessions)
+        PREDICTOR.post_fork()
+
+    if PREDICTOR is None:
+        if REGISTRY is not None:
+            # models are loaded on first use, there is nothing to wait for
+            set_ready()
+        return
+
+    RATE_TASK = asyncio.ensure_future(refresh_request_rate())
+
+    EXECUTOR = create_executor(PREDICTOR)
+    configure_predictor(getattr(PREDICTOR, 'cacheable', False),
+                        has_predict_batch(PREDICTOR))
+
+    mark('started')
+    WARMUP_TASK = asyncio.ensure_future(warm_up())
+    WATCH_TASK = asyncio.ensure_future(watch_predictor())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if WARMUP_TASK is not None:
+        WARMUP_TASK.cancel()
+    if WATCH_TASK is not None:
+        WATCH_TASK.cancel()
+    if RATE_TASK is not None:
+        RATE_TASK.cancel()
+    if BATCHER is not None:
+        await BATCHER.stop()
+    if EXECUTOR is not None:
+        EXECUTOR.shutdown()
+    if REGISTRY is not None:
+        REGISTRY.shutdown()
+
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    # Shed load instead of letting the queue (and latency) grow unbounded
+    return JSONResponse(
+        status_code=HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": f"Server is busy: {str(exc)}"},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.exception_handler(ModelLoadError)
+async def model_load_error_handler(request: Request, exc: ModelLoadError):
+    return JSONResponse(
+        status_code=500,
+        content={"detail": f"{str(exc)}. Please check the logs for more "
+                           "detail."},
+    )
+
+
+def check_sendable(route: str):
+    """Live requests and streams can not be sent to inference workers."""
+    if INFERENCE_WORKERS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{route} is not available with inference workers, use "
+                   f"/predict_dict/, or /predict_image/ without "
+                   f"BUDGET_STREAM_UPLOADS")
+
+
+def respond(response: Any, request: Request, route: str) -> Response:
+    """Encodes a predictor result, streaming it if it is a generator."""
+    accept = request.headers.get('accept')
+    if is_stream(response):
+        chunks = observe_first_chunk(
+            response, route, request.scope.get('budget.start'))
+        return stream_response(chunks, accept)
+    return encode_response(response, accept)
 
 
 @app.get("/")
@@ -80,6 +528,44 @@ def health_check():
     return {"I'm": "Alive!"}
 
 
+@app.get("/ready")
+def readiness_check():
+    """Unlike `/`, only succeeds once all workers finished their warmup, to
+    take traffic."""
+    workers = ready_workers()
+    # gone while the inference process restarts, see gunicorn_conf.py
+    inference_up = not INFERENCE_WORKERS or os.path.exists(SOCKET_PATH)
+    if READY and inference_up and workers >= WORKERS:
+        return {'ready': True, 'workers': workers}
+    return JSONResponse(
+        status_code=HTTP_503_SERVICE_UNAVAILABLE,
+        content={'ready': False, 'workers': workers, 'expected': WORKERS},
+        headers={'Retry-After': '1'},
+    )
+
+
+@app.get("/metrics")
+def metrics(_: str = Depends(verify)):
+    return metrics_response()
+
+
+@app.get("/load")
+def load_status(_: str = Depends(verify)):
+    return load_summary()
+
+
+@app.get("/models")
+def list_models(_: str = Depends(verify)):
+    if REGISTRY is None:
+        return {}
+    return REGISTRY.status()
+
+
+@app.get("/boot_timeline")
+def boot_timeline(_: str = Depends(verify)):
+    return get_timeline()
+
+
 @app.post("/token")
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     global USERS_DB
@@ -93,6 +579,31 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
         status_code=401, detail="Incorrect username or password")
 
 
+@app.post("/admin/reload")
+async def request_reload(request: Request):
+    """Makes all workers reload the predictor, e.g. after a new version was
+    uploaded. Signed with the password, see signing.py."""
+    body = await request.body()
+    if not check_signature(USERS_DB['password'],
+                           request.headers.get(TIMESTAMP_HEADER),
+                           request.headers.get(SIGNATURE_HEADER), body):
+        raise HTTPException(
+            status_code=HTTP_401_UNAUTHORIZED, detail="Invalid signature")
+    if PREDICTOR is None or INFERENCE_WORKERS:
+        raise HTTPException(
+            status_code=409,
+            detail="No predictor is loaded to reload, or it runs in "
+                   "inference workers, which reload on restart")
+    try:
+        with open(RELOAD_TRIGGER_PATH, 'w') as f:
+            f.write(f'{time.time()} {os.getpid()}')
+    except OSError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Could not request the reload with: {str(e)}")
+    return {'reload': 'requested'}
+
+
 @app.post("/predict/")
 async def predict(request: Request,
                   _: str = Depends(verify)) -> Response:
@@ -103,30 +614,61 @@ async def predict(request: Request,
             detail="The predictor could not be loaded. Please check the logs "
                    "for more detail.",
         )
-    return await PREDICTOR.predict(request)
+    check_sendable('/predict/')
+    with observe_predict('/predict/'):
+        response = await EXECUTOR('predict', request)
+    return respond(response, request, '/predict/')
 
 
-@app.post("/predict_image/")
-async def predict_image(request: UploadFile = File(...),
-                        _: str = Depends(verify)) -> Response:
-    """
-    https://fastapi.tiangolo.com/tutorial/request-files/
+if STREAM_UPLOADS:
+    @app.post("/predict_image/")
+    async def predict_image(request: Request,
+                            _: str = Depends(verify)) -> Response:
+        """
+        Streaming variant: the predictor gets a StreamingUpload, which reads
+        the file from the connection chunk by chunk as it is consumed.
 
-    :param request:
-    :return:
-    """
-    global PREDICTOR
-    if PREDICTOR is None:
-        raise HTTPException(
-            status_code=500,
-            detail="The predictor could not be loaded. Please check the logs "
-                   "for more detail.",
-        )
-    return await PREDICTOR.predict(request)
+        :param request:
+        :return:
+        """
+        global PREDICTOR
+        if PREDICTOR is None:
+            raise HTTPException(
+                status_code=500,
+                detail="The predictor could not be loaded. Please check the "
+                       "logs for more detail.",
+            )
+        check_sendable('/predict_image/')
+        upload = StreamingUpload(request, MAX_UPLOAD_BYTES)
+        with observe_predict('/predict_image/'):
+            response = await EXECUTOR('predict', upload)
+        return respond(response, request, '/predict_image/')
+else:
+    @app.post("/predict_image/")
+    async def predict_image(http_request: Request,
+                            request: UploadFile = File(...),
+                            _: str = Depends(verify)) -> Response:
+        """
+        https://fastapi.tiangolo.com/tutorial/request-files/
 
+        :param request:
+        :return:
+        """
+        global PREDICTOR
+        if PREDICTOR is None:
+            raise HTTPException(
+                status_code=500,
+                detail="The predictor could not be loaded. Please check the "
+                       "logs for more detail.",
+            )
+        with observe_predict('/predict_image/'):
+            response = await EXECUTOR('predict', request)
+        return respond(response, http_request, '/predict_image/')
 
-@app.post("/predict_dict/")
-async def predict_dict(request: Payload,
+
+@predict_routes.post("/predict_dict/")
+async def predict_dict(http_request: Request,
+                       request: Payload,
                        _: str = Depends(verify)) -> Response:
     """
     Request is Payload type which has a dict.
@@ -141,7 +683,84 @@ async def predict_dict(request: Payload,
             detail="The predictor could not be loaded. Please check the logs "
                    "for more detail.",
         )
-    return await PREDICTOR.predict(request)
+    # may be set while this request is awaiting, see
+    # connect_inference_workers
+    cache = CACHE
+    if cache is not None:
+        # Responses of a previous version are not reused after a reload
+        key = f'{PREDICTOR_VERSION}:{cache_key(request.payload)}'
+        response = cache.get(key)
+        if response is not MISSING:
+            RESPONSE_CACHE.labels('hit').inc()
+            return respond(response, http_request, '/predict_dict/')
+        RESPONSE_CACHE.labels('miss').inc()
+
+    with observe_predict('/predict_dict/'):
+        if BATCHER is not None:
+            response = await BATCHER.submit(request)
+        else:
+            response = await EXECUTOR('predict', request)
+
+    # Response objects may hold streams or background tasks, so only plain
+    # values are cached
+    if cache is not None and not isinstance(response, Response) \
+            and not is_stream(response):
+        cache.set(key, response)
+    return respond(response, http_request, '/predict_dict/')
+
+
+async def predict_model(name: str, request: Any, http_request: Request,
+                        route: str) -> Response:
+    """Runs `predict` of a model of the registry, loading it if needed."""
+    if REGISTRY is None or name not in REGISTRY:
+        raise HTTPException(
+            status_code=404, detail=f"Model {name} not found")
+    async with REGISTRY.use(name) as model:
+        with observe_predict(route):
+            response = await model.executor('predict', request)
+        response = respond(response, http_request, route)
+        if isinstance(response, StreamingResponse):
+            # the predictor runs until the stream ends
+            response = release_after(response, REGISTRY.pin(model))
+    return response
+
+
+@app.post("/models/{name}/predict/")
+async def predict_with_model(name: str,
+                             request: Request,
+                             _: str = Depends(verify)) -> Response:
+    return await predict_model(
+        name, request, request, '/models/{name}/predict/')
+
+
+if STREAM_UPLOADS:
+    @app.post("/models/{name}/predict_image/")
+    async def predict_image_with_model(name: str,
+                                       request: Request,
+                                       _: str = Depends(verify)) -> Response:
+        upload = StreamingUpload(request, MAX_UPLOAD_BYTES)
+        return await predict_model(
+            name, upload, request, '/models/{name}/predict_image/')
+else:
+    @app.post("/models/{name}/predict_image/")
+    async def predict_image_with_model(name: str,
+                                       http_request: Request,
+                                       request: UploadFile = File(...),
+                                       _: str = Depends(verify)) -> Response:
+        return await predict_model(
+            name, request, http_request, '/models/{name}/predict_image/')
+
+
+@predict_routes.post("/models/{name}/predict_dict/")
+async def predict_dict_with_model(name: str,
+                                  http_request: Request,
+                                  request: Payload,
+                                  _: str = Depends(verify)) -> Response:
+    return await predict_model(
+        name, request, http_request, '/models/{name}/predict_dict/')
+
+
+app.include_router(predict_routes)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,243 @@
+import asyncio
+import inspect
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Text
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, \
+    Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess
+from starlette.concurrency import iterate_in_threadpool
+from starlette.responses import Response
+
+PREDICT_ROUTES = ('/predict/', '/predict_image/', '/predict_dict/',
+                  '/models/{name}/predict/', '/models/{name}/predict_image/',
+                  '/models/{name}/predict_dict/')
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .075, .1, .25, .5, .75, 1.0, 2.5,
+                   5.0, 7.5, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = tuple(4 ** i for i in range(4, 16))  # 256B to 256MB
+
+REQUESTS = Counter(
+    'budget_requests_total',
+    'Number of HTTP requests.',
+    ['method', 'route', 'status'])
+LATENCY = Histogram(
+    'budget_request_duration_seconds',
+    'End-to-end HTTP request latency.',
+    ['route'],
+    buckets=LATENCY_BUCKETS)
+IN_PROGRESS = Gauge(
+    'budget_requests_in_progress',
+    'Number of HTTP requests currently being served.',
+    ['route'],
+    multiprocess_mode='livesum')
+REQUEST_SIZE = Histogram(
+    'budget_request_size_bytes',
+    'Size of the HTTP request body, from Content-Length.',
+    ['route'],
+    buckets=SIZE_BUCKETS)
+PREDICT_LATENCY = Histogram(
+    'budget_predict_duration_seconds',
+    'Time spent in the predictor (including executor and batch queueing), '
+    'excluding framework overhead.',
+    ['route'],
+    buckets=LATENCY_BUCKETS)
+TIME_TO_FIRST_CHUNK = Histogram(
+    'budget_time_to_first_chunk_seconds',
+    'Time from receiving a request to sending the first chunk of a '
+    'streamed response.',
+    ['route'],
+    buckets=LATENCY_BUCKETS)
+RESPONSE_CACHE = Counter(
+    'budget_response_cache_total',
+    'Response cache lookups of /predict_dict/.',
+    ['result'])
+EXECUTOR_PENDING = Gauge(
+    'budget_executor_pending',
+    'Predictor calls running or waiting in the executor.',
+    multiprocess_mode='livesum')
+REQUEST_RATE = Gauge(
+    'budget_predict_requests_per_second',
+    'Requests to the predict routes per second, over the last minute.',
+    multiprocess_mode='livesum')
+MODELS_LOADED = Gauge(
+    'budget_models_loaded',
+    'Models of the registry currently loaded.',
+    multiprocess_mode='livesum')
+MODEL_EVENTS = Counter(
+    'budget_model_events_total',
+    'Loads and evictions of models of the registry.',
+    ['event'])
+RELOADS = Counter(
+    'budget_predictor_reloads_total',
+    'Hot reloads of the predictor.',
+    ['result'])
+AUTH_REJECTIONS = Counter(
+    'budget_auth_rejections_total',
+    'Requests rejected for an invalid API key or over its limits.',
+    ['key', 'reason'])
+WORKERS_READY = Gauge(
+    'budget_workers_ready',
+    'Server workers done with their startup and warmup.',
+    multiprocess_mode='livesum')
+
+
+class RateWindow:
+    def __init__(self, window: int = 60):
+        """Counts events per second over a sliding window."""
+        self.window = window
+        self.counts = deque()
+
+    def _expire(self, now: int):
+        while self.counts and self.counts[0][0] <= now - self.window:
+            self.counts.popleft()
+
+    def record(self):
+        now = int(time.time())
+        self._expire(now)
+        if self.counts and self.counts[-1][0] == now:
+            self.counts[-1][1] += 1
+        else:
+            self.counts.append([now, 1])
+
+    def rate(self) -> float:
+        self._expire(int(time.time()))
+        return sum(count for _, count in self.counts) / self.window
+
+
+PREDICT_RATE = RateWindow()
+
+
+async def refresh_request_rate(interval: float = 5):
+    """Keeps this worker's share of REQUEST_RATE current, also while it
+    receives no requests."""
+    while True:
+        REQUEST_RATE.set(PREDICT_RATE.rate())
+        await asyncio.sleep(interval)
+
+
+@contextmanager
+def observe_predict(route: Text):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PREDICT_LATENCY.labels(route).observe(time.perf_counter() - start)
+
+
+async def observe_first_chunk(chunks: Any,
+                              route: Text,
+                              start: Optional[float] = None
+                              ) -> AsyncIterator[Any]:
+    """Passes through a (sync or async) generator, recording the time to
+    its first chunk since `start`, or since now."""
+    if start is None:
+        start = time.perf_counter()
+    if not inspect.isasyncgen(chunks):
+        # Sync generators may block, so they are advanced in a thread
+        chunks = iterate_in_threadpool(chunks)
+    first = True
+    async for chunk in chunks:
+        if first:
+            TIME_TO_FIRST_CHUNK.labels(route).observe(
+                time.perf_counter() - start)
+            first = False
+        yield chunk
+
+
+def get_registry() -> CollectorRegistry:
+    """Under gunicorn the values of all workers are aggregated from the
+    shared PROMETHEUS_MULTIPROC_DIR."""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def metrics_response() -> Response:
+    """Renders all metrics."""
+    return Response(generate_latest(get_registry()),
+                    media_type=CONTENT_TYPE_LATEST)
+
+
+def load_summary() -> Dict[Text, float]:
+    """Current load of this instance over all workers, e.g. for the
+    autoscaler."""
+    totals = {'in_flight': 0., 'pending': 0., 'requests_per_second': 0.}
+    for metric in get_registry().collect():
+        for sample in metric.samples:
+            if sample.name == 'budget_requests_in_progress' and \
+                    sample.labels.get('route') in PREDICT_ROUTES:
+                totals['in_flight'] += sample.value
+            elif sample.name == 'budget_executor_pending':
+                totals['pending'] += sample.value
+            elif sample.name == 'budget_predict_requests_per_second':
+                totals['requests_per_second'] += sample.value
+    return totals
+
+
+def ready_workers() -> int:
+    """Number of workers of this instance that finished their warmup."""
+    for metric in get_registry().collect():
+        for sample in metric.samples:
+            if sample.name == 'budget_workers_ready':
+                return int(sample.value)
+    return 0
+
+
+class MetricsMiddleware:
+    def __init__(self, app, routes: Iterable[Text] = PREDICT_ROUTES):
+        """
+        ASGI middleware recording request count, latency, in-flight
+        requests and payload size.
+
+        :param app: the wrapped ASGI app.
+        :param routes: paths that get their own label. All other paths are
+        recorded as `other` to keep the number of time series bounded.
+        """
+        self.app = app
+        self.routes = set(routes)
+
+    def get_route(self, path: Text) -> Text:
+        if path.startswith('/models/'):
+            # one label for all models
+            path = '/models/{name}/' + path.split('/', 3)[-1]
+        return path if path in self.routes else 'other'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        route = self.get_route(scope['path'])
+        if route != 'other':
+            PREDICT_RATE.record()
+        headers = dict(scope['headers'])
+        if b'content-length' in headers:
+            try:
+                REQUEST_SIZE.labels(route).observe(
+                    int(headers[b'content-length']))
+            except ValueError:
+                # malformed, left to the route to reject
+                pass
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        IN_PROGRESS.labels(route).inc()
+        start = time.perf_counter()
+        scope['budget.start'] = start
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            LATENCY.labels(route).observe(time.perf_counter() - start)
+            IN_PROGRESS.labels(route).dec()
+            REQUESTS.labels(scope['method'], route, str(status)).inc()
@@ -0,0 +1,38 @@
+"""Files only the server's user can access, for state in world-writable
+places like /dev/shm or /tmp. Another user could otherwise create them
+beforehand, or a symlink in their place, and have the server read or write
+what they choose."""
+import os
+import stat
+from typing import Text
+
+
+def private_directory(path: Text):
+    """Creates a directory only the current user can access, or checks that
+    the existing one is, e.g. not created by another user beforehand."""
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() \
+            or st.st_mode & 0o077:
+        raise PermissionError(
+            f'{path} has to be a directory private to uid {os.getuid()}')
+
+
+def open_private(path: Text, flags: int = os.O_RDWR) -> int:
+    """Opens or creates a file readable and writable only by the current
+    user, in a directory made private first.
+
+    :return: the file descriptor.
+    """
+    private_directory(os.path.dirname(path))
+    fd = os.open(path, flags | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    st = os.fstat(fd)
+    if not stat.S_ISREG(st.st_mode) or st.st_uid != os.getuid() \
+            or st.st_mode & 0o077:
+        os.close(fd)
+        raise PermissionError(
+            f'{path} has to be a file private to uid {os.getuid()}')
+    return fd
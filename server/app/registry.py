@@ -0,0 +1,220 @@
+"""Registry of predictors served side by side by one server, each under
+`/models/{name}/`. Models are loaded on first use and the least recently used
+ones are evicted to stay within a memory budget."""
+import asyncio
+import gc
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Optional, Text, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from executor import PredictExecutor
+from load import create_predictor
+from metrics import MODEL_EVENTS, MODELS_LOADED
+from warmup import get_warmup_requests, run_warmup
+
+
+class ModelLoadError(Exception):
+    pass
+
+
+def parse_models(spec: Text) -> Dict[Text, Tuple[Text, Text]]:
+    """Parses `name=path:Entrypoint,...`, as set by `BudgetML.launch`, into
+    a mapping of name to path and entrypoint."""
+    models = {}
+    for entry in spec.split(','):
+        if not entry.strip():
+            continue
+        name, target = entry.split('=', 1)
+        path, entrypoint = target.rsplit(':', 1)
+        models[name.strip()] = (path.strip(), entrypoint.strip())
+    return models
+
+
+def get_rss_mb() -> float:
+    """Resident memory of this process."""
+    with open('/proc/self/statm', 'r') as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def get_available_mb() -> float:
+    with open('/proc/meminfo', 'r') as f:
+        for line in f:
+            if line.startswith('MemAvailable:'):
+                return int(line.split()[1]) / 2 ** 10
+    return 0.
+
+
+class LoadedModel:
+    def __init__(self,
+                 name: Text,
+                 predictor: Any,
+                 executor: PredictExecutor,
+                 memory_mb: float):
+        self.name = name
+        self.predictor = predictor
+        self.executor = executor
+        self.memory_mb = memory_mb
+        self.in_flight = 0
+        self.last_used = time.time()
+
+
+class ModelRegistry:
+    def __init__(self,
+                 models: Dict[Text, Tuple[Text, Text]],
+                 create_executor: Callable[[Any], PredictExecutor],
+                 memory_budget_mb: float = 0,
+                 max_loaded: int = 0,
+                 warmup: bool = True):
+        """
+        :param models: name to predictor path (gs:// or local) and
+        entrypoint.
+        :param create_executor: creates the executor of a loaded predictor.
+        :param memory_budget_mb: memory the loaded models of this worker may
+        take, as measured while loading them. 0 for no limit.
+        :param max_loaded: maximum number of loaded models, 0 for no limit.
+        :param warmup: run the warmup of a model after loading it, before
+        it serves the request that caused the load.
+        """
+        self.models = models
+        self.create_executor = create_executor
+        self.memory_budget_mb = memory_budget_mb
+        self.max_loaded = max_loaded
+        self.warmup = warmup
+        # least recently used first
+        self.loaded: Dict[Text, LoadedModel] = OrderedDict()
+        # memory measured at the last load, to make room before a reload
+        self.memory_mb: Dict[Text, float] = {}
+        self.locks: Dict[Text, asyncio.Lock] = {}
+
+    def __contains__(self, name: Text) -> bool:
+        return name in self.models
+
+    @asynccontextmanager
+    async def use(self, name: Text):
+        """Yields the loaded model, loading it first if needed. It is not
+        evicted while in use."""
+        model = self.loaded.get(name)
+        if model is None:
+            lock = self.locks.setdefault(name, asyncio.Lock())
+            async with lock:
+                # loaded by a concurrent request while waiting
+                model = self.loaded.get(name)
+                if model is None:
+                    model = await self.load(name)
+        self.loaded.move_to_end(name)
+        model.last_used = time.time()
+        model.in_flight += 1
+        try:
+            yield model
+        finally:
+            model.in_flight -= 1
+
+    def pin(self, model: LoadedModel) -> Callable[[], None]:
+        """Keeps the model from being evicted beyond `use`, e.g. while a
+        streamed response still runs its predictor, until the returned
+        function is called. Calling it again has no effect."""
+        model.in_flight += 1
+        pinned = [True]
+
+        def unpin():
+            if pinned[0]:
+                pinned[0] = False
+                model.in_flight -= 1
+
+        return unpin
+
+    async def load(self, name: Text) -> LoadedModel:
+        path, entrypoint = self.models[name]
+        self.evict(self.memory_mb.get(name, 0.), adding=True)
+
+        start = time.perf_counter()
+        rss = get_rss_mb()
+        try:
+            # Each model gets its own module, as they may share file names
+            predictor = await run_in_threadpool(
+                create_predictor, path, entrypoint,
+                f'budget_model_{name}')
+        except Exception as e:
+            MODEL_EVENTS.labels('load_failed').inc()
+            logging.exception(f'Model {name} could not be loaded')
+            raise ModelLoadError(
+                f'Model {name} could not be loaded with: {str(e)}')
+        # approximate, as other models may allocate at the same time
+        memory_mb = max(get_rss_mb() - rss, 0.)
+        self.memory_mb[name] = memory_mb
+
+        model = LoadedModel(
+            name, predictor, self.create_executor(predictor), memory_mb)
+        requests = get_warmup_requests(predictor)
+        if self.warmup and (requests or hasattr(predictor, 'warmup')):
+            try:
+                await run_warmup(predictor, model.executor, requests)
+            except Exception:
+                logging.exception(f'Warmup of model {name} failed')
+
+        self.loaded[name] = model
+        # the new model may have been larger than expected
+        self.evict(0., keep=name)
+        MODEL_EVENTS.labels('load').inc()
+        MODELS_LOADED.set(len(self.loaded))
+        logging.info(f'Loaded model {name} ({memory_mb:.0f} MB) in '
+                     f'{time.perf_counter() - start:.1f}s')
+        return model
+
+    def over_budget(self, needed_mb: float = 0., adding: bool = False):
+        if self.max_loaded and \
+                len(self.loaded) + int(adding) > self.max_loaded:
+            return True
+        memory_mb = sum(m.memory_mb for m in self.loaded.values())
+        return bool(self.memory_budget_mb) and \
+            memory_mb + needed_mb > self.memory_budget_mb
+
+    def evict(self, needed_mb: float = 0., adding: bool = False,
+              keep: Optional[Text] = None):
+        """Unloads the least recently used idle models until `needed_mb`
+        more (and another model, if `adding`) fit into the budget."""
+        for name in list(self.loaded):
+            if not self.over_budget(needed_mb, adding):
+                return
+            if name != keep and not self.loaded[name].in_flight:
+                self.unload(name)
+        if self.over_budget(needed_mb, adding):
+            logging.warning('Models in use exceed the memory budget of '
+                            f'{self.memory_budget_mb:.0f} MB')
+
+    def unload(self, name: Text):
+        model = self.loaded.pop(name)
+        model.executor.shutdown()
+        if hasattr(model.predictor, 'unload'):
+            try:
+                model.predictor.unload()
+            except Exception:
+                logging.exception(f'Unloading model {name} failed')
+        del model
+        gc.collect()
+        MODEL_EVENTS.labels('evict').inc()
+        MODELS_LOADED.set(len(self.loaded))
+        logging.info(f'Evicted model {name}')
+
+    def shutdown(self):
+        for name in list(self.loaded):
+            self.unload(name)
+
+    def status(self) -> Dict[Text, Dict]:
+        status = {}
+        for name in self.models:
+            model = self.loaded.get(name)
+            status[name] = {
+                'loaded': model is not None,
+                'memory_mb': round(self.memory_mb[name], 1)
+                if name in self.memory_mb else None,
+                'in_flight': model.in_flight if model else 0,
+                'last_used': model.last_used if model else None,
+            }
+        return status
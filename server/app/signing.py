@@ -0,0 +1,40 @@
+"""Signatures of admin requests: an HMAC-SHA256 of a timestamp and the
+request body, keyed with the password. Clients only get the API token, so
+it does not allow admin actions.
+
+There is no nonce: a captured request can be replayed for as long as its
+timestamp is within `max_age` (300 seconds) of the server's clock, and is
+rejected after that. Only use signatures for requests that can safely be
+repeated, like a reload of the uploaded predictor."""
+import hashlib
+import hmac
+import time
+from typing import Optional, Text
+
+TIMESTAMP_HEADER = 'X-Budget-Timestamp'
+SIGNATURE_HEADER = 'X-Budget-Signature'
+
+
+def sign(key: Text, timestamp: Text, body: bytes) -> Text:
+    return hmac.new(key.encode(), timestamp.encode() + b'.' + body,
+                    hashlib.sha256).hexdigest()
+
+
+def check_signature(key: Text,
+                    timestamp: Optional[Text],
+                    signature: Optional[Text],
+                    body: bytes,
+                    max_age: float = 300) -> bool:
+    """
+    :param max_age: seconds the timestamp may be off, in either direction.
+    """
+    if not timestamp or not signature:
+        return False
+    try:
+        age = abs(time.time() - float(timestamp))
+    except ValueError:
+        return False
+    if age > max_age:
+        return False
+    # constant time, to not leak the signature byte by byte
+    return hmac.compare_digest(sign(key, timestamp, body), signature)
@@ -0,0 +1,83 @@
+"""Boot timeline: timestamped phases of an instance (re)start.
+
+The startup and shutdown scripts of the instance and the server append one
+JSON line per phase to the same file, e.g.
+
+    {"phase": "docker_installed", "time": 1613488123.41, "source": "host"}
+
+so that the downtime after a preemption can be broken down by phase.
+"""
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Text
+
+TIMELINE_PATH = os.getenv('BUDGET_BOOT_TIMELINE')
+
+# Starts a new boot cycle in the timeline
+CYCLE_START_PHASES = ('shutdown', 'kernel_boot')
+
+
+def mark(phase: Text, **extra):
+    """Appends a phase, timestamped now, to the timeline."""
+    event = {'phase': phase, 'time': time.time(), 'source': 'server',
+             'pid': os.getpid(), **extra}
+    logging.info(f'Boot phase: {json.dumps(event)}')
+    if TIMELINE_PATH is None:
+        return
+    try:
+        # Lines below PIPE_BUF are appended atomically by all processes
+        with open(TIMELINE_PATH, 'a') as f:
+            f.write(json.dumps(event) + '\n')
+    except OSError as e:
+        logging.debug(f'Could not write boot timeline: {str(e)}')
+
+
+def read_events(path: Text = None) -> List[Dict]:
+    path = path or TIMELINE_PATH
+    if path is None or not os.path.exists(path):
+        return []
+    events = []
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                # e.g. a line cut off by a hard power off
+                continue
+    return sorted(events, key=lambda e: e['time'])
+
+
+def last_cycle(events: List[Dict]) -> List[Dict]:
+    """Events of the latest boot cycle, starting with the shutdown before
+    it if it was recorded."""
+    start = 0
+    for i, event in enumerate(events):
+        if event['phase'] == 'shutdown' or (
+                event['phase'] == 'kernel_boot' and
+                (i == 0 or events[i - 1]['phase'] != 'shutdown')):
+            start = i
+    return events[start:]
+
+
+def get_timeline(path: Text = None) -> Dict:
+    """
+    The latest boot cycle, with the time since its start and since the
+    previous phase for every phase.
+    """
+    events = last_cycle(read_events(path))
+    if not events:
+        return {'phases': [], 'total_seconds': None}
+    start = events[0]['time']
+    previous = start
+    phases = []
+    for event in events:
+        phases.append({
+            **event,
+            'elapsed_seconds': round(event['time'] - start, 3),
+            'seconds': round(event['time'] - previous, 3),
+        })
+        previous = event['time']
+    return {'phases': phases,
+            'total_seconds': round(events[-1]['time'] - start, 3)}
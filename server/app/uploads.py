@@ -0,0 +1,152 @@
+from typing import AsyncIterator, List, Optional, Text
+
+from fastapi import HTTPException
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import Request
+from starlette.status import HTTP_400_BAD_REQUEST, \
+    HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+
+class StreamingUpload:
+    def __init__(self, request: Request, max_bytes: int = 0):
+        """
+        Streams the file of an upload request to the predictor chunk by
+        chunk, instead of buffering all of it first. Accepts a multipart form
+        (the first part with a filename is used) or a raw request body.
+
+        Chunks are only read from the connection when the predictor asks for
+        them, so a slow predictor slows down the client instead of filling
+        up memory.
+
+        :param request: the incoming request.
+        :param max_bytes: maximum body size, 0 for no limit. Larger uploads
+        are rejected with a 413.
+        """
+        self.request = request
+        self.max_bytes = max_bytes
+        self.filename: Optional[Text] = None
+        self.content_type: Optional[Text] = None
+        self._chunks = self._file_chunks()
+        self._buffer = b''
+
+        length = request.headers.get('content-length')
+        if length is not None:
+            try:
+                length = int(length)
+            except ValueError:
+                raise HTTPException(
+                    status_code=HTTP_400_BAD_REQUEST,
+                    detail="Invalid Content-Length.")
+        if max_bytes and length is not None and length > max_bytes:
+            self._too_large()
+
+    def _too_large(self):
+        raise HTTPException(
+            status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Upload exceeds the limit of {self.max_bytes} bytes.",
+        )
+
+    async def _body(self) -> AsyncIterator[bytes]:
+        size = 0
+        async for chunk in self.request.stream():
+            size += len(chunk)
+            if self.max_bytes and size > self.max_bytes:
+                self._too_large()
+            if chunk:
+                yield chunk
+
+    async def _file_chunks(self) -> AsyncIterator[bytes]:
+        content_type, params = parse_options_header(
+            self.request.headers.get('content-type', ''))
+        if content_type != b'multipart/form-data':
+            self.content_type = content_type.decode() or None
+            async for chunk in self._body():
+                yield chunk
+            return
+        if not params.get(b'boundary'):
+            raise HTTPException(
+                status_code=HTTP_400_BAD_REQUEST,
+                detail="Multipart upload without a boundary.")
+
+        pending: List[bytes] = []
+        headers = {}
+        state = {'field': b'', 'value': b'', 'active': False, 'done': False}
+
+        def on_part_begin():
+            headers.clear()
+
+        def on_header_field(data, start, end):
+            state['field'] += data[start:end]
+
+        def on_header_value(data, start, end):
+            state['value'] += data[start:end]
+
+        def on_header_end():
+            headers[state['field'].lower()] = state['value']
+            state['field'] = state['value'] = b''
+
+        def on_headers_finished():
+            _, options = parse_options_header(
+                headers.get(b'content-disposition', b''))
+            if b'filename' in options and not state['done']:
+                state['active'] = True
+                self.filename = options[b'filename'].decode('latin-1')
+                self.content_type = headers.get(
+                    b'content-type', b'').decode() or None
+
+        def on_part_data(data, start, end):
+            if state['active']:
+                pending.append(bytes(data[start:end]))
+
+        def on_part_end():
+            if state['active']:
+                state['active'] = False
+                state['done'] = True
+
+        parser = MultipartParser(params[b'boundary'], {
+            'on_part_begin': on_part_begin,
+            'on_header_field': on_header_field,
+            'on_header_value': on_header_value,
+            'on_header_end': on_header_end,
+            'on_headers_finished': on_headers_finished,
+            'on_part_data': on_part_data,
+            'on_part_end': on_part_end,
+        })
+        try:
+            async for chunk in self._body():
+                parser.write(chunk)
+                while pending:
+                    yield pending.pop(0)
+                if state['done']:
+                    # The remaining parts are of no interest
+                    return
+            parser.finalize()
+        except MultipartParseError as e:
+            raise HTTPException(
+                status_code=HTTP_400_BAD_REQUEST,
+                detail=f"Invalid multipart upload: {str(e)}")
+
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        return self.chunks()
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Yields the file content chunk by chunk."""
+        if self._buffer:
+            buffer, self._buffer = self._buffer, b''
+            yield buffer
+        async for chunk in self._chunks:
+            yield chunk
+
+    async def read(self, size: int = -1) -> bytes:
+        """Same as UploadFile.read, so that existing predictors keep
+        working. Reading everything at once buffers the whole file."""
+        if size < 0:
+            return b''.join([chunk async for chunk in self.chunks()])
+        while len(self._buffer) < size:
+            try:
+                self._buffer += await self._chunks.__anext__()
+            except StopAsyncIteration:
+                break
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
@@ -0,0 +1,43 @@
+"""Warmup of a predictor with its sample requests before it takes traffic,
+see `BasePredictor.warmup`."""
+import inspect
+from typing import Any, List
+
+from starlette.concurrency import iterate_in_threadpool
+
+from executor import PredictExecutor
+from models import Payload
+
+
+async def drain(response: Any):
+    """Runs a streamed response to its end, as the chunks are only
+    computed when consumed."""
+    if inspect.isasyncgen(response):
+        async for _ in response:
+            pass
+    elif inspect.isgenerator(response):
+        async for _ in iterate_in_threadpool(response):
+            pass
+
+
+def get_warmup_requests(predictor: Any) -> List[Payload]:
+    return [Payload(payload=payload) for payload in
+            getattr(predictor, 'warmup_payloads', [])]
+
+
+async def run_warmup(predictor: Any,
+                     executor: PredictExecutor,
+                     requests: List[Payload],
+                     batch_size: int = 0):
+    """
+    :param batch_size: size of the batches of `predict_batch`, if the
+    server batches requests.
+    """
+    if hasattr(predictor, 'warmup'):
+        await executor('warmup', requests)
+    else:
+        for request in requests:
+            await drain(await executor('predict', request))
+    # Batched requests take a different path through the model
+    if batch_size > 1 and requests:
+        await executor('predict_batch', requests[:batch_size])
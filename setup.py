@@ -31,7 +31,9 @@ setup(
     long_description_content_type='text/markdown',
     packages=find_packages(
         exclude=["*.tests", "*.tests.*", "tests.*", "tests", "examples",
-                 "docs"]),
+                 "docs"]) + ["budgetml.server"],
+    # The server app, run by `budgetml bench` without a source checkout
+    package_dir={"budgetml.server": "server/app"},
     version=version,
     install_requires=[
         "google-api-python-client==1.12.8",
@@ -39,7 +41,23 @@ setup(
         "docker==4.4.1",
         "google-cloud-scheduler==2.1.0",
         "google-cloud-pubsub==2.2.0",
+        "requests~=2.25.1",
     ],
+    extras_require={
+        # the server's own requirements, see server/requirements.txt
+        "bench": [
+            "fastapi==0.65.2",
+            "uvicorn==0.13.2",
+            "python-multipart==0.0.5",
+            "aiofiles==0.4.0",
+            "prometheus-client==0.10.1",
+            "orjson==3.5.3",
+            "msgpack==1.0.2",
+        ],
+    },
+    entry_points={
+        'console_scripts': ['budgetml=budgetml.cli:main'],
+    },
     python_requires=">=3.6, <3.9.0",
     license='Apache License 2.0',  # noqa
     author='ebhy Inc.',
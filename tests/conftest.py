@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# budgetml from the checkout, and the server modules, which import each
+# other by their flat names, as when run from server/app
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'server', 'app'))
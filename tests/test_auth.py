@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from auth import ApiKey, LimitStore, RateLimitError, create_authenticator, \
+    hash_key, parse_api_keys
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'limits' / 'rate_limits')
+
+
+def test_parse_api_keys():
+    digest = hash_key('secret')
+    keys = parse_api_keys(f'app={digest}:2:4:100, batch={digest}::')
+    assert [(k.name, k.rate, k.burst, k.quota, k.slot) for k in keys] == [
+        ('app', 2., 4., 100, 0), ('batch', 0., 1., 0, 1)]
+    with pytest.raises(ValueError):
+        parse_api_keys('app=tooshort')
+
+
+def test_authenticate(path):
+    auth = create_authenticator(
+        f'app={hash_key("app-key")}', token='token', path=path)
+    assert auth.authenticate('token').name == 'default'
+    assert auth.authenticate('app-key').name == 'app'
+    assert auth.authenticate('other') is None
+    assert auth.authenticate(None) is None
+
+
+def test_duplicate_keys(path):
+    digest = hash_key('key')
+    with pytest.raises(ValueError):
+        create_authenticator(f'a={digest},b={digest}', path=path)
+
+
+def test_rate_limit(path):
+    store = LimitStore(path, 1)
+    key = ApiKey('app', hash_key('key'), rate=1, burst=2)
+    store.acquire(key, 100)
+    store.acquire(key, 100)
+    with pytest.raises(RateLimitError) as e:
+        store.acquire(key, 100)
+    assert e.value.reason == 'rate_limit'
+    assert e.value.retry_after == pytest.approx(1)
+    # refilled
+    store.acquire(key, 101)
+
+
+def test_quota(path):
+    store = LimitStore(path, 1, quota_period=60)
+    key = ApiKey('app', hash_key('key'), quota=2)
+    store.acquire(key, 0)
+    store.acquire(key, 1)
+    with pytest.raises(RateLimitError) as e:
+        store.acquire(key, 30)
+    assert e.value.reason == 'quota'
+    assert e.value.retry_after == pytest.approx(30)
+    # next period
+    store.acquire(key, 60)
+
+
+def test_limits_are_shared_through_the_file(path):
+    key = ApiKey('app', hash_key('key'), rate=1, burst=1)
+    LimitStore(path, 1).acquire(key, 100)
+    with pytest.raises(RateLimitError):
+        LimitStore(path, 1).acquire(key, 100)
+
+
+def test_keys_have_separate_slots(path):
+    store = LimitStore(path, 2)
+    first = ApiKey('a', hash_key('a'), rate=1, burst=1, slot=0)
+    second = ApiKey('b', hash_key('b'), rate=1, burst=1, slot=1)
+    store.acquire(first, 100)
+    store.acquire(second, 100)
+
+
+def test_file_is_private(path):
+    LimitStore(path, 1).acquire(ApiKey('a', hash_key('a'), rate=1), 100)
+    assert os.stat(os.path.dirname(path)).st_mode & 0o777 == 0o700
+    assert os.stat(path).st_mode & 0o777 == 0o600
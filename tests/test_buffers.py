@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from buffers import GRANULARITY, BufferPool, remove_buffers
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = BufferPool(max_idle=2, directory=str(tmp_path))
+    yield pool
+    pool.close()
+
+
+def test_acquire_rounds_up(pool):
+    buffer = pool.acquire(GRANULARITY + 1)
+    assert buffer.size == 2 * GRANULARITY
+
+
+def test_released_buffer_is_reused(pool):
+    buffer = pool.acquire(GRANULARITY)
+    pool.release(buffer)
+    assert pool.acquire(GRANULARITY // 2) is buffer
+
+
+def test_much_larger_buffer_is_not_reused(pool):
+    buffer = pool.acquire(8 * GRANULARITY)
+    pool.release(buffer)
+    assert pool.acquire(GRANULARITY) is not buffer
+
+
+def test_referenced_buffer_is_reused_once_free(pool):
+    buffer = pool.acquire(GRANULARITY)
+    array = buffer.view(0, np.float32, (16, 16))
+    pool.release(buffer)
+    assert pool.acquire(GRANULARITY) is not buffer
+    del array
+    assert pool.acquire(GRANULARITY) is buffer
+
+
+def test_find(pool):
+    buffer = pool.acquire(GRANULARITY)
+    array = buffer.view(128, np.float64, (4, 8), fortran_order=True)
+    assert pool.find(array) == (buffer, 128)
+    assert pool.find(np.zeros(4)) is None
+    # not contiguous
+    assert pool.find(array[::2]) is None
+    pool.release(buffer)
+    del array
+
+
+def test_idle_buffers_are_trimmed(pool, tmp_path):
+    buffers = [pool.acquire(GRANULARITY) for _ in range(3)]
+    for buffer in buffers:
+        pool.release(buffer)
+    assert len(pool.idle) == 2
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_remove_buffers(tmp_path):
+    pool = BufferPool(directory=str(tmp_path))
+    pool.acquire(GRANULARITY)
+    remove_buffers(directory=str(tmp_path))
+    assert not list(tmp_path.iterdir())
+    pool.close()
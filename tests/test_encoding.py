@@ -0,0 +1,51 @@
+import io
+import json
+
+import msgpack
+import numpy as np
+
+from encoding import JSON, MSGPACK, NPY, decode_body, encode_response, \
+    negotiate
+
+
+def test_negotiate():
+    assert negotiate(None) == JSON
+    assert negotiate('*/*') == JSON
+    assert negotiate('application/msgpack') == MSGPACK
+    assert negotiate('application/x-msgpack; q=1') == MSGPACK
+    assert negotiate('text/html, application/x-npy') == NPY
+    assert negotiate('text/html, application/json, application/msgpack') \
+        == JSON
+
+
+def test_decode_json():
+    assert decode_body(b'{"payload": {"a": 1}}', JSON) == \
+        {'payload': {'a': 1}}
+    # unknown media types are read as JSON
+    assert decode_body(b'[1, 2]', 'text/plain') == [1, 2]
+
+
+def test_decode_msgpack_with_arrays():
+    array = np.arange(6, dtype=np.float32).reshape(2, 3)
+    body = msgpack.packb({'payload': {'array': {
+        '__ndarray__': array.tobytes(), 'dtype': array.dtype.str,
+        'shape': list(array.shape)}}})
+    decoded = decode_body(body, MSGPACK)['payload']['array']
+    np.testing.assert_array_equal(decoded, array)
+
+
+def test_decode_npy():
+    array = np.arange(12, dtype=np.int16).reshape(3, 4)
+    f = io.BytesIO()
+    np.save(f, array)
+    decoded = decode_body(f.getvalue(), NPY)
+    np.testing.assert_array_equal(decoded['payload']['array'], array)
+
+
+def test_encode_round_trip():
+    content = {'label': 'cat', 'score': 0.5}
+    response = encode_response(content, 'application/msgpack')
+    assert response.media_type == MSGPACK
+    assert msgpack.unpackb(response.body) == content
+    response = encode_response(content, None)
+    assert json.loads(response.body) == content
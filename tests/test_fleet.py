@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+from budgetml import fleet
+from budgetml.fleet import RateLimiter, retry
+
+
+def test_rate_limiter_allows_burst_then_waits():
+    limiter = RateLimiter(rate=20, burst=2)
+    start = time.monotonic()
+    for _ in range(4):
+        limiter.acquire()
+    # two at once, then one every 50ms
+    assert time.monotonic() - start >= 0.09
+
+
+def test_retry_transient_errors(monkeypatch):
+    monkeypatch.setattr(fleet.time, 'sleep', lambda seconds: None)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError('reset')
+        return 'ok'
+
+    assert retry(fn, retries=3) == ('ok', 3)
+
+
+def test_retry_gives_up(monkeypatch):
+    monkeypatch.setattr(fleet.time, 'sleep', lambda seconds: None)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise TimeoutError()
+
+    with pytest.raises(TimeoutError):
+        retry(fn, retries=2)
+    assert len(calls) == 3
+
+
+def test_retry_does_not_retry_other_errors():
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise ValueError('invalid')
+
+    with pytest.raises(ValueError):
+        retry(fn)
+    assert len(calls) == 1
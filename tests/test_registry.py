@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from executor import PredictExecutor
+from registry import ModelLoadError, ModelRegistry
+
+SOURCE = '''
+class Predictor:
+    def load(self):
+        pass
+
+    def predict(self, request):
+        return NAME
+'''
+
+
+@pytest.fixture
+def models(tmp_path):
+    models = {}
+    for name in ('a', 'b', 'c'):
+        path = tmp_path / f'{name}.py'
+        path.write_text(f'NAME = {name!r}\n' + SOURCE)
+        models[name] = (str(path), 'Predictor')
+    return models
+
+
+def create_registry(models, **kwargs):
+    return ModelRegistry(models, PredictExecutor, warmup=False, **kwargs)
+
+
+def test_models_are_loaded_on_first_use(models):
+    registry = create_registry(models)
+
+    async def run():
+        async with registry.use('a') as model:
+            return await model.executor('predict', None)
+
+    assert asyncio.run(run()) == 'a'
+    assert list(registry.loaded) == ['a']
+    assert registry.status()['a']['loaded']
+    assert not registry.status()['b']['loaded']
+    registry.shutdown()
+
+
+def test_least_recently_used_model_is_evicted(models):
+    registry = create_registry(models, max_loaded=2)
+
+    async def run():
+        for name in ('a', 'b', 'a', 'c'):
+            async with registry.use(name):
+                pass
+
+    asyncio.run(run())
+    assert list(registry.loaded) == ['a', 'c']
+    registry.shutdown()
+
+
+def test_models_in_use_are_not_evicted(models):
+    registry = create_registry(models, max_loaded=1)
+
+    async def run():
+        async with registry.use('a'):
+            async with registry.use('b'):
+                pass
+            assert 'a' in registry.loaded
+
+    asyncio.run(run())
+    registry.shutdown()
+
+
+def test_pinned_model_is_not_evicted(models):
+    registry = create_registry(models, max_loaded=1)
+
+    async def run():
+        async with registry.use('a') as model:
+            unpin = registry.pin(model)
+        async with registry.use('b'):
+            pass
+        assert 'a' in registry.loaded
+        unpin()
+        unpin()
+        assert model.in_flight == 0
+        async with registry.use('c'):
+            pass
+        assert 'a' not in registry.loaded
+
+    asyncio.run(run())
+    registry.shutdown()
+
+
+def test_load_error(tmp_path):
+    path = tmp_path / 'broken.py'
+    path.write_text('raise RuntimeError("broken")\n')
+    registry = create_registry({'broken': (str(path), 'Predictor')})
+
+    async def run():
+        async with registry.use('broken'):
+            pass
+
+    with pytest.raises(ModelLoadError):
+        asyncio.run(run())
@@ -0,0 +1,33 @@
+import time
+
+from budgetml.signing import SIGNATURE_HEADER, TIMESTAMP_HEADER, \
+    get_signature_headers, sign
+from signing import check_signature
+
+
+def check(headers, key='password', body=b'{}', **kwargs):
+    return check_signature(key, headers[TIMESTAMP_HEADER],
+                           headers[SIGNATURE_HEADER], body, **kwargs)
+
+
+def test_valid_signature():
+    assert check(get_signature_headers('password', b'{}'))
+
+
+def test_wrong_key_or_body():
+    headers = get_signature_headers('password', b'{}')
+    assert not check(headers, key='other')
+    assert not check(headers, body=b'{"a": 1}')
+
+
+def test_timestamp_out_of_window():
+    for offset in (-301, 301):
+        timestamp = str(time.time() + offset)
+        assert not check({TIMESTAMP_HEADER: timestamp,
+                          SIGNATURE_HEADER: sign('password', timestamp,
+                                                 b'{}')})
+
+
+def test_missing_or_malformed_headers():
+    assert not check_signature('password', None, 'abc', b'')
+    assert not check_signature('password', 'now', 'abc', b'')
@@ -0,0 +1,61 @@
+import threading
+import time
+
+import pytest
+
+from budgetml.steps import Step, StepError, run_steps
+
+
+def test_results_are_passed_to_dependents():
+    results, timings = run_steps([
+        Step('a', lambda: 1),
+        Step('b', lambda a: a + 1, depends_on=['a']),
+        Step('c', lambda a, b: a + b, depends_on=['a', 'b']),
+    ])
+    assert results == {'a': 1, 'b': 2, 'c': 3}
+    assert set(timings) == {'a', 'b', 'c'}
+
+
+def test_independent_steps_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+    results, _ = run_steps([
+        Step('a', lambda: barrier.wait()),
+        Step('b', lambda: barrier.wait()),
+    ])
+    assert set(results) == {'a', 'b'}
+
+
+def test_failure_stops_scheduling():
+    started = []
+
+    def fail():
+        raise RuntimeError('boom')
+
+    def slow():
+        time.sleep(0.1)
+        started.append('slow')
+
+    with pytest.raises(StepError) as e:
+        run_steps([
+            Step('fail', fail),
+            Step('slow', slow),
+            Step('after', lambda fail: started.append('after'),
+                 depends_on=['fail']),
+        ])
+    assert e.value.step == 'fail'
+    assert isinstance(e.value.error, RuntimeError)
+    # steps in flight finish, dependents never start
+    assert started == ['slow']
+
+
+def test_unknown_dependency():
+    with pytest.raises(ValueError):
+        run_steps([Step('a', lambda b: b, depends_on=['b'])])
+
+
+def test_circular_dependencies():
+    with pytest.raises(ValueError):
+        run_steps([
+            Step('a', lambda b: b, depends_on=['b']),
+            Step('b', lambda a: a, depends_on=['a']),
+        ])